@@ -7,6 +7,7 @@
 """
 from jtrade.models.dto import TradeAccountDto
 from jtrade.core.trade_context import get_context
+import threading
 import logging
 
 
@@ -16,6 +17,8 @@ class Account(object):
         self.acc_dto: TradeAccountDto = self.__init_account(account_name)
         self.account_name = self.acc_dto.account_name
         self.logger = logging.getLogger("account")
+        # 多只股票的交易引擎在不同线程中共用同一账户时，余额的检查和修改需要串行
+        self.lock = threading.RLock()
 
     @staticmethod
     def __init_account(account_name: str):
@@ -25,6 +28,12 @@ class Account(object):
             raise Exception("Account not found: {}".format(account_name))
         return acc
 
+    def reload(self):
+        """
+        从数据库重新加载账户（事务回滚后恢复内存中的余额）
+        """
+        self.acc_dto = self.__init_account(self.account_name)
+
     def check_balance_enough(self, amount: float):
         return self.acc_dto.account_balance >= amount
 
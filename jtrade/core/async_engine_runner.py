@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: async_engine_runner
+@author: jkguo
+@create: 2024/10/24
+"""
+import asyncio
+import typing
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from jtrade.core.trade_engine import TradeEngine
+
+
+class AsyncTradeEngineRunner(object):
+    """
+    在一个 asyncio 事件循环中运行多只股票的交易引擎
+    - 实时数据按股票代码分发到每只股票自己的有界队列，每只股票一个消费协程，保证同一股票按顺序处理
+    - engine.on_rt_data 中阻塞的数据库、富途调用放到有界线程池中执行，不同股票之间并发
+    - 所有引擎共用进程内的数据库连接池和富途行情连接池
+    """
+
+    def __init__(self, max_workers: int = 8, queue_size: int = 256):
+        """
+        :param max_workers: 执行引擎的线程数
+        :param queue_size: 每只股票积压的实时数据上限
+        """
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.engines: typing.Dict[str, TradeEngine] = {}
+        self.queues: typing.Dict[str, asyncio.Queue] = {}
+        self.executor: typing.Optional[ThreadPoolExecutor] = None
+        self.loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: typing.List[asyncio.Task] = []
+        self.processed_count = 0
+        self.dropped_count = 0
+        self.error_count = 0
+        self.logger = logging.getLogger("async_engine_runner")
+
+    def add_engine(self, engine: TradeEngine):
+        """
+        添加交易引擎，需要在 start 之前调用
+        """
+        if engine.stock_code in self.engines:
+            raise Exception(f"engine for {engine.stock_code} already added")
+        self.engines[engine.stock_code] = engine
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="trade_engine")
+        for stock_code, engine in self.engines.items():
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self.queues[stock_code] = queue
+            self._tasks.append(asyncio.create_task(self._consume(engine, queue), name=f"engine_{stock_code}"))
+        self.logger.info(f"async trade engine runner started. engines {len(self.engines)} workers {self.max_workers}")
+
+    async def stop(self, drain: bool = True):
+        """
+        :param drain: 是否等待已入队的数据处理完
+        """
+        if drain:
+            await self.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.queues = {}
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.logger.info(f"async trade engine runner stopped. processed {self.processed_count}"
+                         f" dropped {self.dropped_count} errors {self.error_count}")
+
+    async def join(self):
+        """
+        等待所有已入队的数据处理完
+        """
+        await asyncio.gather(*[queue.join() for queue in self.queues.values()])
+
+    async def submit(self, cur_data: dict):
+        """
+        提交实时数据，队列满时等待（背压）
+        """
+        queue = self.queues.get(cur_data["code"])
+        if queue is None:
+            return
+        await queue.put(cur_data)
+
+    def submit_nowait(self, cur_data: dict) -> bool:
+        """
+        在事件循环线程中提交实时数据，队列满时丢弃
+        :return: 是否入队
+        """
+        queue = self.queues.get(cur_data["code"])
+        if queue is None:
+            return False
+        try:
+            queue.put_nowait(cur_data)
+            return True
+        except asyncio.QueueFull:
+            self.dropped_count += 1
+            return False
+
+    def submit_threadsafe(self, cur_data: dict):
+        """
+        从其他线程（如富途推送回调、RtDataService）提交实时数据
+        """
+        self.loop.call_soon_threadsafe(self.submit_nowait, cur_data)
+
+    async def _consume(self, engine: TradeEngine, queue: asyncio.Queue):
+        while True:
+            cur_data = await queue.get()
+            try:
+                await self.loop.run_in_executor(self.executor, engine.on_rt_data, cur_data)
+                self.processed_count += 1
+            except Exception as e:
+                self.error_count += 1
+                self.logger.exception(f"engine {engine.stock_code} on_rt_data {cur_data.get('time')} failed: {e}")
+            finally:
+                queue.task_done()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: engine_shard_supervisor
+@author: jkguo
+@create: 2024/10/24
+"""
+import os
+import time
+import queue
+import typing
+import logging
+import multiprocessing
+from jtrade.utils.consistent_hash import ConsistentHashRing
+
+# 工作进程回传的消息类型
+MSG_DECISIONS = "decisions"
+MSG_ERROR = "error"
+MSG_METRICS = "metrics"
+
+
+def _shard_worker_main(worker_id: int, stock_codes: typing.List[str],
+                       engine_factory: typing.Callable[[str], typing.Any],
+                       worker_init: typing.Optional[typing.Callable[[], None]],
+                       conn, result_queue):
+    """
+    工作进程： 创建分到的股票的交易引擎，逐条处理管道中的 (实时数据, 账户状态快照)，
+    只生成交易决策（不执行），每条数据回传一次决策或错误，退出时回传统计；
+    初始化或创建引擎失败时回传 stock_code 为空的错误和统计后退出
+    """
+    metrics = {
+        "worker_id": worker_id,
+        "pid": os.getpid(),
+        "stocks": 0,
+        "processed": 0,
+        "errors": 0,
+        "decisions": 0,
+        "busy_seconds": 0.0
+    }
+    try:
+        if worker_init is not None:
+            worker_init()
+        engines = {code: engine_factory(code) for code in stock_codes}
+    except Exception as e:
+        metrics["errors"] += 1
+        result_queue.put((MSG_ERROR, worker_id, None, None, repr(e)))
+        result_queue.put((MSG_METRICS, worker_id, None, None, metrics))
+        return
+    metrics["stocks"] = len(engines)
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        for cur_data, account_state in msg:
+            start_time = time.perf_counter()
+            try:
+                decisions = engines[cur_data["code"]].gen_decisions(cur_data, account_state) or []
+                metrics["decisions"] += len(decisions)
+                result_queue.put((MSG_DECISIONS, worker_id, cur_data["code"], cur_data.get("time"), decisions))
+            except Exception as e:
+                metrics["errors"] += 1
+                result_queue.put((MSG_ERROR, worker_id, cur_data["code"], cur_data.get("time"), repr(e)))
+            metrics["processed"] += 1
+            metrics["busy_seconds"] += time.perf_counter() - start_time
+    result_queue.put((MSG_METRICS, worker_id, None, None, metrics))
+
+
+class EngineShardSupervisor(object):
+    """
+    交易引擎多进程分片
+    按股票代码一致性哈希把股票分配到 num_workers 个工作进程，每个进程内运行分到的股票的交易引擎，
+    实时数据通过管道发送到对应进程，交易决策、错误和统计通过结果队列汇总回来。
+    工作进程只生成决策（CPU 密集的策略计算），账户只在主进程中有一份：
+    发送实时数据时附带主进程引擎的账户状态快照（可用资金、持股），collect 收到决策后由主进程的引擎执行。
+    submit / collect 异步使用时，快照不包含尚未 collect 的决策；process_batch 按轮发送（每轮每只股票最多一条），
+    执行完一轮的决策后再发送下一轮，每条数据看到的都是之前所有决策执行后的状态。
+    工作进程初始化失败时 process_batch 抛出异常，不等待超时。
+    engine_factory / worker_init 在工作进程中调用（需要可 pickle，如模块级函数），
+    worker_init 一般负责 init_context 等进程内初始化。
+    """
+
+    def __init__(self, stock_codes: typing.List[str], engine_factory: typing.Callable[[str], typing.Any],
+                 num_workers: typing.Optional[int] = None,
+                 worker_init: typing.Optional[typing.Callable[[], None]] = None, mp_start_method: str = "spawn",
+                 executor_factory: typing.Optional[typing.Callable[[str], typing.Any]] = None):
+        """
+        :param stock_codes: 股票代码
+        :param engine_factory: stock_code -> TradeEngine，在工作进程中只用于生成决策
+        :param num_workers: 工作进程数，默认 CPU 核数
+        :param worker_init: 工作进程初始化函数
+        :param mp_start_method: multiprocessing 启动方式
+        :param executor_factory: stock_code -> TradeEngine，在主进程中提供账户状态快照并执行决策；
+            为空时工作进程使用自己的账户状态，决策只回传不执行
+        """
+        self.stock_codes = list(dict.fromkeys(stock_codes))
+        self.engine_factory = engine_factory
+        self.worker_init = worker_init
+        self.num_workers = max(1, min(num_workers or os.cpu_count() or 1, len(self.stock_codes)))
+        self.mp_context = multiprocessing.get_context(mp_start_method)
+        self.ring = ConsistentHashRing(range(self.num_workers))
+        self.assignment: typing.Dict[str, int] = {code: self.ring.get_node(code) for code in self.stock_codes}
+        self.processes: typing.List[multiprocessing.Process] = []
+        self._senders = []
+        self.result_queue = None
+        self.worker_metrics: typing.Dict[int, dict] = {}
+        self.executors = {code: executor_factory(code) for code in self.stock_codes} \
+            if executor_factory is not None else {}
+        # 已发送、尚未回传决策或错误的实时数据条数
+        self.pending = 0
+        # 初始化失败的工作进程 worker_id -> 错误
+        self.worker_errors: typing.Dict[int, str] = {}
+        self.logger = logging.getLogger("engine_shard_supervisor")
+
+    def start(self):
+        self.result_queue = self.mp_context.Queue()
+        for worker_id in range(self.num_workers):
+            codes = [code for code, wid in self.assignment.items() if wid == worker_id]
+            recv_conn, send_conn = self.mp_context.Pipe(duplex=False)
+            process = self.mp_context.Process(
+                target=_shard_worker_main,
+                args=(worker_id, codes, self.engine_factory, self.worker_init, recv_conn, self.result_queue),
+                name=f"engine_shard_{worker_id}",
+                daemon=True
+            )
+            process.start()
+            recv_conn.close()
+            self.processes.append(process)
+            self._senders.append(send_conn)
+            self.logger.info(f"start engine shard {worker_id} pid {process.pid} stocks {len(codes)}")
+
+    def submit(self, cur_data: dict):
+        """
+        发送一条实时数据到对应的工作进程
+        """
+        self._senders[self.assignment[cur_data["code"]]].send([self._with_account_state(cur_data)])
+        self.pending += 1
+
+    def submit_batch(self, data_list: typing.List[dict]):
+        """
+        批量发送实时数据（每个工作进程一次管道写入），同一股票保持列表中的顺序。
+        配置了 executor_factory 时每只股票最多一条（同一批的快照都是发送前的状态），多条时使用 process_batch
+        """
+        if len(self.executors) > 0 and len({cur_data["code"] for cur_data in data_list}) < len(data_list):
+            raise Exception("submit_batch accepts at most one data per stock with executors, use process_batch")
+        batches: typing.Dict[int, list] = {}
+        for cur_data in data_list:
+            batches.setdefault(self.assignment[cur_data["code"]], []).append(self._with_account_state(cur_data))
+        for worker_id, batch in batches.items():
+            self._senders[worker_id].send(batch)
+        self.pending += len(data_list)
+
+    def process_batch(self, data_list: typing.List[dict], timeout: float = 60) -> typing.List[tuple]:
+        """
+        发送一批实时数据，等待所有决策回传并在主进程执行后返回。
+        同一股票的多条数据分到不同轮次，前一轮的决策执行后再发送下一轮，保证快照包含之前的决策
+        :param timeout: 整批最长等待时间 s
+        :return: 同 collect
+        """
+        rounds: typing.List[typing.List[dict]] = []
+        counts: typing.Dict[str, int] = {}
+        for cur_data in data_list:
+            index = counts.get(cur_data["code"], 0)
+            counts[cur_data["code"]] = index + 1
+            if index == len(rounds):
+                rounds.append([])
+            rounds[index].append(cur_data)
+        results = []
+        deadline = time.time() + timeout
+        for round_data in rounds:
+            self._check_workers()
+            self.submit_batch(round_data)
+            while self.pending > 0:
+                if time.time() >= deadline:
+                    raise Exception(f"engine shards not respond, pending {self.pending}")
+                results.extend(self.collect(timeout=min(0.5, max(deadline - time.time(), 0.01))))
+                self._check_workers()
+        return results
+
+    def _check_workers(self):
+        """
+        工作进程初始化失败或意外退出时抛出异常
+        """
+        if len(self.worker_errors) > 0:
+            raise Exception(f"engine shards init failed: {self.worker_errors}")
+        for process in self.processes:
+            if not process.is_alive():
+                raise Exception(f"engine shard {process.name} exited, exit code {process.exitcode}")
+
+    def _with_account_state(self, cur_data: dict) -> tuple:
+        executor = self.executors.get(cur_data["code"])
+        return cur_data, executor.account_state() if executor is not None else None
+
+    def collect(self, timeout: float = 0) -> typing.List[tuple]:
+        """
+        取出工作进程回传的交易决策和错误，配置了 executor_factory 时按回传顺序在主进程中执行决策
+        :param timeout: 没有结果时最长等待时间 s
+        :return: [(msg_type, worker_id, stock_code, time, decisions / error)]，不包含空决策，
+            执行失败的决策记为 MSG_ERROR，工作进程初始化失败记为 stock_code 为空的 MSG_ERROR
+        """
+        results = []
+        try:
+            item = self.result_queue.get(timeout=timeout) if timeout > 0 else self.result_queue.get_nowait()
+            while True:
+                if item[0] == MSG_METRICS:
+                    self.worker_metrics[item[1]] = item[4]
+                elif item[2] is None:
+                    self.logger.error(f"engine shard {item[1]} init error: {item[4]}")
+                    self.worker_errors[item[1]] = item[4]
+                    results.append(item)
+                else:
+                    self.pending -= 1
+                    if item[0] == MSG_DECISIONS:
+                        item = self._execute(item)
+                    if item is not None:
+                        results.append(item)
+                item = self.result_queue.get_nowait()
+        except queue.Empty:
+            pass
+        return results
+
+    def _execute(self, item: tuple) -> typing.Optional[tuple]:
+        _, worker_id, stock_code, cur_time, decisions = item
+        if len(decisions) == 0:
+            return None
+        executor = self.executors.get(stock_code)
+        if executor is None:
+            return item
+        try:
+            executor.execute_decisions(decisions)
+        except Exception as e:
+            self.logger.exception(f"execute decisions error. code {stock_code} time {cur_time}")
+            return MSG_ERROR, worker_id, stock_code, cur_time, repr(e)
+        return item
+
+    def stop(self, timeout: float = 60) -> typing.List[tuple]:
+        """
+        通知工作进程处理完已发送的数据后退出，并收集剩余结果和统计
+        :return: 剩余的交易决策和错误
+        """
+        for sender in self._senders:
+            try:
+                sender.send(None)
+            except OSError:
+                # 工作进程已退出
+                pass
+            sender.close()
+        results = []
+        deadline = time.time() + timeout
+        while len(self.worker_metrics) < len(self.processes) and time.time() < deadline:
+            results.extend(self.collect(timeout=0.5))
+        for process in self.processes:
+            process.join(timeout=max(deadline - time.time(), 0.1))
+            if process.is_alive():
+                self.logger.error(f"engine shard {process.name} not exit, terminate")
+                process.terminate()
+        self.processes = []
+        self._senders = []
+        return results
+
+    def metrics(self) -> dict:
+        """
+        汇总工作进程统计（stop 之后完整）
+        """
+        total = {"processed": 0, "errors": 0, "decisions": 0, "busy_seconds": 0.0}
+        for m in self.worker_metrics.values():
+            for k in total:
+                total[k] += m[k]
+        total["workers"] = dict(self.worker_metrics)
+        return total
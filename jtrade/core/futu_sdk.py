@@ -5,18 +5,196 @@
 @author: jkguo
 @create: 2024/10/19
 """
+import collections
+import contextlib
+import threading
+import time
+import typing
 import pandas
 import pandas as pd
 from futu import OpenQuoteContext, KLType, RET_OK, TrdMarket, TrdEnv
 import logging
 
 
+class FutuQuoteContextPool(object):
+    """
+    富途行情连接池
+    维护有限数量的长连接 OpenQuoteContext，线程安全地借出/归还；
+    闲置超过 health_check_interval 的连接借出前做健康检查，异常的连接关闭后重建。
+    """
+
+    def __init__(self, context_factory: typing.Callable[[], OpenQuoteContext], max_size: int = 4,
+                 checkout_timeout: float = 30, health_check_interval: float = 60):
+        """
+        :param context_factory: 创建行情连接的函数
+        :param max_size: 最大连接数
+        :param checkout_timeout: 借出连接的最长等待时间 s
+        :param health_check_interval: 闲置多久后借出前需要做健康检查 s
+        """
+        self.context_factory = context_factory
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.logger = logging.getLogger("futu_sdk")
+        self._cond = threading.Condition()
+        # 空闲连接： (quote_ctx, 归还时间)
+        self._idle: typing.List[typing.Tuple[OpenQuoteContext, float]] = []
+        self._size = 0
+        self._closed = False
+
+    @contextlib.contextmanager
+    def checkout(self) -> typing.Iterator[OpenQuoteContext]:
+        """
+        借出一个行情连接，with 结束后自动归还
+        """
+        quote_ctx = self._acquire()
+        failed = False
+        try:
+            yield quote_ctx
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._release(quote_ctx, failed)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "max_size": self.max_size
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for quote_ctx, _ in idle:
+            self._close_context(quote_ctx)
+
+    def _acquire(self) -> OpenQuoteContext:
+        deadline = time.time() + self.checkout_timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise Exception("futu quote context pool closed")
+                if len(self._idle) > 0:
+                    quote_ctx, release_time = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    quote_ctx, release_time = None, None
+                    break
+                remain = deadline - time.time()
+                if remain <= 0:
+                    raise Exception(f"checkout futu quote context timeout. pool size {self._size}")
+                self._cond.wait(remain)
+        try:
+            if quote_ctx is None:
+                return self._create_context()
+            if time.time() - release_time >= self.health_check_interval and not self._is_healthy(quote_ctx):
+                self.logger.warning("futu quote context unhealthy, reconnect.")
+                self._close_context(quote_ctx)
+                return self._create_context()
+            return quote_ctx
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, quote_ctx: OpenQuoteContext, failed: bool):
+        if failed and not self._is_healthy(quote_ctx):
+            self.logger.warning("futu quote context broken, drop it.")
+            self._close_context(quote_ctx)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                close_it = True
+            else:
+                self._idle.append((quote_ctx, time.time()))
+                close_it = False
+            self._cond.notify()
+        if close_it:
+            self._close_context(quote_ctx)
+
+    def _create_context(self) -> OpenQuoteContext:
+        self.logger.info("create futu quote context.")
+        return self.context_factory()
+
+    def _is_healthy(self, quote_ctx: OpenQuoteContext) -> bool:
+        try:
+            ret, _ = quote_ctx.get_global_state()
+            return ret == RET_OK
+        except Exception as e:
+            self.logger.warning(f"futu quote context health check failed: {e}")
+            return False
+
+    def _close_context(self, quote_ctx: OpenQuoteContext):
+        try:
+            quote_ctx.close()
+        except Exception as e:
+            self.logger.warning(f"close futu quote context failed: {e}")
+
+
+class FutuRateLimiter(object):
+    """
+    滑动窗口限频： 任意 period 秒内最多 max_requests 次请求，超出时 acquire 阻塞等待
+    """
+
+    def __init__(self, max_requests: int, period: float):
+        self.max_requests = max_requests
+        self.period = period
+        self._lock = threading.Lock()
+        self._request_times: typing.Deque[float] = collections.deque()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while len(self._request_times) > 0 and self._request_times[0] <= now - self.period:
+                    self._request_times.popleft()
+                if len(self._request_times) < self.max_requests:
+                    self._request_times.append(now)
+                    return
+                wait_time = self._request_times[0] + self.period - now
+            time.sleep(wait_time)
+
+
 class FutuSdk:
+    # 富途历史K线接口限频： 30 秒内最多 60 次请求（每一页算一次）
+    KLINE_RATE_LIMIT = (60, 30)
+    # 历史K线每页最大条数
+    KLINE_PAGE_SIZE = 1000
 
-    def __init__(self, host='127.0.0.1', port=11111):
+    def __init__(self, host='127.0.0.1', port=11111, pool_size: int = 4,
+                 quote_ctx_factory: typing.Optional[typing.Callable[[], OpenQuoteContext]] = None):
+        """
+        :param host: OpenD host
+        :param port: OpenD port
+        :param pool_size: 行情长连接数量
+        :param quote_ctx_factory: 创建行情连接的函数，默认连接 host:port 的 OpenD（可替换为本地模拟的 OpenD）
+        """
         self.host = host
         self.port = port
         self.logger = logging.getLogger("futu_sdk")
+        if quote_ctx_factory is None:
+            quote_ctx_factory = self._new_quote_context
+        self.quote_ctx_pool = FutuQuoteContextPool(quote_ctx_factory, max_size=pool_size)
+        self.kline_rate_limiter = FutuRateLimiter(*self.KLINE_RATE_LIMIT)
+
+    def close(self):
+        self.quote_ctx_pool.close()
+
+    def _new_quote_context(self) -> OpenQuoteContext:
+        return OpenQuoteContext(host=self.host, port=self.port)
 
     def query_kline(self, stock_code: str, begin_time: str, end_time: str, k_line_type: str) -> pd.DataFrame:
         """
@@ -30,27 +208,43 @@ class FutuSdk:
         begin_date = begin_time[:10]
         end_date = end_time[:10]
         self.logger.info(f"start query_kline {stock_code} {begin_date} to {end_date}")
-        quote_ctx = OpenQuoteContext(host=self.host, port=self.port)  # 创建行情对象
-        ret, data, page_req_key = quote_ctx.request_history_kline(code=stock_code, start=begin_date, end=end_date,
-                                                                  ktype=k_line_type)
-        df_list = [data]
-        if ret != RET_OK:
-            self.logger.error(f"query_kline {stock_code} {begin_date} to {end_date} failed: {data}")
-            raise Exception(
-                f"query_kline {stock_code} {begin_date} to {end_date} failed: {data}"
-            )
-        while page_req_key is not None:  # 请求后面的所有结果
+        with self.quote_ctx_pool.checkout() as quote_ctx:
+            self.kline_rate_limiter.acquire()
             ret, data, page_req_key = quote_ctx.request_history_kline(code=stock_code, start=begin_date, end=end_date,
                                                                       ktype=k_line_type,
-                                                                      max_count=100,
-                                                                      page_req_key=page_req_key)  # 请求翻页后的数据
-            if ret == RET_OK:
-                df_list.append(data)
-            else:
+                                                                      max_count=self.KLINE_PAGE_SIZE)
+            df_list = [data]
+            if ret != RET_OK:
                 self.logger.error(f"query_kline {stock_code} {begin_date} to {end_date} failed: {data}")
                 raise Exception(
                     f"query_kline {stock_code} {begin_date} to {end_date} failed: {data}"
                 )
-        quote_ctx.close()  # 关闭对象，防止连接条数用尽
+            while page_req_key is not None:  # 请求后面的所有结果
+                self.kline_rate_limiter.acquire()
+                ret, data, page_req_key = quote_ctx.request_history_kline(code=stock_code, start=begin_date,
+                                                                          end=end_date,
+                                                                          ktype=k_line_type,
+                                                                          max_count=self.KLINE_PAGE_SIZE,
+                                                                          page_req_key=page_req_key)  # 请求翻页后的数据
+                if ret == RET_OK:
+                    df_list.append(data)
+                else:
+                    self.logger.error(f"query_kline {stock_code} {begin_date} to {end_date} failed: {data}")
+                    raise Exception(
+                        f"query_kline {stock_code} {begin_date} to {end_date} failed: {data}"
+                    )
         df = pd.concat(df_list, ignore_index=True)
         return df[(df['time_key'] >= begin_time) & (df['time_key'] <= end_time)]
+
+    def query_history_kline_quota(self) -> typing.Tuple[int, int, typing.Set[str]]:
+        """
+        查询历史K线额度（最近30天内请求过的股票不重复占用额度）
+        :return: (已用额度, 剩余额度, 最近30天请求过的股票代码)
+        """
+        with self.quote_ctx_pool.checkout() as quote_ctx:
+            ret, data = quote_ctx.get_history_kl_quota(get_detail=True)
+        if ret != RET_OK:
+            self.logger.error(f"query history kline quota failed: {data}")
+            raise Exception(f"query history kline quota failed: {data}")
+        used_quota, remain_quota, detail_list = data
+        return used_quota, remain_quota, {item["code"] for item in detail_list}
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: futu_trader
+@author: jkguo
+@create: 2024/10/25
+"""
+import threading
+import time
+import typing
+import logging
+import pandas as pd
+from futu import (OpenSecTradeContext, TradeOrderHandlerBase, TradeDealHandlerBase, OrderStatus, OrderType,
+                  ModifyOrderOp, TrdSide, TrdEnv, RET_OK, RET_ERROR)
+from jtrade.core.trader import StockTraderBase
+from jtrade.core.stock_manager import StockManager
+from jtrade.core.futu_sdk import FutuRateLimiter
+from jtrade.core.trade_context import get_context
+from jtrade.models.dto import DtoUtil, TradeAccountDto, TradeOrderDto, TradeOrderStatus
+from jtrade.utils.latency_stats import span, get_latency_registry
+
+
+class _OrderPushHandler(TradeOrderHandlerBase):
+    """
+    订单状态推送
+    """
+
+    def __init__(self, trader: "FutuTrader"):
+        super().__init__()
+        self.trader = trader
+
+    def on_recv_rsp(self, rsp_pb):
+        ret_code, data = super().on_recv_rsp(rsp_pb)
+        if ret_code != RET_OK:
+            self.trader.logger.error(f"order push error: {data}")
+            return RET_ERROR, data
+        self.on_push_data(data)
+        return RET_OK, data
+
+    def on_push_data(self, data: pd.DataFrame):
+        for row in data.to_dict('records'):
+            self.trader.on_order_push(row)
+
+
+class _DealPushHandler(TradeDealHandlerBase):
+    """
+    成交推送
+    """
+
+    def __init__(self, trader: "FutuTrader"):
+        super().__init__()
+        self.trader = trader
+
+    def on_recv_rsp(self, rsp_pb):
+        ret_code, data = super().on_recv_rsp(rsp_pb)
+        if ret_code != RET_OK:
+            self.trader.logger.error(f"deal push error: {data}")
+            return RET_ERROR, data
+        self.on_push_data(data)
+        return RET_OK, data
+
+    def on_push_data(self, data: pd.DataFrame):
+        for row in data.to_dict('records'):
+            self.trader.on_deal_push(row)
+
+
+class FutuTrader(StockTraderBase):
+    """
+    富途交易
+    维护一个长连接 OpenSecTradeContext，启动时解锁一次交易（真实环境），
+    订阅订单 / 成交推送，订单状态变化通过推送回调通知（order_listener 或注册的 StockManager），不轮询。
+    富途订单状态映射为 TradeOrderStatus：
+    - 已提交 / 等待提交 -> TRADING，部分成交 -> PART_TRADED，全部成交 -> ALL_TRADED
+    - 撤单、下单失败、超时等终止状态 -> CANCELLED，已有成交时 -> PART_CANCELLED
+    成交数量和成交均价记录在 ext_detail.dealt_qty / dealt_avg_price
+    """
+
+    # 富途下单 / 改单接口频率限制： 每 30 秒 15 次
+    ORDER_RATE_LIMIT = (15, 30)
+
+    STATUS_MAP = {
+        OrderStatus.UNSUBMITTED: TradeOrderStatus.TRADING,
+        OrderStatus.WAITING_SUBMIT: TradeOrderStatus.TRADING,
+        OrderStatus.SUBMITTING: TradeOrderStatus.TRADING,
+        OrderStatus.SUBMITTED: TradeOrderStatus.TRADING,
+        OrderStatus.CANCELLING_PART: TradeOrderStatus.PART_TRADED,
+        OrderStatus.CANCELLING_ALL: TradeOrderStatus.TRADING,
+        OrderStatus.FILLED_PART: TradeOrderStatus.PART_TRADED,
+        OrderStatus.FILLED_ALL: TradeOrderStatus.ALL_TRADED,
+        OrderStatus.CANCELLED_PART: TradeOrderStatus.CANCELLED,
+        OrderStatus.CANCELLED_ALL: TradeOrderStatus.CANCELLED,
+        OrderStatus.SUBMIT_FAILED: TradeOrderStatus.CANCELLED,
+        OrderStatus.FAILED: TradeOrderStatus.CANCELLED,
+        OrderStatus.TIMEOUT: TradeOrderStatus.CANCELLED,
+        OrderStatus.DISABLED: TradeOrderStatus.CANCELLED,
+        OrderStatus.DELETED: TradeOrderStatus.CANCELLED,
+        OrderStatus.FILL_CANCELLED: TradeOrderStatus.CANCELLED
+    }
+
+    FINAL_STATUS = (TradeOrderStatus.ALL_TRADED, TradeOrderStatus.CANCELLED, TradeOrderStatus.PART_CANCELLED)
+
+    def __init__(self, acc_dto: TradeAccountDto,
+                 trade_ctx_factory: typing.Optional[typing.Callable[[], OpenSecTradeContext]] = None,
+                 acc_id: int = 0, order_rate_limit: typing.Tuple[int, float] = ORDER_RATE_LIMIT):
+        """
+        :param acc_dto: 交易账户，trade_pwd 用于解锁交易
+        :param trade_ctx_factory: 创建交易连接的函数，默认按 TradeContext.futu_config 连接 OpenD
+                                  （离线测试使用 FakeSecTradeContext）
+        :param acc_id: 富途账户id，0 表示第一个账户
+        :param order_rate_limit: 下单 / 撤单限频 (次数, 秒)
+        """
+        self.acc_dto = acc_dto
+        self.trade_ctx_factory = trade_ctx_factory or self._default_trade_ctx
+        self.acc_id = acc_id
+        self.stock_managers: typing.Dict[str, StockManager] = {}
+        self.order_rate_limiter = FutuRateLimiter(*order_rate_limit)
+        self.logger = logging.getLogger("futu_trader")
+        self._trade_ctx: typing.Optional[OpenSecTradeContext] = None
+        self._lock = threading.RLock()
+        # order_id -> 订单
+        self._orders: typing.Dict[str, TradeOrderDto] = {}
+        # order_id -> 下单时间 ns
+        self._submit_ns: typing.Dict[str, int] = {}
+        # 下单接口返回前就收到的推送 order_id -> [(push_type, row)]
+        self._early_pushes: typing.Dict[str, list] = {}
+
+    def _default_trade_ctx(self) -> OpenSecTradeContext:
+        futu_config = get_context().futu_config
+        return OpenSecTradeContext(filter_trdmarket=self.acc_dto.trade_market,
+                                   host=futu_config.get("host", "127.0.0.1"),
+                                   port=futu_config.get("port", 11111))
+
+    def register_stock_manager(self, stock_manager: StockManager):
+        """
+        未设置 order_listener 时，订单状态变化直接通知对应股票的 StockManager
+        """
+        self.stock_managers[stock_manager.stock_code] = stock_manager
+
+    def start(self):
+        """
+        建立交易连接、订阅推送，真实环境下解锁交易
+        """
+        if self._trade_ctx is not None:
+            return
+        trade_ctx = self.trade_ctx_factory()
+        trade_ctx.set_handler(_OrderPushHandler(self))
+        trade_ctx.set_handler(_DealPushHandler(self))
+        if self.acc_dto.trade_env == TrdEnv.REAL:
+            ret, data = trade_ctx.unlock_trade(password=self.acc_dto.trade_pwd)
+            if ret != RET_OK:
+                trade_ctx.close()
+                raise Exception(f"unlock trade for {self.acc_dto.account_name} failed: {data}")
+            self.logger.info(f"unlock trade for {self.acc_dto.account_name} ok.")
+        self._trade_ctx = trade_ctx
+
+    def close(self):
+        if self._trade_ctx is not None:
+            self._trade_ctx.close()
+            self._trade_ctx = None
+
+    def open_position(self, order: TradeOrderDto):
+        """
+        开仓买入股票（限价单）
+        :param order:
+        :return: order_id
+        """
+        return self._place_order(order, TrdSide.BUY)
+
+    def close_position(self, order: TradeOrderDto):
+        """
+        平仓卖出股票（限价单）
+        :param order:
+        :return: order_id
+        """
+        return self._place_order(order, TrdSide.SELL)
+
+    def cancel_order(self, order: TradeOrderDto):
+        """
+        撤单，结果通过订单推送返回
+        :param order:
+        :return:
+        """
+        self.order_rate_limiter.acquire()
+        ret, data = self._trade_ctx.modify_order(ModifyOrderOp.CANCEL, order.order_id, 0, 0,
+                                                 trd_env=self.acc_dto.trade_env, acc_id=self.acc_id)
+        if ret != RET_OK:
+            raise Exception(f"cancel order {order.order_id} failed: {data}")
+
+    def _place_order(self, order: TradeOrderDto, trd_side: str) -> str:
+        if self._trade_ctx is None:
+            raise Exception("FutuTrader not started")
+        assert order.trade_side == trd_side
+        self.order_rate_limiter.acquire()
+        submit_ns = time.perf_counter_ns()
+        with span("futu_trader.place_order"):
+            ret, data = self._trade_ctx.place_order(
+                price=order.price, qty=order.quantity, code=order.stock_code, trd_side=trd_side,
+                order_type=OrderType.NORMAL, trd_env=self.acc_dto.trade_env, acc_id=self.acc_id,
+                remark=order.stock_holding_id
+            )
+        if ret != RET_OK:
+            raise Exception(f"place order {order.stock_code} {trd_side} {order.quantity} * {order.price} failed: {data}")
+        order_id = str(data["order_id"].iloc[0])
+        with self._lock:
+            order.order_id = order_id
+            order.order_status = TradeOrderStatus.TRADING
+            self._orders[order_id] = order
+            self._submit_ns[order_id] = submit_ns
+            early_pushes = self._early_pushes.pop(order_id, [])
+        for push_handler, row in early_pushes:
+            push_handler(row)
+        return order_id
+
+    def on_order_push(self, row: dict):
+        """
+        订单推送（推送线程）
+        """
+        order_id = str(row["order_id"])
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None:
+                self._early_pushes.setdefault(order_id, []).append((self.on_order_push, row))
+                return
+            new_status = self.STATUS_MAP.get(row["order_status"])
+            if new_status is None or new_status == order.order_status or order.order_status in self.FINAL_STATUS:
+                return
+            # 订单推送中的成交数量是累计值，可能落后于成交推送；终止状态以订单推送为准（成交可能被撤销）
+            dealt_qty = int(row.get("dealt_qty") or 0)
+            if dealt_qty > dict(order.ext_detail or {}).get("dealt_qty", 0) or \
+                    (new_status in self.FINAL_STATUS and "dealt_qty" in row):
+                self._record_dealt(order, float(row.get("dealt_avg_price") or 0), dealt_qty)
+            if new_status == TradeOrderStatus.CANCELLED and dict(order.ext_detail or {}).get("dealt_qty", 0) > 0:
+                # 部分成交后撤单（或成交被撤销后仍有成交），已成交部分需要按持有 / 卖出结算
+                new_status = TradeOrderStatus.PART_CANCELLED
+            order.order_status = new_status
+            if new_status in self.FINAL_STATUS:
+                order.complete_time = str(row.get("updated_time") or "")[:19]
+            # 锁内复制，通知携带本次推送后的状态，不受后续推送修改影响
+            snapshot = DtoUtil.clone(order)
+        self._notify(snapshot)
+
+    def on_deal_push(self, row: dict):
+        """
+        成交推送（推送线程），成交推送可能先于订单推送到达，累计成交数量达到委托数量时即认为全部成交
+        """
+        order_id = str(row["order_id"])
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None:
+                self._early_pushes.setdefault(order_id, []).append((self.on_deal_push, row))
+                return
+            if order.order_status in self.FINAL_STATUS:
+                return
+            deals = dict(order.ext_detail or {}).get("deals", [])
+            if any(deal["deal_id"] == str(row["deal_id"]) for deal in deals):
+                return
+            deals = deals + [{"deal_id": str(row["deal_id"]), "qty": int(row["qty"]), "price": float(row["price"]),
+                              "time": str(row.get("create_time") or "")[:19]}]
+            order.ext_detail = dict(order.ext_detail or {})
+            order.ext_detail["deals"] = deals
+            dealt_qty = sum(deal["qty"] for deal in deals)
+            dealt_avg_price = sum(deal["qty"] * deal["price"] for deal in deals) / dealt_qty
+            self._record_dealt(order, dealt_avg_price, dealt_qty)
+            if dealt_qty >= order.quantity:
+                order.order_status = TradeOrderStatus.ALL_TRADED
+                order.complete_time = deals[-1]["time"]
+            else:
+                order.order_status = TradeOrderStatus.PART_TRADED
+            snapshot = DtoUtil.clone(order)
+        self._notify(snapshot)
+
+    @staticmethod
+    def _record_dealt(order: TradeOrderDto, dealt_avg_price: float, dealt_qty: int):
+        """
+        记录成交数量和成交均价；订单的价格、金额和费用保持下单时（冻结资金）的值，
+        由 StockManager 按成交均价结算与冻结金额的差额
+        """
+        order.ext_detail = dict(order.ext_detail or {})
+        order.ext_detail["dealt_qty"] = dealt_qty
+        order.ext_detail["dealt_avg_price"] = dealt_avg_price
+
+    def _notify(self, order: TradeOrderDto):
+        """
+        通知订单状态变化
+        :param order: 推送处理时在锁内复制的订单快照
+        """
+        if order.order_status in self.FINAL_STATUS:
+            with self._lock:
+                self._orders.pop(order.order_id, None)
+                submit_ns = self._submit_ns.pop(order.order_id, None)
+            if submit_ns is not None:
+                get_latency_registry().record(f"futu_trader.order_{order.order_status}",
+                                              time.perf_counter_ns() - submit_ns)
+        if self.order_listener is not None:
+            self.order_listener(order)
+            return
+        stock_manager = self.stock_managers.get(order.stock_code)
+        if stock_manager is None:
+            self.logger.error(f"order {order.order_id} {order.stock_code} status {order.order_status}"
+                              f" has no stock manager")
+            return
+        if order.trade_side == TrdSide.BUY:
+            stock_manager.on_stock_buy_status_change(order)
+        else:
+            stock_manager.on_stock_sell_status_change(order)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: kline_block_cache
+@author: jkguo
+@create: 2024/10/23
+"""
+import collections
+import threading
+import typing
+import logging
+import numpy as np
+
+# (stock_code, time_unit, 北京时间 epoch 天数, 是否紧凑表示)
+BlockKey = typing.Tuple[str, int, int, bool]
+
+
+class KLineBlockCache(object):
+    """
+    进程内共享的K线日块缓存
+    以 (stock_code, time_unit, trading_day, compact) 为键缓存已收盘交易日的K线列（只读 ndarray），
+    同一进程内的所有 StockKLineLib 共享，超出内存预算时按 LRU 淘汰。
+    compact 为 True 的日块使用紧凑表示（KLineRingBuffer.COMPACT_COLUMN_DTYPES），供紧凑表示的 lib 直接引用。
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024):
+        """
+        :param max_bytes: 内存预算（字节）
+        """
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._blocks: typing.OrderedDict[BlockKey, typing.Dict[str, np.ndarray]] = collections.OrderedDict()
+        self._block_bytes: typing.Dict[BlockKey, int] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.logger = logging.getLogger("kline_block_cache")
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, key: BlockKey) -> typing.Optional[typing.Dict[str, np.ndarray]]:
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key: BlockKey, columns: typing.Dict[str, np.ndarray]) -> typing.Dict[str, np.ndarray]:
+        """
+        缓存一个日块，列数据会被拷贝并设为只读
+        :return: 缓存中的日块
+        """
+        block = {}
+        for c, values in columns.items():
+            values = np.array(values, copy=True)
+            values.setflags(write=False)
+            block[c] = values
+        nbytes = sum(v.nbytes for v in block.values())
+        with self._lock:
+            self._remove(key)
+            self._blocks[key] = block
+            self._block_bytes[key] = nbytes
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes and len(self._blocks) > 1:
+                old_key, _ = self._blocks.popitem(last=False)
+                self.total_bytes -= self._block_bytes.pop(old_key)
+                self.evictions += 1
+        return block
+
+    def invalidate(self, stock_code: str, time_unit: int, days: typing.Iterable[int]):
+        """
+        数据更新后删除对应的日块
+        """
+        with self._lock:
+            for day in days:
+                for compact in (False, True):
+                    self._remove((stock_code, time_unit, int(day), compact))
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._block_bytes.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "blocks": len(self._blocks),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def _remove(self, key: BlockKey):
+        block = self._blocks.pop(key, None)
+        if block is not None:
+            self.total_bytes -= self._block_bytes.pop(key)
+
+
+__KLINE_BLOCK_CACHE__ = KLineBlockCache()
+
+
+def get_block_cache() -> KLineBlockCache:
+    return __KLINE_BLOCK_CACHE__
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: kline_buffer
+@author: jkguo
+@create: 2024/10/21
+"""
+import typing
+import numpy as np
+import pandas as pd
+from jtrade.utils import date_utils
+
+
+class KLineRingBuffer(object):
+    """
+    K线内存缓冲区
+    每列一个预分配的 ndarray，有效数据位于 [head, tail)，按 time（int64 epoch 分钟）升序只追加。
+    - 追加： 写入 tail 之后的空闲位置，摊还 O(1)；写满时把有效数据搬到新数组（必要时倍增容量）
+    - 淘汰： 只移动 head，不拷贝
+    - 查询： 二分查找 time 后返回数组切片视图，不拷贝；time_key 字符串只在返回 DataFrame 时按需生成
+    已有数据从不原地修改（搬迁和覆盖都会分配新数组），因此之前查询返回的视图始终有效；
+    返回的视图是只读的，调用方不能通过视图修改缓冲区（以及共享的日块）。
+    共享段模式（assign_segments）： 缓冲区直接由多个只读数组段组成（如进程内共享的日块），不拷贝；
+    查询范围在一个段内时返回段的视图，跨段时才按需拼接被查询的列；之后追加数据时搬到新数组。
+    """
+
+    COLUMNS = ['code', 'time', 'open', 'close', 'high', 'low', 'pe_ratio', 'turnover_rate', 'volume', 'turnover',
+               'change_rate', 'last_close']
+    COLUMN_DTYPES = {
+        'code': object,
+        'time': 'int64'
+    }
+    # 紧凑表示： 价格和比率用 float32，成交量用 int64（成交额数值较大，保留 float64）
+    COMPACT_COLUMN_DTYPES = {
+        'code': object,
+        'time': 'int64',
+        'open': 'float32',
+        'close': 'float32',
+        'high': 'float32',
+        'low': 'float32',
+        'last_close': 'float32',
+        'pe_ratio': 'float32',
+        'turnover_rate': 'float32',
+        'change_rate': 'float32',
+        'volume': 'int64'
+    }
+
+    def __init__(self, capacity: int = 4096, column_names: typing.Optional[typing.List[str]] = None,
+                 column_dtypes: typing.Optional[typing.Dict[str, typing.Any]] = None):
+        """
+        :param capacity: 初始容量
+        :param column_names: 列名，必须包含 time，默认 COLUMNS
+        :param column_dtypes: 列的 dtype，默认 COLUMN_DTYPES，未指定的列为 float64
+        """
+        self.column_names = list(self.COLUMNS if column_names is None else column_names)
+        assert 'time' in self.column_names
+        self.column_dtypes = dict(self.COLUMN_DTYPES if column_dtypes is None else column_dtypes)
+        # 查询返回的 DataFrame 列顺序： code,time_key,...,time
+        self.df_columns = [c for c in self.column_names if c == 'code'] + ['time_key'] + \
+                          [c for c in self.column_names if c not in ('code', 'time')] + ['time']
+        self.capacity = max(int(capacity), 16)
+        self.head = 0
+        self.tail = 0
+        self.columns: typing.Dict[str, np.ndarray] = self._alloc(self.capacity)
+        # 共享段模式下的只读数组段，按 time 升序且互不重叠；为 None 时使用 columns
+        self.segments: typing.Optional[typing.List[typing.Dict[str, np.ndarray]]] = None
+        # 共享段模式下不随行变化的列（如 code）
+        self.constants: typing.Dict[str, typing.Any] = {}
+        # 共享段模式下按需拼接的整列
+        self._joined: typing.Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def wrap(cls, columns: typing.Dict[str, np.ndarray]) -> "KLineRingBuffer":
+        """
+        直接以已有的（可以是只读的）数组作为缓冲区，不拷贝；之后追加数据时才搬到新数组
+        :param columns: 列名 -> ndarray，必须包含 time 且已按 time 升序
+        """
+        buffer = cls(capacity=16, column_names=list(columns.keys()),
+                     column_dtypes={c: v.dtype for c, v in columns.items()})
+        count = len(columns['time'])
+        buffer.columns = dict(columns)
+        buffer.capacity = count
+        buffer.head = 0
+        buffer.tail = count
+        return buffer
+
+    def assign_segments(self, segments: typing.List[typing.Dict[str, np.ndarray]],
+                        constants: typing.Optional[typing.Dict[str, typing.Any]] = None):
+        """
+        以多个只读数组段替换缓冲区的内容，不拷贝
+        :param segments: 列名 -> ndarray，按 time 升序且互不重叠，dtype 与 column_dtypes 一致
+        :param constants: 不随行变化的列 -> 值（如 code），这些列不需要出现在段中
+        """
+        self.clear()
+        segments = [segment for segment in segments if len(segment['time']) > 0]
+        if len(segments) == 0:
+            return
+        self.segments = [{c: segment[c] for c in self.column_names if c not in (constants or {})}
+                         for segment in segments]
+        self.constants = dict(constants or {})
+
+    def __len__(self):
+        if self.segments is not None:
+            return sum(len(segment['time']) for segment in self.segments)
+        return self.tail - self.head
+
+    def clear(self):
+        self.head = 0
+        self.tail = 0
+        self.columns = self._alloc(self.capacity)
+        self.segments = None
+        self.constants = {}
+        self._joined = {}
+
+    def first_time(self) -> typing.Optional[int]:
+        if len(self) == 0:
+            return None
+        if self.segments is not None:
+            return int(self.segments[0]['time'][0])
+        return int(self.columns['time'][self.head])
+
+    def last_time(self) -> typing.Optional[int]:
+        if len(self) == 0:
+            return None
+        if self.segments is not None:
+            return int(self.segments[-1]['time'][-1])
+        return int(self.columns['time'][self.tail - 1])
+
+    def append(self, df: pd.DataFrame):
+        """
+        追加K线，与缓冲区末尾重叠的部分以新数据为准
+        :param df: 列名同 column_names，缺少 time 列时由 time_key 换算
+        :return:
+        """
+        if df is None or len(df) == 0:
+            return
+        new_columns = {}
+        for c in self.column_names:
+            if c == 'time' and c not in df.columns:
+                new_columns[c] = date_utils.time_strs2epoch_mins(df['time_key'].to_numpy())
+            else:
+                new_columns[c] = self.to_array(df[c], self.column_dtypes.get(c, 'float64'))
+        times = new_columns['time']
+        if len(times) > 1 and not bool(np.all(times[:-1] < times[1:])):
+            # 乱序或重复，先排序去重（保留最后出现的行）
+            order = np.argsort(times, kind='stable')
+            sorted_times = times[order]
+            keep = np.ones(len(sorted_times), dtype=bool)
+            keep[:-1] = sorted_times[:-1] != sorted_times[1:]
+            order = order[keep]
+            new_columns = {c: v[order] for c, v in new_columns.items()}
+            times = new_columns['time']
+        if self.segments is not None:
+            self._materialize(len(times))
+        live_times = self.columns['time'][self.head: self.tail]
+        # 新数据开始位置之后的旧数据全部被覆盖
+        keep_count = int(np.searchsorted(live_times, times[0], side='left'))
+        n = len(times)
+        if keep_count < len(live_times) or self.head + keep_count + n > self.capacity:
+            self._relocate(keep_count, n)
+        else:
+            self.tail = self.head + keep_count
+        for c in self.column_names:
+            self.columns[c][self.tail: self.tail + n] = new_columns[c]
+        self.tail += n
+
+    def evict_before(self, time: int) -> int:
+        """
+        淘汰 time 之前的K线
+        :param time: epoch 分钟
+        :return: 淘汰的行数
+        """
+        if self.segments is not None:
+            return self._evict_segments_before(time)
+        live_times = self.columns['time'][self.head: self.tail]
+        count = int(np.searchsorted(live_times, time, side='left'))
+        self.head += count
+        return count
+
+    def query(self, begin_time: int, end_time: int) -> pd.DataFrame:
+        """
+        查询 [begin_time, end_time] 范围内的K线
+        :param begin_time: epoch 分钟
+        :param end_time: epoch 分钟
+        :return: pd.DataFrame 数值列为缓冲区的只读视图（原地修改前需要 copy）, time_key 列按需生成
+        """
+        if self.segments is not None:
+            data = {c: self._readonly(self._segment_column(c, begin_time, end_time)) for c in self.column_names}
+        else:
+            begin_idx, end_idx = self._range(begin_time, end_time)
+            data = {c: self._readonly(self.columns[c][begin_idx: end_idx]) for c in self.column_names}
+        data['time_key'] = date_utils.epoch_mins2time_strs(data['time'])
+        return pd.DataFrame(data, columns=self.df_columns, copy=False)
+
+    def column(self, name: str, begin_time: int, end_time: int) -> np.ndarray:
+        """
+        查询某一列 [begin_time, end_time] 范围内的只读视图
+        """
+        if self.segments is not None:
+            return self._readonly(self._segment_column(name, begin_time, end_time))
+        begin_idx, end_idx = self._range(begin_time, end_time)
+        return self._readonly(self.columns[name][begin_idx: end_idx])
+
+    @staticmethod
+    def _readonly(values: np.ndarray) -> np.ndarray:
+        values = values.view()
+        values.flags.writeable = False
+        return values
+
+    def _range(self, begin_time: int, end_time: int) -> typing.Tuple[int, int]:
+        live_times = self.columns['time'][self.head: self.tail]
+        begin_idx = self.head + int(np.searchsorted(live_times, begin_time, side='left'))
+        end_idx = self.head + int(np.searchsorted(live_times, end_time, side='right'))
+        return begin_idx, end_idx
+
+    def _segment_column(self, name: str, begin_time: int, end_time: int) -> np.ndarray:
+        hit = None
+        for segment in self.segments:
+            times = segment['time']
+            if times[-1] < begin_time:
+                continue
+            if times[0] > end_time:
+                break
+            if hit is not None:
+                # 跨段查询，使用拼接后的整列
+                joined_times = self._join('time')
+                begin_idx = int(np.searchsorted(joined_times, begin_time, side='left'))
+                end_idx = int(np.searchsorted(joined_times, end_time, side='right'))
+                return self._join(name)[begin_idx: end_idx]
+            hit = segment
+        if hit is None:
+            return np.empty(0, dtype=self.column_dtypes.get(name, 'float64'))
+        times = hit['time']
+        begin_idx = int(np.searchsorted(times, begin_time, side='left'))
+        end_idx = int(np.searchsorted(times, end_time, side='right'))
+        if name in self.constants:
+            return np.full(end_idx - begin_idx, self.constants[name], dtype=self.column_dtypes.get(name, 'float64'))
+        return hit[name][begin_idx: end_idx]
+
+    def _join(self, name: str) -> np.ndarray:
+        values = self._joined.get(name)
+        if values is None:
+            if name in self.constants:
+                values = np.full(len(self), self.constants[name], dtype=self.column_dtypes.get(name, 'float64'))
+            else:
+                values = np.concatenate([segment[name] for segment in self.segments])
+            self._joined[name] = values
+        return values
+
+    def _evict_segments_before(self, time: int) -> int:
+        count = 0
+        while len(self.segments) > 0 and self.segments[0]['time'][-1] < time:
+            count += len(self.segments.pop(0)['time'])
+        if len(self.segments) > 0:
+            idx = int(np.searchsorted(self.segments[0]['time'], time, side='left'))
+            if idx > 0:
+                self.segments[0] = {c: v[idx:] for c, v in self.segments[0].items()}
+                count += idx
+        self._joined = {c: v[count:] for c, v in self._joined.items()}
+        return count
+
+    def _materialize(self, incoming: int):
+        """
+        共享段模式转为普通的预分配数组，并保证能再放下 incoming 条
+        """
+        count = len(self)
+        capacity = 16
+        while capacity < (count + incoming) * 2:
+            capacity *= 2
+        columns = self._alloc(capacity)
+        offset = 0
+        for segment in self.segments:
+            n = len(segment['time'])
+            for c in self.column_names:
+                columns[c][offset: offset + n] = self.constants[c] if c in self.constants else segment[c]
+            offset += n
+        self.segments = None
+        self.constants = {}
+        self._joined = {}
+        self.columns = columns
+        self.capacity = capacity
+        self.head = 0
+        self.tail = count
+
+    def _relocate(self, keep_count: int, incoming: int):
+        """
+        把前 keep_count 条有效数据搬到新数组头部，并保证能再放下 incoming 条
+        """
+        need = keep_count + incoming
+        capacity = self.capacity
+        while capacity < need * 2:
+            capacity *= 2
+        columns = self._alloc(capacity)
+        for c in self.column_names:
+            columns[c][:keep_count] = self.columns[c][self.head: self.head + keep_count]
+        self.columns = columns
+        self.capacity = capacity
+        self.head = 0
+        self.tail = keep_count
+
+    def _alloc(self, capacity: int) -> typing.Dict[str, np.ndarray]:
+        return {c: np.empty(capacity, dtype=self.column_dtypes.get(c, 'float64')) for c in self.column_names}
+
+    @staticmethod
+    def to_array(series: pd.Series, dtype) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        if dtype.kind in 'iu' and series.dtype.kind == 'f':
+            # 浮点转整数： 四舍五入，缺失值记为 0
+            return np.rint(series.to_numpy(dtype='float64', na_value=0)).astype(dtype)
+        return series.to_numpy(dtype=dtype)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: kline_coverage
+@author: jkguo
+@create: 2024/10/22
+"""
+import bisect
+import typing
+import logging
+from jtrade.models.mysql_backend import StockKLineCoverageRepo
+
+
+class KLineCoverageIndex(object):
+    """
+    K线数据覆盖索引
+    记录 (stock_code, time_unit) 已经从富途同步过的时间区间（epoch 分钟，闭区间，互不重叠且有序），
+    节假日等没有数据的区间一旦同步过也会记录，避免反复请求。
+    """
+
+    def __init__(self, repo: StockKLineCoverageRepo):
+        self.repo = repo
+        self.intervals: typing.List[typing.List[int]] = []
+        self.dirty = False
+        self.logger = logging.getLogger("kline_coverage")
+        self.load()
+
+    def load(self):
+        self.intervals = []
+        for begin_time, end_time in self.repo.query():
+            self._add(begin_time, end_time)
+        self.dirty = False
+
+    def save(self):
+        if not self.dirty:
+            return
+        self.repo.save([(b, e) for b, e in self.intervals])
+        self.dirty = False
+
+    def add(self, begin_time: int, end_time: int):
+        """
+        记录 [begin_time, end_time] 已覆盖
+        """
+        if begin_time > end_time:
+            return
+        if self._add(begin_time, end_time):
+            self.dirty = True
+
+    def is_covered(self, begin_time: int, end_time: int) -> bool:
+        return len(self.missing(begin_time, end_time)) == 0
+
+    def missing(self, begin_time: int, end_time: int) -> typing.List[typing.Tuple[int, int]]:
+        """
+        [begin_time, end_time] 中未覆盖的区间
+        """
+        res = []
+        cur = begin_time
+        idx = max(bisect.bisect_right(self.intervals, [begin_time, float('inf')]) - 1, 0)
+        while idx < len(self.intervals) and cur <= end_time:
+            b, e = self.intervals[idx]
+            if b > end_time:
+                break
+            if e >= cur:
+                if b > cur:
+                    res.append((cur, b - 1))
+                cur = e + 1
+            idx += 1
+        if cur <= end_time:
+            res.append((cur, end_time))
+        return res
+
+    def _add(self, begin_time: int, end_time: int) -> bool:
+        intervals = self.intervals
+        # 找到所有与 [begin_time, end_time] 重叠或相邻的区间并合并
+        lo = bisect.bisect_left(intervals, [begin_time, begin_time])
+        if lo > 0 and intervals[lo - 1][1] >= begin_time - 1:
+            lo -= 1
+        hi = lo
+        while hi < len(intervals) and intervals[hi][0] <= end_time + 1:
+            hi += 1
+        if hi > lo:
+            if intervals[lo][0] <= begin_time and intervals[hi - 1][1] >= end_time and hi - lo == 1:
+                return False
+            begin_time = min(begin_time, intervals[lo][0])
+            end_time = max(end_time, intervals[hi - 1][1])
+        intervals[lo:hi] = [[begin_time, end_time]]
+        return True
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: kline_prefetcher
+@author: jkguo
+@create: 2024/10/23
+"""
+import time
+import typing
+import logging
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from jtrade.core.futu_sdk import FutuSdk
+from jtrade.core.stock_k_linke_lib import StockKLineLib
+from jtrade.models.mysql_backend import MysqlBackend
+from jtrade.models.kline_column_store import StockKLineColumnStore
+from jtrade.utils import date_utils, hk_trade_calendar
+
+
+class KLinePrefetcher(object):
+    """
+    多股票历史K线并行预取
+    每只股票按覆盖索引计算缺失的交易时段，切分为 chunk_days 天的块，由线程池并发从富途拉取并批量写入数据库；
+    一只股票的所有块完成后记录覆盖索引，预取范围完整时再从数据库把K线连续地补齐到本地列式存储
+    （只写拉取的块会在本地存储中留下空洞）。
+    请求频率由 FutuSdk 的限频器控制，历史K线额度不足时超出额度的新股票不拉取。
+    """
+
+    def __init__(self, futu_sdk: FutuSdk, backend: MysqlBackend,
+                 column_store_factory: typing.Optional[
+                     typing.Callable[[str, int], typing.Optional[StockKLineColumnStore]]] = None,
+                 time_unit: int = 1, max_workers: int = 4, chunk_days: int = 30, max_retries: int = 3):
+        """
+        :param futu_sdk:
+        :param backend:
+        :param column_store_factory: (stock_code, time_unit) -> 本地列式存储，如 TradeContext.kline_column_store
+        :param time_unit: K线时间单位 min
+        :param max_workers: 并发拉取的线程数（不宜超过行情连接池大小）
+        :param chunk_days: 每个请求块覆盖的自然日天数
+        :param max_retries: 每个块失败后的重试次数
+        """
+        self.futu_sdk = futu_sdk
+        self.backend = backend
+        self.column_store_factory = column_store_factory
+        self.time_unit = time_unit
+        self.max_workers = max_workers
+        self.chunk_days = chunk_days
+        self.max_retries = max_retries
+        self.logger = logging.getLogger("kline_prefetcher")
+
+    def prefetch(self, stock_codes: typing.List[str], begin_time: str, end_time: str) -> dict:
+        """
+        预取多只股票 [begin_time, end_time] 的K线
+        :param stock_codes:
+        :param begin_time: yyyy-mm-dd[ HH:MM:SS]
+        :param end_time: yyyy-mm-dd[ HH:MM:SS]
+        :return: 预取报告 {stocks, skipped, chunks, rows, failed, cost}
+        """
+        start_ts = time.time()
+        begin_min = date_utils.time_str2epoch_min(StockKLineLib._format_start_time_str(begin_time))
+        end_min = date_utils.time_str2epoch_min(StockKLineLib._format_end_time_str(end_time))
+        libs = {code: self._build_lib(code) for code in dict.fromkeys(stock_codes)}
+        # 计算各股票需要拉取的块
+        chunks: typing.Dict[str, typing.List[typing.Tuple[int, int]]] = {}
+        for code, lib in libs.items():
+            stock_chunks = []
+            for b, e in lib.plan_sync(begin_min, end_min):
+                stock_chunks.extend(self._split_chunks(b, e))
+            if len(stock_chunks) > 0:
+                chunks[code] = stock_chunks
+        skipped = self._apply_quota(list(chunks.keys()))
+        for code in skipped:
+            chunks.pop(code)
+        report = {
+            "stocks": len(chunks),
+            "skipped": skipped,
+            "chunks": sum(len(c) for c in chunks.values()),
+            "rows": 0,
+            "failed": [],
+            "cost": 0
+        }
+        self.logger.info(f"start prefetch {len(chunks)} stocks {report['chunks']} chunks"
+                         f" {begin_time} to {end_time}, skipped {len(skipped)} stocks for quota")
+        pending = {code: len(c) for code, c in chunks.items()}
+        results: typing.Dict[str, list] = {code: [] for code in chunks}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="kline_prefetch") as executor:
+            futures = {}
+            for code, stock_chunks in chunks.items():
+                for b, e in stock_chunks:
+                    futures[executor.submit(self._fetch_chunk, libs[code], b, e)] = (code, b, e)
+            for future in as_completed(futures):
+                code, b, e = futures[future]
+                try:
+                    df = future.result()
+                    results[code].append((b, e, df))
+                    report["rows"] += len(df)
+                except Exception as ex:
+                    self.logger.error(f"prefetch {code} {date_utils.epoch_min2time_str(b)}"
+                                      f" to {date_utils.epoch_min2time_str(e)} failed: {ex}")
+                    report["failed"].append((code, date_utils.epoch_min2time_str(b),
+                                             date_utils.epoch_min2time_str(e), str(ex)))
+                pending[code] -= 1
+                if pending[code] == 0:
+                    self._finish_stock(libs[code], results.pop(code), begin_min, end_min)
+        report["cost"] = round(time.time() - start_ts, 3)
+        self.logger.info(f"prefetch done. stocks {report['stocks']} chunks {report['chunks']} rows {report['rows']}"
+                         f" failed {len(report['failed'])} cost {report['cost']}s")
+        return report
+
+    def _build_lib(self, stock_code: str) -> StockKLineLib:
+        column_store = None
+        if self.column_store_factory is not None:
+            column_store = self.column_store_factory(stock_code, self.time_unit)
+        return StockKLineLib(
+            stock_code,
+            self.backend.stock_k_line_repo(stock_code, self.time_unit),
+            self.futu_sdk,
+            time_unit=self.time_unit,
+            column_store=column_store,
+            coverage_repo=self.backend.stock_k_line_coverage_repo(stock_code, self.time_unit)
+        )
+
+    def _split_chunks(self, begin_time: int, end_time: int) -> typing.List[typing.Tuple[int, int]]:
+        """
+        按北京时间自然日边界把区间切分为不超过 chunk_days 天的块，块首尾都是交易分钟
+        """
+        res = []
+        cur = begin_time
+        while cur <= end_time:
+            day = (cur + date_utils.HK_UTC_OFFSET_MINUTES) // hk_trade_calendar.DAY_MINUTES
+            chunk_end = min(end_time, hk_trade_calendar.day_range(day + self.chunk_days - 1)[1])
+            clipped = hk_trade_calendar.clip_trading_range(cur, chunk_end)
+            if clipped is not None:
+                res.append(clipped)
+            cur = chunk_end + 1
+        return res
+
+    def _apply_quota(self, stock_codes: typing.List[str]) -> typing.List[str]:
+        """
+        最近30天请求过的股票不占用额度，其余股票按顺序占用剩余额度
+        :return: 额度不足而跳过的股票
+        """
+        if len(stock_codes) == 0:
+            return []
+        used_quota, remain_quota, recent_codes = self.futu_sdk.query_history_kline_quota()
+        new_codes = [code for code in stock_codes if code not in recent_codes]
+        self.logger.info(f"history kline quota used {used_quota} remain {remain_quota}, new stocks {len(new_codes)}")
+        return new_codes[max(remain_quota, 0):]
+
+    def _fetch_chunk(self, lib: StockKLineLib, begin_time: int, end_time: int) -> pd.DataFrame:
+        retry = 0
+        while True:
+            try:
+                df = lib.fetch_kline_from_futu(begin_time, end_time)
+                lib.store_kline(df, to_column_store=False)
+                return df
+            except Exception as e:
+                if retry >= self.max_retries:
+                    raise
+                retry += 1
+                self.logger.warning(f"fetch {lib.stock_code} {date_utils.epoch_min2time_str(begin_time)} failed: {e},"
+                                    f" retry {retry}")
+                time.sleep(2 ** retry)
+
+    @staticmethod
+    def _finish_stock(lib: StockKLineLib, results: typing.List[typing.Tuple[int, int, pd.DataFrame]],
+                      begin_time: int, end_time: int):
+        if len(results) == 0:
+            return
+        for b, e, _ in results:
+            lib.mark_synced(b, e)
+        if lib.coverage is None:
+            return
+        lib.coverage.save()
+        complete = all(hk_trade_calendar.clip_trading_range(b, e) is None
+                       for b, e in lib.coverage.missing(begin_time, end_time))
+        if complete:
+            # 数据库中整个范围都已完整，连续地补齐本地存储
+            lib.fill_column_store(begin_time, end_time)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: kline_rollup
+@author: jkguo
+@create: 2024/10/22
+"""
+import typing
+import numpy as np
+import pandas as pd
+from jtrade.core.kline_buffer import KLineRingBuffer
+from jtrade.utils import date_utils
+
+
+class KLineRollup(object):
+    """
+    由1分钟K线增量合成的高周期 OHLCV K线
+    - 日内周期（5/15/30/60 ...）： 按北京时间对齐，K线时间取周期结束时刻（同富途），如 09:31~09:35 合成 09:35
+    - 日K（1440）： K线时间取当天 00:00:00
+    已完成的K线缓存在 completed 中不再计算，每次更新只重新合成当前未完成的K线。
+    """
+
+    COLUMNS = ['time', 'open', 'close', 'high', 'low', 'volume', 'turnover']
+    DAY_MINUTES = 24 * 60
+
+    def __init__(self, time_unit: int):
+        assert 1 < time_unit <= self.DAY_MINUTES
+        self.time_unit = time_unit
+        self.completed = KLineRingBuffer(capacity=1024, column_names=self.COLUMNS)
+        # 当前未完成的K线
+        self.open_bar: typing.Optional[typing.Dict[str, float]] = None
+        # 已经合成过的最后一根1分钟K线时间
+        self.last_source_time: typing.Optional[int] = None
+
+    def reset(self):
+        self.completed.clear()
+        self.open_bar = None
+        self.last_source_time = None
+
+    def update(self, source: KLineRingBuffer):
+        """
+        用1分钟K线缓存中新增的数据更新合成K线
+        :param source: 1分钟K线缓存
+        :return:
+        """
+        source_last_time = source.last_time()
+        if source_last_time is None:
+            return
+        if self.last_source_time is not None and source_last_time < self.last_source_time:
+            # 源数据被重置
+            self.reset()
+        begin_time = source.first_time() if self.last_source_time is None else self.last_source_time + 1
+        if begin_time > source_last_time:
+            return
+        times = source.column('time', begin_time, source_last_time)
+        if len(times) == 0:
+            return
+        labels = self.bucket_times(times)
+        starts = np.concatenate([[0], np.flatnonzero(labels[1:] != labels[:-1]) + 1])
+        ends = np.concatenate([starts[1:], [len(times)]])
+        opens = source.column('open', begin_time, source_last_time)[starts]
+        closes = source.column('close', begin_time, source_last_time)[ends - 1]
+        highs = np.maximum.reduceat(source.column('high', begin_time, source_last_time), starts)
+        lows = np.minimum.reduceat(source.column('low', begin_time, source_last_time), starts)
+        volumes = np.add.reduceat(source.column('volume', begin_time, source_last_time), starts)
+        turnovers = np.add.reduceat(source.column('turnover', begin_time, source_last_time), starts)
+        bars = {
+            'time': labels[starts], 'open': opens, 'close': closes, 'high': highs, 'low': lows,
+            'volume': volumes, 'turnover': turnovers
+        }
+        open_bar = self.open_bar
+        if open_bar is not None:
+            if open_bar['time'] == bars['time'][0]:
+                # 与未完成的K线合并
+                bars['open'][0] = open_bar['open']
+                bars['high'][0] = max(bars['high'][0], open_bar['high'])
+                bars['low'][0] = min(bars['low'][0], open_bar['low'])
+                bars['volume'][0] += open_bar['volume']
+                bars['turnover'][0] += open_bar['turnover']
+            else:
+                self.completed.append(pd.DataFrame({c: [open_bar[c]] for c in self.COLUMNS}))
+        self.last_source_time = int(times[-1])
+        # 最后一根K线的周期尚未结束时，作为未完成K线保留
+        count = len(bars['time'])
+        if self._bucket_end_time(int(bars['time'][-1])) > self.last_source_time:
+            self.open_bar = {c: bars[c][-1].item() for c in self.COLUMNS}
+            count -= 1
+        else:
+            self.open_bar = None
+        if count > 0:
+            self.completed.append(pd.DataFrame({c: bars[c][:count] for c in self.COLUMNS}))
+
+    def evict_before(self, time: int) -> int:
+        return self.completed.evict_before(time)
+
+    def query(self, begin_time: int, end_time: int) -> pd.DataFrame:
+        """
+        查询 [begin_time, end_time] 范围内的合成K线（包含未完成的K线）
+        :param begin_time: epoch 分钟
+        :param end_time: epoch 分钟
+        :return: pd.DataFrame 列名： time_key,open,close,high,low,volume,turnover,time
+        """
+        df = self.completed.query(begin_time, end_time)
+        open_bar = self.open_bar
+        if open_bar is None or not begin_time <= open_bar['time'] <= end_time:
+            return df
+        open_df = pd.DataFrame({c: [open_bar[c]] for c in self.COLUMNS})
+        open_df['time_key'] = date_utils.epoch_mins2time_strs(open_df['time'].to_numpy())
+        return pd.concat([df, open_df[df.columns]], ignore_index=True)
+
+    def bucket_times(self, times: np.ndarray) -> np.ndarray:
+        """
+        计算1分钟K线所属的合成K线时间
+        :param times: epoch 分钟
+        :return: epoch 分钟
+        """
+        local_times = times + date_utils.HK_UTC_OFFSET_MINUTES
+        if self.time_unit == self.DAY_MINUTES:
+            local_labels = local_times // self.DAY_MINUTES * self.DAY_MINUTES
+        else:
+            local_labels = -(-local_times // self.time_unit) * self.time_unit
+        return local_labels - date_utils.HK_UTC_OFFSET_MINUTES
+
+    def _bucket_end_time(self, label_time: int) -> int:
+        if self.time_unit == self.DAY_MINUTES:
+            return label_time + self.DAY_MINUTES - 1
+        return label_time
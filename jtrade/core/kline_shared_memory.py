@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: kline_shared_memory
+@author: jkguo
+@create: 2024/10/23
+"""
+import json
+import typing
+import logging
+import numpy as np
+from multiprocessing import shared_memory
+
+logger = logging.getLogger("kline.shared_memory")
+
+
+class SharedKLineSegment(object):
+    """
+    共享内存中的一段K线
+    一只股票（一个时间单位）的所有列依次存放在同一个 SharedMemory 中，
+    各进程通过 info（段名、行数、各列的 dtype 和偏移）以只读 ndarray 视图零拷贝访问。
+    """
+
+    COLUMNS = ['time', 'open', 'close', 'high', 'low', 'volume', 'turnover']
+    COLUMN_DTYPES = {
+        'time': 'int64'
+    }
+
+    def __init__(self, shm: shared_memory.SharedMemory, info: dict, owner: bool):
+        self.shm = shm
+        self.info = info
+        self.owner = owner
+        self.columns: typing.Dict[str, np.ndarray] = {}
+        for name, dtype, offset in info["columns"]:
+            values = np.ndarray((info["count"],), dtype=dtype, buffer=shm.buf, offset=offset)
+            values.setflags(write=False)
+            self.columns[name] = values
+
+    @property
+    def stock_code(self) -> str:
+        return self.info["stock_code"]
+
+    @property
+    def time_unit(self) -> int:
+        return self.info["time_unit"]
+
+    @property
+    def begin_time(self) -> int:
+        """
+        发布时的查询开始时间 epoch 分钟
+        """
+        return self.info["begin_time"]
+
+    def __len__(self):
+        return self.info["count"]
+
+    @classmethod
+    def create(cls, stock_code: str, time_unit: int, begin_time: int,
+               columns: typing.Dict[str, np.ndarray]) -> "SharedKLineSegment":
+        """
+        创建共享内存段并写入列数据
+        :param stock_code:
+        :param time_unit:
+        :param begin_time: 数据对应的查询开始时间 epoch 分钟
+        :param columns: 列名 -> ndarray，需包含 COLUMNS
+        """
+        count = len(columns['time'])
+        layout = []
+        offset = 0
+        for c in cls.COLUMNS:
+            dtype = np.dtype(cls.COLUMN_DTYPES.get(c, 'float64'))
+            layout.append([c, dtype.str, offset])
+            offset += count * dtype.itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        info = {
+            "shm_name": shm.name,
+            "stock_code": stock_code,
+            "time_unit": time_unit,
+            "begin_time": int(begin_time),
+            "count": count,
+            "columns": layout
+        }
+        for name, dtype, col_offset in layout:
+            target = np.ndarray((count,), dtype=dtype, buffer=shm.buf, offset=col_offset)
+            target[:] = columns[name]
+            del target
+        return cls(shm, info, owner=True)
+
+    @classmethod
+    def attach(cls, info: dict) -> "SharedKLineSegment":
+        """
+        按 info 附加到已发布的共享内存段（不拷贝）
+        """
+        try:
+            # 附加方不负责回收 (python >= 3.13)
+            shm = shared_memory.SharedMemory(name=info["shm_name"], track=False)
+        except TypeError:
+            # 低版本附加时会登记到 resource_tracker，工作进程需由发布进程通过 multiprocessing 启动（共用同一个
+            # resource_tracker），否则工作进程退出时会删除发布方的共享内存
+            shm = shared_memory.SharedMemory(name=info["shm_name"])
+        return cls(shm, info, owner=False)
+
+    def close(self):
+        self.columns = {}
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class KLineSharedCatalog(object):
+    """
+    共享K线目录
+    发布方维护 (stock_code, time_unit) -> 共享内存段，catalog() 返回可序列化的目录（dict），
+    传给工作进程（参数或 json 文件）后由 attach 附加。
+    """
+
+    def __init__(self):
+        self.segments: typing.Dict[str, SharedKLineSegment] = {}
+
+    @staticmethod
+    def key(stock_code: str, time_unit: int) -> str:
+        return f"{stock_code}/{time_unit}"
+
+    def publish(self, stock_code: str, time_unit: int, begin_time: int,
+                columns: typing.Dict[str, np.ndarray]) -> SharedKLineSegment:
+        """
+        发布（或替换）一只股票的K线
+        """
+        key = self.key(stock_code, time_unit)
+        old_segment = self.segments.pop(key, None)
+        if old_segment is not None:
+            old_segment.close()
+        segment = SharedKLineSegment.create(stock_code, time_unit, begin_time, columns)
+        self.segments[key] = segment
+        logger.info(f"publish shared kline {key} count {len(segment)} shm {segment.info['shm_name']}")
+        return segment
+
+    def catalog(self) -> typing.Dict[str, dict]:
+        return {key: segment.info for key, segment in self.segments.items()}
+
+    def save(self, path: str):
+        with open(path, "w") as fp:
+            json.dump(self.catalog(), fp)
+
+    @staticmethod
+    def load(path: str) -> typing.Dict[str, dict]:
+        with open(path, "r") as fp:
+            return json.load(fp)
+
+    @staticmethod
+    def attach(catalog: typing.Dict[str, dict], stock_code: str, time_unit: int = 1) -> SharedKLineSegment:
+        info = catalog.get(KLineSharedCatalog.key(stock_code, time_unit))
+        if info is None:
+            raise Exception(f"shared kline {stock_code} unit {time_unit} not published")
+        return SharedKLineSegment.attach(info)
+
+    def close(self):
+        for segment in self.segments.values():
+            segment.close()
+        self.segments = {}
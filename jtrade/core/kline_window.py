@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: kline_window
+@author: jkguo
+@create: 2024/10/23
+"""
+import typing
+import numpy as np
+import pandas as pd
+from jtrade.core.kline_buffer import KLineRingBuffer
+from jtrade.core.stock_k_linke_lib import StockKLineLib
+from jtrade.utils import date_utils
+
+
+class KLineWindow(object):
+    """
+    交易引擎使用的K线滑动窗口
+    每个周期只把窗口边界向前移动（二分查找），x / y / kline_df 都是 StockKLineLib 内存缓存的视图；
+    time_key 字符串由窗口自己缓存，每次只为新增的K线生成，单周期开销与窗口长度无关。
+    """
+
+    def __init__(self, kline_lib: StockKLineLib):
+        self.kline_lib = kline_lib
+        self.begin_time: typing.Optional[int] = None
+        self.end_time: typing.Optional[int] = None
+        # 已生成的 time_key 字符串，按 time 对齐
+        self._time_keys = KLineRingBuffer(column_names=['time', 'time_key'],
+                                          column_dtypes={'time': 'int64', 'time_key': object})
+        self._x: typing.Optional[np.ndarray] = None
+
+    def update(self, begin_time: str | float, end_time: str | float):
+        """
+        移动窗口到 [begin_time, end_time]
+        :param begin_time: yyyy-mm-dd[ HH[:MM[:SS]]] 或者 时间戳
+        :param end_time: yyyy-mm-dd[ HH[:MM[:SS]]] 或者 时间戳
+        :return:
+        """
+        self.begin_time, self.end_time = self.kline_lib.ensure_range(begin_time, end_time)
+        times = self.kline_lib.buffer.column('time', self.begin_time, self.end_time)
+        self._x = self._update_time_keys(times)
+
+    @property
+    def x(self) -> np.ndarray:
+        """
+        窗口内K线的 time_key（object ndarray）
+        """
+        return self._x
+
+    @property
+    def y(self) -> np.ndarray:
+        """
+        窗口内K线的收盘价
+        """
+        return self.kline_lib.buffer.column('close', self.begin_time, self.end_time)
+
+    @property
+    def kline_df(self) -> pd.DataFrame:
+        """
+        窗口内的K线，列同 StockKLineLib.query，所有列都是视图
+        """
+        buffer = self.kline_lib.buffer
+        data = {}
+        for c in buffer.df_columns:
+            values = self._x if c == 'time_key' else buffer.column(c, self.begin_time, self.end_time)
+            if values.dtype == object:
+                # 避免 pandas 把 object 列推断为字符串类型（会拷贝整列）
+                values = pd.Series(values, dtype=object, copy=False)
+            data[c] = values
+        return pd.DataFrame(data, columns=buffer.df_columns, copy=False)
+
+    def _update_time_keys(self, times: np.ndarray) -> np.ndarray:
+        cache = self._time_keys
+        if len(times) == 0:
+            return np.empty(0, dtype=object)
+        first_time = cache.first_time()
+        if first_time is None or times[0] < first_time:
+            cache.clear()
+        last_time = cache.last_time()
+        new_times = times if last_time is None else times[int(np.searchsorted(times, last_time, side='right')):]
+        if len(new_times) > 0:
+            cache.append(pd.DataFrame({
+                'time': new_times,
+                'time_key': pd.Series(date_utils.epoch_mins2time_strs(new_times).astype(object), dtype=object)
+            }))
+        cache.evict_before(int(times[0]))
+        time_keys = cache.column('time_key', int(times[0]), int(times[-1]))
+        if len(time_keys) != len(times):
+            # 内存缓存中间补入了数据，重新生成
+            cache.clear()
+            return self._update_time_keys(times)
+        return time_keys
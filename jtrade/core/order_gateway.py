@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: order_gateway
+@author: jkguo
+@create: 2024/10/25
+"""
+import queue
+import typing
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from futu import TrdSide
+from jtrade.core.trader import StockTraderBase
+from jtrade.core.stock_manager import StockManager
+from jtrade.models.dto import DtoUtil, TradeOrderDto, TradeOrderStatus
+from jtrade.core.trade_context import get_context
+from jtrade.utils.latency_stats import span
+
+
+class OrderEvent(object):
+    """
+    订单事件
+    """
+
+    # 券商已接受订单（已分配 order_id）
+    SUBMITTED = "submitted"
+    # 下单失败
+    REJECTED = "rejected"
+    # 成交、部分成交、撤单等状态变化
+    STATUS_CHANGE = "status_change"
+
+    def __init__(self, event_type: str, order: TradeOrderDto, error: typing.Optional[str] = None):
+        self.event_type = event_type
+        # 交易类之后的推送会继续修改同一个订单对象，事件保存的是产生事件时的订单副本
+        self.order = DtoUtil.clone(order)
+        self.error = error
+
+    def __str__(self):
+        return (f"OrderEvent({self.event_type} {self.order.stock_code} {self.order.trade_side}"
+                f" {self.order.order_id} status {self.order.order_status} error {self.error})")
+
+
+class AsyncOrderGateway(object):
+    """
+    异步订单网关
+    - submit_open / submit_close 立即返回 Future（结果为 order_id），下单请求在线程池中调用交易类
+    - 下单确认 / 失败，以及交易类回调的成交、部分成交、撤单都放入事件队列，
+      由一个事件线程按顺序调用对应股票的 StockManager.on_stock_*_status_change 并写订单表
+    - 下单前由调用方执行 on_stock_submit_buying / on_stock_submit_selling 冻结资金 / 持股，
+      下单失败按撤单处理（退款 / 恢复持有）
+    """
+
+    def __init__(self, trader: StockTraderBase, max_workers: int = 4):
+        """
+        :param trader: 交易类，其订单状态回调会被设置为本网关
+        :param max_workers: 并发下单的线程数
+        """
+        self.trader = trader
+        self.max_workers = max_workers
+        self.stock_managers: typing.Dict[str, StockManager] = {}
+        self.events: "queue.Queue[typing.Optional[OrderEvent]]" = queue.Queue()
+        self.executor: typing.Optional[ThreadPoolExecutor] = None
+        self._event_thread: typing.Optional[threading.Thread] = None
+        self.submitted_count = 0
+        self.rejected_count = 0
+        self.event_count = 0
+        self.error_count = 0
+        # 计数在下单线程池和事件线程中更新
+        self._metrics_lock = threading.Lock()
+        self.logger = logging.getLogger("order_gateway")
+        self.trader.set_order_listener(self.on_order_status)
+
+    def register_stock_manager(self, stock_manager: StockManager):
+        self.stock_managers[stock_manager.stock_code] = stock_manager
+
+    def start(self):
+        if self._event_thread is not None:
+            return
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="order_gateway")
+        self._event_thread = threading.Thread(target=self._event_loop, name="order_gateway_event", daemon=True)
+        self._event_thread.start()
+
+    def stop(self):
+        """
+        等待已提交的下单请求和已收到的事件处理完后退出
+        """
+        if self._event_thread is None:
+            return
+        self.executor.shutdown(wait=True)
+        self.executor = None
+        self.events.put(None)
+        self._event_thread.join()
+        self._event_thread = None
+        self.logger.info(f"order gateway stopped. {self.metrics()}")
+
+    def is_started(self) -> bool:
+        return self.executor is not None
+
+    def join(self):
+        """
+        等待当前已收到的事件处理完
+        """
+        self.events.join()
+
+    def submit_open(self, order: TradeOrderDto) -> Future:
+        """
+        异步买入，调用方不应再修改 order
+        :return: Future，结果为 order_id，下单失败时为异常
+        """
+        return self._executor().submit(self._submit, order, self.trader.open_position, "gateway.trader.open_position")
+
+    def submit_close(self, order: TradeOrderDto) -> Future:
+        """
+        异步卖出，调用方不应再修改 order
+        :return: Future，结果为 order_id，下单失败时为异常
+        """
+        return self._executor().submit(self._submit, order, self.trader.close_position, "gateway.trader.close_position")
+
+    def on_order_status(self, order: TradeOrderDto):
+        """
+        交易类的订单状态回调（可在任意线程调用）
+        """
+        self.events.put(OrderEvent(OrderEvent.STATUS_CHANGE, order))
+
+    def metrics(self) -> dict:
+        with self._metrics_lock:
+            return {
+                "submitted": self.submitted_count,
+                "rejected": self.rejected_count,
+                "events": self.event_count,
+                "errors": self.error_count,
+                "pending_events": self.events.qsize()
+            }
+
+    def _executor(self) -> ThreadPoolExecutor:
+        executor = self.executor
+        if executor is None:
+            raise Exception("order gateway not started")
+        return executor
+
+    def _submit(self, order: TradeOrderDto, place_order: typing.Callable[[TradeOrderDto], str], span_name: str):
+        try:
+            with span(span_name):
+                order_id = place_order(order)
+        except Exception as e:
+            with self._metrics_lock:
+                self.rejected_count += 1
+            self.logger.exception(f"submit order {order.stock_code} {order.trade_side} {order.stock_holding_id}"
+                                  f" failed: {e}")
+            self.events.put(OrderEvent(OrderEvent.REJECTED, order, repr(e)))
+            raise
+        with self._metrics_lock:
+            self.submitted_count += 1
+        self.events.put(OrderEvent(OrderEvent.SUBMITTED, order))
+        return order_id
+
+    def _event_loop(self):
+        while True:
+            event = self.events.get()
+            try:
+                if event is None:
+                    return
+                with span(f"gateway.event.{event.event_type}"):
+                    self._handle_event(event)
+                with self._metrics_lock:
+                    self.event_count += 1
+            except Exception as e:
+                with self._metrics_lock:
+                    self.error_count += 1
+                self.logger.exception(f"handle {event} failed: {e}")
+            finally:
+                self.events.task_done()
+
+    def _handle_event(self, event: OrderEvent):
+        order = event.order
+        stock_manager = self.stock_managers.get(order.stock_code)
+        if stock_manager is None:
+            raise Exception(f"stock manager for {order.stock_code} not registered")
+        order_repo = get_context().backend().trade_order_repo(stock_manager.account.account_name)
+        with stock_manager.unit_of_work():
+            if event.event_type == OrderEvent.SUBMITTED:
+                stock_manager.on_stock_order_submitted(order)
+                order_repo.store(order)
+                return
+            if event.event_type == OrderEvent.REJECTED:
+                # 下单失败，按撤单退回冻结的资金 / 持股
+                order.order_status = TradeOrderStatus.CANCELLED
+            if order.trade_side == TrdSide.BUY:
+                stock_manager.on_stock_buy_status_change(order)
+            else:
+                stock_manager.on_stock_sell_status_change(order)
+            if order.order_id:
+                order_repo.store(order)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: position_book
+@author: jkguo
+@create: 2024/10/23
+"""
+import threading
+import typing
+import logging
+from jtrade.models.dto import StockDto, DtoUtil
+from jtrade.models.mysql_backend import StockRepo
+
+
+class StockPositionBook(object):
+    """
+    内存持仓簿
+    启动时从数据库加载一只股票的全部持股记录，之后以内存为准，按 stock_holding_id 和状态建立索引；
+    修改后通过 save 写回数据库：
+    - write_through： 每次 save 立即写库
+    - write_behind： save 只标记为脏数据，由 flush 批量在一个事务中写库（StockManager 在工作单元提交前 flush）
+    """
+
+    WRITE_THROUGH = "write_through"
+    WRITE_BEHIND = "write_behind"
+
+    def __init__(self, stock_repo: StockRepo, stock_code: str, persist_mode: str = WRITE_THROUGH):
+        assert persist_mode in (self.WRITE_THROUGH, self.WRITE_BEHIND)
+        self.stock_repo = stock_repo
+        self.stock_code = stock_code
+        self.persist_mode = persist_mode
+        self._lock = threading.RLock()
+        self._stocks: typing.Dict[str, StockDto] = {}
+        self._status_index: typing.Dict[int, typing.Dict[str, StockDto]] = {}
+        # 记录索引时的状态，调用方可能在 save 之前直接修改了 status
+        self._indexed_status: typing.Dict[str, int] = {}
+        self._dirty: typing.Dict[str, StockDto] = {}
+        self.logger = logging.getLogger("position_book")
+        self.load()
+
+    def load(self):
+        """
+        从数据库加载（丢弃未写库的修改）
+        """
+        with self._lock:
+            self._stocks = {}
+            self._status_index = {}
+            self._indexed_status = {}
+            self._dirty = {}
+            for stock in self.stock_repo.query_all(self.stock_code):
+                self._index(stock)
+        self.logger.info(f"load position book {self.stock_code} {len(self._stocks)} stocks")
+
+    def get(self, stock_holding_id: str) -> typing.Optional[StockDto]:
+        """
+        :return: 持仓簿中的持股记录（不是副本），供 StockManager 修改后 save
+        """
+        with self._lock:
+            return self._stocks.get(stock_holding_id)
+
+    def query(self, status_list: typing.List[int]) -> typing.Dict[str, StockDto]:
+        """
+        按状态查询
+        :return: stock_holding_id -> StockDto 副本，调用方（策略、账户快照）修改不影响持仓簿，
+            也不会被之后的成交推送修改
+        """
+        with self._lock:
+            res = {}
+            for status in status_list:
+                for holding_id, stock in self._status_index.get(status, {}).items():
+                    res[holding_id] = DtoUtil.clone(stock)
+            return res
+
+    def save(self, stock: StockDto):
+        """
+        新增或更新持股记录
+        """
+        with self._lock:
+            self._index(stock)
+            if self.persist_mode == self.WRITE_BEHIND:
+                self._dirty[stock.stock_holding_id] = stock
+                return True
+        return self.stock_repo.save(stock)
+
+    def flush(self):
+        """
+        写回所有未写库的修改
+        """
+        with self._lock:
+            dirty = list(self._dirty.values())
+            self._dirty = {}
+        try:
+            self.stock_repo.save_all(dirty)
+        except Exception:
+            with self._lock:
+                for stock in dirty:
+                    self._dirty.setdefault(stock.stock_holding_id, stock)
+            raise
+
+    def _index(self, stock: StockDto):
+        holding_id = stock.stock_holding_id
+        old_status = self._indexed_status.get(holding_id)
+        if old_status is not None:
+            self._status_index[old_status].pop(holding_id, None)
+        self._stocks[holding_id] = stock
+        self._status_index.setdefault(stock.status, {})[holding_id] = stock
+        self._indexed_status[holding_id] = stock.status
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: rt_data_service
+@author: jkguo
+@create: 2024/10/23
+"""
+import collections
+import threading
+import time
+import typing
+import logging
+import pandas as pd
+from jtrade.utils.latency_stats import LatencyHistogram
+from futu import OpenQuoteContext, RTDataHandlerBase, CurKlineHandlerBase, SubType, RET_OK, RET_ERROR
+
+
+class RtDataQueue(object):
+    """
+    按股票合并的有界实时数据队列（交易引擎前的入口队列）
+    - 同一只股票只保留最新的一条待处理数据，新数据覆盖旧数据（coalesced），
+      时间早于已入队 / 已处理数据的乱序数据直接丢弃（stale）
+    - get 取出的股票标记为处理中，task_done 之前该股票的新数据只更新待处理数据、不会再被取出，
+      保证同一股票不会被并发处理，引擎处理完后直接拿到最新一条
+    - 待处理的股票数达到上限时新股票的数据直接丢弃（dropped），put 永不阻塞推送线程
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._cond = threading.Condition()
+        # 待处理数据 stock_code -> (cur_data, 最早一条未处理数据的入队时间 ns)
+        self._latest: typing.Dict[str, typing.Tuple[dict, int]] = {}
+        # 可以取出的股票（不含处理中的股票）
+        self._order: typing.Deque[str] = collections.deque()
+        self._busy: typing.Set[str] = set()
+        self._last_time: typing.Dict[str, str] = {}
+        self._unfinished = 0
+        self.put_count = 0
+        self.coalesced_count = 0
+        self.stale_count = 0
+        self.dropped_count = 0
+        self.wait_histogram = LatencyHistogram()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._latest)
+
+    def put(self, cur_data: dict) -> bool:
+        """
+        :param cur_data: 实时数据，必须包含 code
+        :return: 是否入队（包括合并）
+        """
+        stock_code = cur_data["code"]
+        data_time = cur_data.get("time")
+        with self._cond:
+            self.put_count += 1
+            last_time = self._last_time.get(stock_code)
+            if data_time is not None and last_time is not None and data_time < last_time:
+                self.stale_count += 1
+                return False
+            pending = self._latest.get(stock_code)
+            if pending is not None:
+                self._latest[stock_code] = (cur_data, pending[1])
+                self._last_time[stock_code] = data_time
+                self.coalesced_count += 1
+                return True
+            if len(self._latest) >= self.max_size:
+                self.dropped_count += 1
+                return False
+            self._latest[stock_code] = (cur_data, time.perf_counter_ns())
+            self._last_time[stock_code] = data_time
+            self._unfinished += 1
+            if stock_code not in self._busy:
+                self._order.append(stock_code)
+                self._cond.notify()
+            return True
+
+    def get(self, timeout: typing.Optional[float] = None) -> typing.Optional[dict]:
+        """
+        取出最早入队股票的最新数据，处理完成后需要调用 task_done(stock_code)
+        :param timeout: 超时时间 s， None 表示一直等待
+        :return: 超时返回 None
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._order) > 0, timeout):
+                return None
+            stock_code = self._order.popleft()
+            cur_data, enqueue_ns = self._latest.pop(stock_code)
+            self._busy.add(stock_code)
+        self.wait_histogram.record(time.perf_counter_ns() - enqueue_ns)
+        return cur_data
+
+    def task_done(self, stock_code: str):
+        """
+        :param stock_code: get 取出的数据的股票代码
+        """
+        with self._cond:
+            self._busy.discard(stock_code)
+            if stock_code in self._latest:
+                self._order.append(stock_code)
+                self._cond.notify()
+            self._unfinished -= 1
+            if self._unfinished <= 0:
+                self._cond.notify_all()
+
+    def join(self, timeout: typing.Optional[float] = None) -> bool:
+        """
+        等待所有已入队的数据处理完成
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._unfinished <= 0, timeout)
+
+    def metrics(self) -> dict:
+        """
+        :return: 队列深度、计数和排队延迟
+        depth 待处理的股票数， busy 处理中的股票数， oldest_wait_ms 最久一条待处理数据已排队的时间，
+        wait 从入队到被取出的耗时统计
+        """
+        now_ns = time.perf_counter_ns()
+        with self._cond:
+            oldest_ns = min((enqueue_ns for _, enqueue_ns in self._latest.values()), default=now_ns)
+            metrics = {
+                "depth": len(self._latest),
+                "busy": len(self._busy),
+                "put": self.put_count,
+                "coalesced": self.coalesced_count,
+                "stale": self.stale_count,
+                "dropped": self.dropped_count,
+                "oldest_wait_ms": round((now_ns - oldest_ns) / 1e6, 4)
+            }
+        metrics["wait"] = self.wait_histogram.summary()
+        return metrics
+
+
+class _RtDataPushHandler(RTDataHandlerBase):
+    """
+    分时数据推送
+    """
+
+    def __init__(self, service: "RtDataService"):
+        super().__init__()
+        self.service = service
+
+    def on_recv_rsp(self, rsp_pb):
+        ret_code, data = super().on_recv_rsp(rsp_pb)
+        if ret_code != RET_OK:
+            self.service.logger.error(f"rt data push error: {data}")
+            return RET_ERROR, data
+        for row in data.to_dict('records'):
+            if row.get("is_blank"):
+                continue
+            self.service.on_push(row)
+        return RET_OK, data
+
+
+class _CurKlinePushHandler(CurKlineHandlerBase):
+    """
+    实时K线推送，转换为分时回调的数据格式
+    """
+
+    def __init__(self, service: "RtDataService"):
+        super().__init__()
+        self.service = service
+
+    def on_recv_rsp(self, rsp_pb):
+        ret_code, data = super().on_recv_rsp(rsp_pb)
+        if ret_code != RET_OK:
+            self.service.logger.error(f"cur kline push error: {data}")
+            return RET_ERROR, data
+        for row in data.to_dict('records'):
+            self.service.on_push(RtDataService.kline_to_rt_data(row))
+        return RET_OK, data
+
+
+class RtDataService(object):
+    """
+    实时数据推送服务
+    订阅富途的分时（或1分钟K线）推送，按股票分发给注册的交易引擎。
+    推送线程只负责入队，由分发线程调用引擎，引擎处理慢时同一股票的积压数据只保留最新一条。
+    多个分发线程时不同股票并发处理，同一股票始终串行。
+    """
+
+    def __init__(self, quote_ctx_factory: typing.Optional[typing.Callable[[], OpenQuoteContext]] = None,
+                 use_kline_push: bool = False, queue_size: int = 1024, dispatch_threads: int = 1):
+        """
+        :param quote_ctx_factory: 创建行情连接的函数，为空时不订阅富途（使用 RtDataReplayer 回放）
+        :param use_kline_push: True 订阅1分钟K线推送， False 订阅分时推送
+        :param queue_size: 队列中最多积压的股票数
+        :param dispatch_threads: 分发线程数
+        """
+        self.quote_ctx_factory = quote_ctx_factory
+        self.use_kline_push = use_kline_push
+        self.queue = RtDataQueue(queue_size)
+        self.dispatch_threads = max(1, dispatch_threads)
+        self.engines: typing.Dict[str, list] = {}
+        self.logger = logging.getLogger("rt_data_service")
+        self._quote_ctx: typing.Optional[OpenQuoteContext] = None
+        self._dispatch_thread_list: typing.List[threading.Thread] = []
+        self._running = False
+
+    def register_engine(self, engine):
+        """
+        注册交易引擎，需要在 start 之前调用
+        :param engine: TradeEngine
+        :return:
+        """
+        self.engines.setdefault(engine.stock_code, []).append(engine)
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for i in range(self.dispatch_threads):
+            thread = threading.Thread(target=self._dispatch_loop, name=f"rt_data_dispatch_{i}", daemon=True)
+            thread.start()
+            self._dispatch_thread_list.append(thread)
+        if self.quote_ctx_factory is not None:
+            self._subscribe()
+
+    def stop(self):
+        self._running = False
+        if self._quote_ctx is not None:
+            self._quote_ctx.close()
+            self._quote_ctx = None
+        for thread in self._dispatch_thread_list:
+            thread.join()
+        self._dispatch_thread_list = []
+        self.logger.info(f"rt data service stopped. queue metrics {self.queue.metrics()}")
+
+    def metrics(self) -> dict:
+        """
+        入口队列的深度、合并 / 丢弃计数和排队延迟
+        """
+        return self.queue.metrics()
+
+    def on_push(self, cur_data: dict):
+        """
+        推送数据入队（推送线程 / 回放调用）
+        :param cur_data: 分时回调数据 code,time,cur_price,...
+        :return:
+        """
+        if cur_data["code"] not in self.engines:
+            return
+        self.queue.put(cur_data)
+
+    @staticmethod
+    def kline_to_rt_data(row: dict) -> dict:
+        """
+        K线数据转换为分时回调的数据格式
+        """
+        return {
+            "code": row["code"],
+            "time": row["time_key"],
+            "cur_price": row["close"],
+            "last_close": row.get("last_close"),
+            "volume": row.get("volume"),
+            "turnover": row.get("turnover")
+        }
+
+    def _subscribe(self):
+        quote_ctx = self.quote_ctx_factory()
+        quote_ctx.set_handler(_RtDataPushHandler(self))
+        quote_ctx.set_handler(_CurKlinePushHandler(self))
+        sub_type = SubType.K_1M if self.use_kline_push else SubType.RT_DATA
+        stock_codes = list(self.engines.keys())
+        ret, data = quote_ctx.subscribe(stock_codes, [sub_type])
+        if ret != RET_OK:
+            quote_ctx.close()
+            raise Exception(f"subscribe {stock_codes} {sub_type} failed: {data}")
+        self.logger.info(f"subscribe {stock_codes} {sub_type} ok.")
+        self._quote_ctx = quote_ctx
+
+    def _dispatch_loop(self):
+        while self._running:
+            cur_data = self.queue.get(timeout=0.5)
+            if cur_data is None:
+                continue
+            try:
+                for engine in self.engines.get(cur_data["code"], []):
+                    engine.on_rt_data(cur_data)
+            except Exception as e:
+                self.logger.exception(f"dispatch rt data {cur_data['code']} {cur_data.get('time')} failed: {e}")
+            finally:
+                self.queue.task_done(cur_data["code"])
+
+
+class RtDataReplayer(object):
+    """
+    本地回放： 把K线按时间顺序当作推送数据送入 RtDataService，用于离线测试
+    """
+
+    def __init__(self, service: RtDataService, kline_df: pd.DataFrame, interval: float = 0,
+                 wait_each: bool = False):
+        """
+        :param service:
+        :param kline_df: 列名至少包含 code,time_key,close
+        :param interval: 两条推送之间的间隔 s
+        :param wait_each: 是否等每条数据处理完再推下一条（关闭合并，逐条回放）
+        """
+        self.service = service
+        self.kline_df = kline_df
+        self.interval = interval
+        self.wait_each = wait_each
+
+    def run(self):
+        for row in self.kline_df.to_dict('records'):
+            self.service.on_push(RtDataService.kline_to_rt_data(row))
+            if self.wait_each:
+                self.service.queue.join()
+            if self.interval > 0:
+                time.sleep(self.interval)
+        self.service.queue.join()
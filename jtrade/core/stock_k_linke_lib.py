@@ -6,113 +6,425 @@
 @create: 2024/10/18
 """
 import typing
-import datetime
+import math
+import time
+import numpy as np
 import pandas as pd
-import pytz
-from jtrade.models.mysql_backend import StockKLineDto, StockKLineRepo, DtoUtil
+from jtrade.models.mysql_backend import StockKLineDto, StockKLineRepo, StockKLineCoverageRepo
+from jtrade.models.kline_column_store import StockKLineColumnStore
 from jtrade.core.futu_sdk import FutuSdk
+from jtrade.core.kline_buffer import KLineRingBuffer
+from jtrade.core.kline_rollup import KLineRollup
+from jtrade.core.kline_coverage import KLineCoverageIndex
+from jtrade.core.kline_block_cache import KLineBlockCache, get_block_cache
+from jtrade.core.kline_shared_memory import SharedKLineSegment, KLineSharedCatalog
+from jtrade.utils import date_utils, hk_trade_calendar
 from futu import KLType
 
 
 class StockKLineLib(object):
     """
     股票K线数据lib
+    内部以 int64 epoch 分钟（time 列）作为时间索引，time_key 字符串只在查询结果和外部接口处生成
     """
 
+    # 日块缓存保存的列
+    BLOCK_COLUMNS = [c for c in KLineRingBuffer.COLUMNS if c != 'code']
+
     def __init__(self, stock_code: str,  repo: StockKLineRepo, futu_sdk: FutuSdk, time_unit: int = 1,
-                 force_sync_from_futu: bool = False):
+                 force_sync_from_futu: bool = False, column_store: typing.Optional[StockKLineColumnStore] = None,
+                 cache_keep_days: typing.Optional[int] = None, rollup_units: typing.Optional[typing.List[int]] = None,
+                 coverage_repo: typing.Optional[StockKLineCoverageRepo] = None,
+                 block_cache: typing.Optional[KLineBlockCache] = None,
+                 shared_segment: typing.Optional[SharedKLineSegment] = None, compact: bool = False,
+                 columns: typing.Optional[typing.List[str]] = None):
+        """
+        :param stock_code:
+        :param repo: 数据库K线存储
+        :param futu_sdk:
+        :param time_unit: K线时间单位 min
+        :param force_sync_from_futu: 是否强制从富途同步
+        :param column_store: 本地列式存储，位于内存缓存和数据库之间，为空时直接查询数据库
+        :param cache_keep_days: 内存缓存保留的天数，应不小于策略需要的最大窗口；为空时不淘汰
+        :param rollup_units: 由缓存K线增量合成的高周期（min），如 [5, 15, 60, 1440]
+        :param coverage_repo: 已同步区间的存储，配置后只向富途请求真正缺失的交易时段（包括中间的空洞）
+        :param block_cache: 已收盘交易日的K线日块缓存，默认使用进程内共享的缓存
+        :param shared_segment: 其他进程发布的共享内存K线，内存缓存直接使用其只读视图（只有 SharedKLineSegment.COLUMNS 列）
+        :param compact: 内存缓存和日块缓存使用紧凑表示（float32 价格、int64 成交量），且不保存 code 列
+        :param columns: 内存缓存只保留的列（time 总是保留），如 ['close']；为空时保留全部列
+        """
         self.stock_code = stock_code
         self.time_unit = time_unit
+        self.compact = compact
         self.repo = repo
+        self.column_store = column_store
         self.force_sync_from_futu = force_sync_from_futu
-        self.timezone = pytz.timezone('Asia/Shanghai')
-        self.df: typing.Optional[pd.DataFrame] = None
-        self.df_min_query_time = None
+        self.cache_keep_days = cache_keep_days
+        self.shared_segment = shared_segment
+        if shared_segment is not None:
+            self.buffer = KLineRingBuffer.wrap(shared_segment.columns)
+        else:
+            buffer_columns = [c for c in KLineRingBuffer.COLUMNS if not (compact and c == 'code')]
+            if columns is not None:
+                buffer_columns = [c for c in buffer_columns if c == 'time' or c in columns]
+            self.buffer = KLineRingBuffer(
+                column_names=buffer_columns,
+                column_dtypes=KLineRingBuffer.COMPACT_COLUMN_DTYPES if compact else None
+            )
+        self.rollups: typing.Dict[int, KLineRollup] = {
+            unit: KLineRollup(unit) for unit in (rollup_units or []) if unit != time_unit
+        }
+        if len(self.rollups) > 0:
+            missing_columns = [c for c in KLineRollup.COLUMNS if c not in self.buffer.column_names]
+            if len(missing_columns) > 0:
+                raise ValueError(f"rollup need columns {missing_columns}")
+        # 内存缓存覆盖的最早查询时间 epoch 分钟
+        self.df_min_query_time: typing.Optional[int] = None
+        if shared_segment is not None and len(shared_segment) > 0:
+            self.df_min_query_time = shared_segment.begin_time
         self.futu_sdk = futu_sdk
+        self.block_cache = block_cache if block_cache is not None else get_block_cache()
+        # 日块缓存中列的 dtype
+        block_dtypes = KLineRingBuffer.COMPACT_COLUMN_DTYPES if compact else KLineRingBuffer.COLUMN_DTYPES
+        self.block_dtypes = {c: block_dtypes.get(c, 'float64') for c in self.BLOCK_COLUMNS}
+        # dtype 一致时内存缓存直接引用日块（共享段模式），不拷贝
+        self.share_blocks = all(
+            np.dtype(self.buffer.column_dtypes.get(c, 'float64')) == np.dtype(self.block_dtypes[c])
+            for c in self.buffer.column_names if c != 'code'
+        )
+        self.coverage: typing.Optional[KLineCoverageIndex] = None
+        if coverage_repo is not None:
+            self.coverage = KLineCoverageIndex(coverage_repo)
 
-    def query(self, begin_time: str, end_time: str) -> pd.DataFrame:
+    def query(self, begin_time: str | float, end_time: str | float) -> pd.DataFrame:
         """
         需要优先从本地的df中查询，如果查询不到，再从外部同步
-        :param begin_time:
-        :param end_time:
+        :param begin_time: yyyy-mm-dd[ HH[:MM[:SS]]] 或者 时间戳
+        :param end_time: yyyy-mm-dd[ HH[:MM[:SS]]] 或者 时间戳
+        :return: pd.DataFrame
+            列名： code,time_key,open,close,high,low,pe_ratio,turnover_rate,volume,turnover,change_rate,last_close,time
+            compact / columns 时只包含内存缓存保留的列（以及 time_key）；数值列为内存缓存的只读视图
+        """
+        begin_time, end_time = self.ensure_range(begin_time, end_time)
+        return self.buffer.query(begin_time, end_time)
+
+    def ensure_range(self, begin_time: str | float, end_time: str | float) -> typing.Tuple[int, int]:
+        """
+        保证内存缓存（buffer）覆盖查询范围，供直接读取 buffer 的调用方使用
+        :param begin_time: yyyy-mm-dd[ HH[:MM[:SS]]] 或者 时间戳
+        :param end_time: yyyy-mm-dd[ HH[:MM[:SS]]] 或者 时间戳
+        :return: (begin_time, end_time) epoch 分钟
+        """
+        begin_time = self._to_begin_epoch_min(begin_time)
+        end_time = self._to_end_epoch_min(end_time)
+        self._ensure(begin_time, end_time)
+        return begin_time, end_time
+
+    def query_rollup(self, time_unit: int, begin_time: str | float, end_time: str | float) -> pd.DataFrame:
+        """
+        查询由缓存K线合成的高周期K线
+        :param time_unit: 合成周期 min, 需要在 rollup_units 中
+        :param begin_time: yyyy-mm-dd[ HH[:MM[:SS]]] 或者 时间戳
+        :param end_time: yyyy-mm-dd[ HH[:MM[:SS]]] 或者 时间戳
         :return: pd.DataFrame
-            列名： code,time_key,open,close,high,low,pe_ratio,turnover_rate,volume,turnover,change_rate,last_close
+            列名： time_key,open,close,high,low,volume,turnover,time
+        """
+        rollup = self.rollups.get(time_unit)
+        if rollup is None:
+            raise ValueError(f"rollup time unit {time_unit} not configured")
+        begin_time = self._to_begin_epoch_min(begin_time)
+        end_time = self._to_end_epoch_min(end_time)
+        # 第一根合成K线需要完整的周期数据
+        self._ensure(begin_time - time_unit, end_time)
+        return rollup.query(begin_time, end_time)
+
+    def publish_shared(self, catalog: KLineSharedCatalog, begin_time: str | float,
+                       end_time: str | float) -> SharedKLineSegment:
+        """
+        把 [begin_time, end_time] 的K线发布到共享内存，供工作进程以 shared_segment 零拷贝使用
+        :param catalog: 共享K线目录
+        :param begin_time: yyyy-mm-dd[ HH[:MM[:SS]]] 或者 时间戳
+        :param end_time: yyyy-mm-dd[ HH[:MM[:SS]]] 或者 时间戳
+        :return:
         """
-        begin_time = self._format_start_time_str(begin_time)
-        end_time = self._format_end_time_str(end_time)
-        if self.df_min_query_time is None or self.df is None or len(self.df) == 0 or begin_time < self.df_min_query_time:
+        begin_time = self._to_begin_epoch_min(begin_time)
+        end_time = self._to_end_epoch_min(end_time)
+        self._ensure(begin_time, end_time)
+        return catalog.publish(self.stock_code, self.time_unit, begin_time, {
+            c: self.buffer.column(c, begin_time, end_time) for c in SharedKLineSegment.COLUMNS
+        })
+
+    def _ensure(self, begin_time: int, end_time: int):
+        """
+        保证内存缓存覆盖 [begin_time, end_time]
+        :param begin_time: epoch 分钟
+        :param end_time: epoch 分钟
+        :return:
+        """
+        if self.df_min_query_time is None or len(self.buffer) == 0 or begin_time < self.df_min_query_time:
             # 需要清空缓存，从投开始同步
-            self.df = None
+            self.buffer.clear()
+            for rollup in self.rollups.values():
+                rollup.reset()
+            self.df_min_query_time = None
             need_sync_begin_time = begin_time
             need_sync_end_time = end_time
         else:
-            df_end_time = self.df['time_key'].iloc[-1]
+            df_end_time = self.buffer.last_time()
             if df_end_time >= end_time:
                 # 无需同步数据
                 need_sync_begin_time = None
                 need_sync_end_time = None
             else:
-                need_sync_begin_time = self._add_time(df_end_time, self.time_unit * 60)
+                need_sync_begin_time = df_end_time + self.time_unit
                 need_sync_end_time = end_time
         if need_sync_begin_time is not None and need_sync_end_time is not None:
             self._query(need_sync_begin_time, need_sync_end_time)
         if self.df_min_query_time is None or begin_time < self.df_min_query_time:
             self.df_min_query_time = begin_time
-        return self.df[(self.df['time_key'] >= begin_time) & (self.df['time_key'] <= end_time)]
+        self._evict_expired(end_time)
 
-    def _query(self, begin_time: str | float, end_time: str | float) -> pd.DataFrame:
+    def _query(self, begin_time: int, end_time: int):
         if self.force_sync_from_futu:
-            df = self._sync_kline_from_futu(begin_time, end_time)
+            parts = [self._sync_kline_from_futu(begin_time, end_time)]
+            if self.coverage is not None:
+                self.mark_synced(begin_time, end_time)
+                self.coverage.save()
+        elif self.coverage is not None:
+            # 先补齐缺失的交易时段，再从本地读取
+            for sync_begin_time, sync_end_time in self.plan_sync(begin_time, end_time):
+                self._sync_kline_from_futu(sync_begin_time, sync_end_time)
+                self.mark_synced(sync_begin_time, sync_end_time)
+            self.coverage.save()
+            parts = self._load_local_parts(begin_time, end_time)
         else:
-            df = self._convert_list_to_df(self.repo.query(begin_time, end_time))
+            parts = self._load_local_parts(begin_time, end_time)
             need_sync_begin_time = begin_time
-            if len(df) > 0:
-                last_time_key = df['time_key'].iloc[-1]
-                need_sync_begin_time = self._add_time(last_time_key, self.time_unit * 60)
-            if need_sync_begin_time <= end_time:
+            if len(parts) > 0:
+                need_sync_begin_time = int(np.asarray(parts[-1]['time'])[-1]) + self.time_unit
+            if hk_trade_calendar.clip_trading_range(need_sync_begin_time, end_time) is not None:
                 # 需要从外部同步数据
-                sync_df = self._sync_kline_from_futu(need_sync_begin_time, end_time)
-                # print(df.columns)
-                # print(sync_df.columns)
-                # print(df)
-                # print(sync_df)
-                if df is None or len(df) == 0:
-                    df = sync_df
-                else:
-                    df = pd.concat([df, sync_df], ignore_index=True)
-        if self.df is None:
-            self.df = df
-        else:
-            # 合并两个 DataFrame
-            merged_df = pd.concat([self.df, df], ignore_index=True)
-            # 去除 time_key 列值相同的行
-            merged_df = merged_df.drop_duplicates(subset='time_key', keep='last')
-            # 重新设置索引和排序
-            self.df = merged_df.sort_values(by='time_key').reset_index(drop=True)
-        return df
+                parts.append(self._sync_kline_from_futu(need_sync_begin_time, end_time))
+        self._append_parts(parts)
+        for rollup in self.rollups.values():
+            rollup.update(self.buffer)
 
-    def _format_time_str(self, time_str: str | float):
-        if isinstance(time_str, float):
-            utc_time = datetime.datetime.utcfromtimestamp(time_str).replace(tzinfo=pytz.utc)
-            local_time = utc_time.astimezone(self.timezone)
-            formatted_time = local_time.strftime('%Y-%m-%d %H:%M:%S')
-            return formatted_time
-        if len(time_str) == 19:
-            return time_str
-        if len(time_str) == 10:
-            return time_str + ' 00:00:00'
-        if len(time_str) == 13:
-            return time_str + ':00:00'
-        if len(time_str) == 16:
-            return time_str + ':00'
-        raise ValueError('time_str format error')
+    def _append_parts(self, parts: typing.List[typing.Union[pd.DataFrame, typing.Dict[str, np.ndarray]]]):
+        """
+        把加载的K线追加到内存缓存： 缓存为空且全部来自日块缓存时直接引用日块，否则拼接后追加
+        :param parts: 按时间排序的 DataFrame 或日块视图（列名 -> ndarray）
+        """
+        parts = [part for part in parts if len(part['time']) > 0]
+        if len(parts) == 0:
+            return
+        if self.share_blocks and len(self.buffer) == 0 and all(isinstance(part, dict) for part in parts):
+            constants = {'code': self.stock_code} if 'code' in self.buffer.column_names else None
+            self.buffer.assign_segments(parts, constants)
+            return
+        dfs = []
+        for part in parts:
+            if isinstance(part, dict):
+                part = pd.DataFrame(part, copy=False)
+                if 'code' in self.buffer.column_names:
+                    part.insert(0, 'code', self.stock_code)
+            dfs.append(part)
+        self.buffer.append(dfs[0] if len(dfs) == 1 else pd.concat(dfs, ignore_index=True))
+
+    def plan_sync(self, begin_time: int, end_time: int) -> typing.List[typing.Tuple[int, int]]:
+        """
+        根据覆盖索引和交易时段，计算 [begin_time, end_time] 中需要从富途同步的区间
+        未配置覆盖索引时只去掉首尾的非交易时段
+        :return: [(begin_time, end_time)] epoch 分钟，首尾都是交易分钟
+        """
+        if self.coverage is None:
+            clipped = hk_trade_calendar.clip_trading_range(begin_time, end_time)
+            return [] if clipped is None else [clipped]
+        plan = []
+        for gap_begin_time, gap_end_time in self.coverage.missing(begin_time, end_time):
+            clipped = hk_trade_calendar.clip_trading_range(gap_begin_time, gap_end_time)
+            if clipped is None:
+                # 非交易时段（夜间、午休、周末）
+                continue
+            if self.time_unit == 1 and clipped[1] - clipped[0] >= hk_trade_calendar.DAY_MINUTES:
+                # 大段缺失时，先把数据库中已完整的交易日记入覆盖索引
+                self._seed_coverage_from_db(clipped[0], clipped[1])
+                for b, e in self.coverage.missing(clipped[0], clipped[1]):
+                    sub_clipped = hk_trade_calendar.clip_trading_range(b, e)
+                    if sub_clipped is not None:
+                        plan.append(sub_clipped)
+            else:
+                plan.append(clipped)
+        return plan
+
+    def _seed_coverage_from_db(self, begin_time: int, end_time: int):
+        counts = self.repo.count_by_day(date_utils.epoch_min2time_str(begin_time),
+                                        date_utils.epoch_min2time_str(end_time))
+        for day_str, count in counts.items():
+            if count < hk_trade_calendar.HK_DAY_KLINE_COUNT:
+                continue
+            day = (date_utils.time_str2epoch_min(day_str + " 00:00:00") + date_utils.HK_UTC_OFFSET_MINUTES) \
+                // hk_trade_calendar.DAY_MINUTES
+            self.coverage.add(*hk_trade_calendar.day_range(day))
+
+    def mark_synced(self, begin_time: int, end_time: int):
+        """
+        记录区间已同步，尚未走完的分钟不记录
+        """
+        if self.coverage is None:
+            return
+        last_closed_time = int(time.time() // 60) - 1
+        self.coverage.add(begin_time, min(end_time, last_closed_time))
 
-    def _format_start_time_str(self, time_str: str | float):
-        if isinstance(time_str, float):
-            utc_time = datetime.datetime.utcfromtimestamp(time_str).replace(tzinfo=pytz.utc)
-            local_time = utc_time.astimezone(self.timezone)
-            formatted_time = local_time.strftime('%Y-%m-%d %H:%M:%S')
-            return formatted_time
+    def _evict_expired(self, end_time: int):
+        """
+        淘汰早于 end_time 之前保留天数的缓存数据，并相应调整缓存覆盖的最早查询时间
+        """
+        if self.cache_keep_days is None or len(self.buffer) == 0:
+            return
+        expire_time = end_time - self.cache_keep_days * 24 * 60
+        if expire_time <= self.df_min_query_time:
+            return
+        self.buffer.evict_before(expire_time)
+        for rollup in self.rollups.values():
+            rollup.evict_before(expire_time)
+        self.df_min_query_time = expire_time
+
+    def _load_local_parts(self, begin_time: int,
+                          end_time: int) -> typing.List[typing.Union[pd.DataFrame, typing.Dict[str, np.ndarray]]]:
+        """
+        加载本地K线： 已收盘的交易日经过进程内共享的日块缓存，当天的数据直接读取存储
+        :param begin_time: epoch 分钟
+        :param end_time: epoch 分钟
+        :return: 按时间排序的日块视图（列名 -> 只读 ndarray）和 DataFrame
+        """
+        today = self._day_of(int(time.time() // 60))
+        today_begin_time = hk_trade_calendar.day_range(today)[0]
+        parts = []
+        if begin_time < today_begin_time:
+            parts.extend(self._load_cached_days(begin_time, min(end_time, today_begin_time - 1)))
+        if end_time >= today_begin_time:
+            parts.append(self._load_store_or_db(max(begin_time, today_begin_time), end_time))
+        return [part for part in parts if len(part['time']) > 0]
+
+    def _load_cached_days(self, begin_time: int, end_time: int) -> typing.List[typing.Dict[str, np.ndarray]]:
+        """
+        按交易日读取日块缓存，缺失的连续交易日合并为一次查询加载后放入缓存
+        :return: 每个交易日在 [begin_time, end_time] 内的日块视图，只包含内存缓存需要的列，不拷贝
+        """
+        cache = self.block_cache
+        first_day = self._day_of(begin_time)
+        last_day = self._day_of(end_time)
+        blocks = {}
+        missing_days = []
+        for day in range(first_day, last_day + 1):
+            block = cache.get((self.stock_code, self.time_unit, day, self.compact))
+            if block is None:
+                missing_days.append(day)
+            else:
+                blocks[day] = block
+        # 缺失的日期按连续区间分组加载
+        runs = []
+        for day in missing_days:
+            if len(runs) > 0 and runs[-1][1] == day - 1:
+                runs[-1][1] = day
+            else:
+                runs.append([day, day])
+        for run_first_day, run_last_day in runs:
+            df = self._load_store_or_db(hk_trade_calendar.day_range(run_first_day)[0],
+                                        hk_trade_calendar.day_range(run_last_day)[1])
+            times = df['time'].to_numpy(dtype='int64')
+            for day in range(run_first_day, run_last_day + 1):
+                day_begin_time, day_end_time = hk_trade_calendar.day_range(day)
+                begin_idx = int(np.searchsorted(times, day_begin_time, side='left'))
+                end_idx = int(np.searchsorted(times, day_end_time, side='right'))
+                blocks[day] = cache.put((self.stock_code, self.time_unit, day, self.compact), {
+                    c: KLineRingBuffer.to_array(df[c].iloc[begin_idx: end_idx], self.block_dtypes[c])
+                    for c in self.BLOCK_COLUMNS
+                })
+        load_columns = [c for c in self.BLOCK_COLUMNS if c in self.buffer.column_names]
+        parts = []
+        for day in range(first_day, last_day + 1):
+            times = blocks[day]['time']
+            begin_idx = int(np.searchsorted(times, begin_time, side='left'))
+            end_idx = int(np.searchsorted(times, end_time, side='right'))
+            if end_idx > begin_idx:
+                parts.append({c: blocks[day][c][begin_idx: end_idx] for c in load_columns})
+        return parts
+
+    @staticmethod
+    def _day_of(epoch_min: int) -> int:
+        """
+        epoch 分钟所在的北京时间 epoch 天数
+        """
+        return (epoch_min + date_utils.HK_UTC_OFFSET_MINUTES) // hk_trade_calendar.DAY_MINUTES
+
+    def _load_store_or_db(self, begin_time: int, end_time: int) -> pd.DataFrame:
+        """
+        优先从本地列式存储中读取，本地未覆盖的部分再查询数据库，并回写到本地存储
+        :param begin_time: epoch 分钟
+        :param end_time: epoch 分钟
+        :return:
+        """
+        store = self.column_store
+        if store is None:
+            return self._query_db(begin_time, end_time)
+        store_begin_time = store.begin_time()
+        if store_begin_time is None:
+            # 本地存储为空，全部从数据库加载
+            df = self._query_db(begin_time, end_time)
+            store.store(df, begin_time)
+            return df
+        if begin_time < store_begin_time:
+            # 本地存储未覆盖开始时间，只从数据库加载之前的部分（数据库可能是不持久化的内存后端）
+            head_end_time = min(end_time, store_begin_time - self.time_unit)
+            head_df = self._query_db(begin_time, head_end_time)
+            if hk_trade_calendar.clip_trading_range(head_end_time + self.time_unit,
+                                                    store_begin_time - self.time_unit) is None:
+                # 与本地存储相接时才写入，本地存储始终是一段连续的K线
+                store.store(head_df, begin_time)
+            if end_time < store_begin_time:
+                return head_df
+            df = self._load_store_or_db(store_begin_time, end_time)
+            if len(head_df) == 0:
+                return df
+            return head_df if len(df) == 0 else pd.concat([head_df, df], ignore_index=True)
+        df = store.query(begin_time, end_time)
+        store_end_time = store.end_time()
+        if store_end_time is not None and store_end_time >= end_time:
+            return df
+        if store_end_time is None:
+            # 只记录了开始时间，还没有K线
+            store_end_time = store_begin_time - self.time_unit
+        db_begin_time = max(begin_time, store_end_time + self.time_unit)
+        db_df = self._query_db(db_begin_time, end_time)
+        if len(db_df) == 0:
+            return df
+        if hk_trade_calendar.clip_trading_range(store_end_time + self.time_unit,
+                                                db_begin_time - self.time_unit) is None:
+            store.store(db_df)
+        if len(df) == 0:
+            return db_df
+        return pd.concat([df, db_df], ignore_index=True)
+
+    def _query_db(self, begin_time: int, end_time: int) -> pd.DataFrame:
+        return self._convert_list_to_df(self.repo.query(
+            date_utils.epoch_min2time_str(begin_time), date_utils.epoch_min2time_str(end_time)
+        ))
+
+    def _to_begin_epoch_min(self, time_str: str | float) -> int:
+        if isinstance(time_str, (float, int)):
+            # 时间戳，向上取整到分钟
+            return math.ceil(time_str / 60)
+        return date_utils.time_str2epoch_min(self._format_start_time_str(time_str))
+
+    def _to_end_epoch_min(self, time_str: str | float) -> int:
+        if isinstance(time_str, (float, int)):
+            # 时间戳，向下取整到分钟
+            return math.floor(time_str / 60)
+        return date_utils.time_str2epoch_min(self._format_end_time_str(time_str))
+
+    @staticmethod
+    def _format_start_time_str(time_str: str):
         if len(time_str) == 19:
             return time_str
         if len(time_str) == 10:
@@ -123,12 +435,8 @@ class StockKLineLib(object):
             return time_str + ':00'
         raise ValueError('time_str format error')
 
-    def _format_end_time_str(self, time_str: str | float):
-        if isinstance(time_str, float):
-            utc_time = datetime.datetime.utcfromtimestamp(time_str).replace(tzinfo=pytz.utc)
-            local_time = utc_time.astimezone(self.timezone)
-            formatted_time = local_time.strftime('%Y-%m-%d %H:%M:%S')
-            return formatted_time
+    @staticmethod
+    def _format_end_time_str(time_str: str):
         if len(time_str) == 19:
             return time_str
         if len(time_str) == 10:
@@ -139,32 +447,85 @@ class StockKLineLib(object):
             return time_str + ':00'
         raise ValueError('time_str format error')
 
-    def _add_time(self, time_str: str, time_delta: int):
-        time_str = self._format_time_str(time_str)
-        local_time = datetime.datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S')
-        local_time = self.timezone.localize(local_time)
-        utc_time = local_time.astimezone(pytz.utc)
-        timestamp = utc_time.timestamp()
-        return self._format_time_str(timestamp + time_delta)
+    def _sync_kline_from_futu(self, need_sync_begin_time: int, end_time: int) -> pd.DataFrame:
+        res_df = self.fetch_kline_from_futu(need_sync_begin_time, end_time)
+        self.store_kline(res_df)
+        return res_df
 
-    def _sync_kline_from_futu(self, need_sync_begin_time: str, end_time: str) -> pd.DataFrame:
-        res_df = self.futu_sdk.query_kline(self.stock_code, need_sync_begin_time, end_time, self._get_kline_type())
+    def fetch_kline_from_futu(self, begin_time: int, end_time: int) -> pd.DataFrame:
+        """
+        从富途拉取 [begin_time, end_time] 的K线（不写入存储）
+        :param begin_time: epoch 分钟
+        :param end_time: epoch 分钟
+        :return: pd.DataFrame 列名同 query
+        """
+        res_df = self.futu_sdk.query_kline(self.stock_code,
+                                           date_utils.epoch_min2time_str(begin_time),
+                                           date_utils.epoch_min2time_str(end_time),
+                                           self._get_kline_type())
         res_df = res_df.drop(columns=['name'])
-        # 需要将这些数据保存到数据库
-        stock_dto_list = []
-        for index, row in res_df.iterrows():
-            row_dict = row.to_dict()
-            row_dict["stock_code"] = row_dict["code"]
-            row_dict["time_unit"] = self.time_unit
-            stock_dto_list.append(DtoUtil.from_dict(StockKLineDto(), row_dict))
-        self.repo.store(stock_dto_list)
+        res_df['time'] = date_utils.time_strs2epoch_mins(res_df['time_key'].to_numpy())
         return res_df
 
+    def store_kline(self, df: pd.DataFrame, to_db: bool = True, to_column_store: bool = True):
+        """
+        将富途拉取的K线保存到数据库和本地列式存储
+        :param df: fetch_kline_from_futu 的结果
+        :param to_db: 是否写入数据库
+        :param to_column_store: 是否写入本地列式存储
+        :return:
+        """
+        if to_db:
+            # 按列整体转换后批量写入
+            db_df = df.rename(columns={'code': 'stock_code'})
+            db_df['time_unit'] = self.time_unit
+            self.repo.bulk_store(db_df[StockKLineDto.columns].to_dict('records'))
+        if to_column_store and self.column_store is not None and self._is_store_contiguous(df):
+            self.column_store.store(df)
+        if len(df) > 0:
+            # 日块缓存中对应交易日的数据已过期
+            days = np.unique(self._day_of(df['time'].to_numpy(dtype='int64')))
+            self.block_cache.invalidate(self.stock_code, self.time_unit, days)
+
+    def fill_column_store(self, begin_time: int, end_time: int):
+        """
+        从数据库把 [begin_time, end_time] 的K线补齐到本地列式存储（只写入与已有数据相接的部分），
+        如预取只写入数据库之后；调用方需保证数据库中该范围的K线完整
+        :param begin_time: epoch 分钟
+        :param end_time: epoch 分钟
+        """
+        if self.column_store is not None:
+            self._load_store_or_db(begin_time, end_time)
+
+    def _is_store_contiguous(self, df: pd.DataFrame) -> bool:
+        """
+        _load_store_or_db 把本地存储的 [begin_time, end_time] 当作一段完整的K线，
+        与已有数据之间隔着交易分钟的K线（如按覆盖索引只同步的空洞）不能写入，之后读取时从数据库连续补齐
+        """
+        store_begin_time = self.column_store.begin_time()
+        if len(df) == 0 or store_begin_time is None:
+            return True
+        times = df['time'].to_numpy(dtype='int64')
+        first_time, last_time = int(times.min()), int(times.max())
+        store_end_time = self.column_store.end_time()
+        if store_end_time is None:
+            # 只记录了开始时间，还没有K线
+            store_end_time = store_begin_time - self.time_unit
+        if first_time > store_end_time and \
+                hk_trade_calendar.clip_trading_range(store_end_time + self.time_unit,
+                                                     first_time - self.time_unit) is not None:
+            return False
+        if last_time < store_begin_time and \
+                hk_trade_calendar.clip_trading_range(last_time + self.time_unit,
+                                                     store_begin_time - self.time_unit) is not None:
+            return False
+        return True
+
     @staticmethod
     def _convert_list_to_df(k_list: typing.List[StockKLineDto]):
         """
         将k线列表转换为DataFrame
-        列名： code,time_key,open,close,high,low,pe_ratio,turnover_rate,volume,turnover,change_rate,last_close
+        列名： code,time_key,open,close,high,low,pe_ratio,turnover_rate,volume,turnover,change_rate,last_close,time
         :param k_list:
         :return:
         """
@@ -177,9 +538,17 @@ class StockKLineLib(object):
                     c = 'stock_code'
                 row.append(item.__getattribute__(c))
             data.append(row)
-        return pd.DataFrame(data, columns=columns)
+        df = pd.DataFrame(data, columns=columns)
+        df['time'] = date_utils.time_strs2epoch_mins(df['time_key'].to_numpy(dtype=object))
+        return df
 
     def _get_kline_type(self):
-        if self.time_unit == 1:
-            return KLType.K_1M
-        return KLType.NONE
+        return {
+            1: KLType.K_1M,
+            3: KLType.K_3M,
+            5: KLType.K_5M,
+            15: KLType.K_15M,
+            30: KLType.K_30M,
+            60: KLType.K_60M,
+            1440: KLType.K_DAY
+        }.get(self.time_unit, KLType.NONE)
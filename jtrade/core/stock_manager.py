@@ -5,10 +5,16 @@
 @author: jkguo
 @create: 2024/10/18
 """
+import contextlib
+import threading
 import typing
 import logging
+from datetime import datetime
 from jtrade.core.account import Account
-from jtrade.models.dto import StockDto, TradeOrderDto, StockStatus, TradeOrderStatus
+from jtrade.core.position_book import StockPositionBook
+from jtrade.models.mysql_backend import UnitOfWork
+from jtrade.models.dto import StockDto, TradeOrderDto, StockStatus, TradeOrderStatus, DtoUtil
+from jtrade.utils.fee_util import calc_hk_ext_fee
 from jtrade.core.trade_context import get_context
 from futu import TrdSide
 
@@ -18,38 +24,69 @@ class StockManager(object):
     股票管理器
     """
 
-    def __init__(self, account: Account, stock_code: str):
+    def __init__(self, account: Account, stock_code: str,
+                 persist_mode: str = StockPositionBook.WRITE_THROUGH):
         """
         :param account:
         :param stock_code:
+        :param persist_mode: 持仓簿写库方式 StockPositionBook.WRITE_THROUGH /
+                             WRITE_BEHIND（工作单元中的修改在提交前批量写入同一事务）
         """
         self.account = account
         self.stock_code = stock_code
         self.logger = logging.getLogger("stock_manager")
-
-    def load_all_valid_stocks(self) -> typing.Dict[str, StockDto]:
         ctx = get_context()
         ctx.validate_account(self.account.acc_dto)
+        # 持仓以内存为准，只在启动时从数据库加载
+        self.position_book = StockPositionBook(
+            ctx.backend().stock_repo(self.account.account_name), stock_code, persist_mode
+        )
+        # 当前线程 unit_of_work 的嵌套层数，最外层提交前写回持仓簿
+        self._uow_local = threading.local()
+
+    def load_all_valid_stocks(self) -> typing.Dict[str, StockDto]:
         stock_status_list = [
             StockStatus.SELLING, StockStatus.BUYING, StockStatus.HOLDING
         ]
-        res = {}
-        stock_repo = ctx.backend().stock_repo(self.account.account_name)
-        for item in stock_repo.query_all(self.stock_code, stock_status_list):
-            res[item.stock_holding_id] = item
-        return res
+        return self.position_book.query(stock_status_list)
 
     def load_all_sold_stocks(self) -> typing.Dict[str, StockDto]:
-        ctx = get_context()
-        ctx.validate_account(self.account.acc_dto)
         stock_status_list = [
             StockStatus.SOLD
         ]
-        res = {}
-        stock_repo = ctx.backend().stock_repo(self.account.account_name)
-        for item in stock_repo.query_all(self.stock_code, stock_status_list):
-            res[item.stock_holding_id] = item
-        return res
+        return self.position_book.query(stock_status_list)
+
+    @contextlib.contextmanager
+    def unit_of_work(self) -> typing.Iterator[UnitOfWork]:
+        """
+        持股、账户（以及调用方的订单）的修改在一个事务中写库，回滚时从数据库恢复内存状态；
+        write_behind 模式下持仓簿的脏数据在最外层提交前写入同一事务，回滚不会丢失之前已提交的修改；
+        期间持有账户锁，共用账户的其他引擎等待
+        :return:
+        """
+        with self.account.lock, get_context().backend().unit_of_work() as uow:
+            uow.on_rollback(self.reload)
+            depth = getattr(self._uow_local, "depth", 0)
+            self._uow_local.depth = depth + 1
+            try:
+                yield uow
+                if depth == 0 and self.position_book.persist_mode == StockPositionBook.WRITE_BEHIND:
+                    self.position_book.flush()
+            finally:
+                self._uow_local.depth = depth
+
+    def reload(self):
+        """
+        从数据库重新加载账户余额和持仓簿
+        """
+        self.account.reload()
+        self.position_book.load()
+
+    def flush(self):
+        """
+        写回持仓簿中未写库的修改（write_behind 模式）
+        """
+        self.position_book.flush()
 
     def on_stock_submit_selling(self, order: TradeOrderDto):
         """
@@ -57,22 +94,20 @@ class StockManager(object):
         :param order:
         :return:
         """
-        ctx = get_context()
-        ctx.validate_account(self.account.acc_dto)
-        stock_repo = ctx.backend().stock_repo(self.account.account_name)
-        stock = stock_repo.query_by_holding_id(order.stock_code, order.stock_holding_id)
-        if stock is None:
-            raise Exception(f"stock {self.stock_code} {order.stock_holding_id} not found")
-        if stock.status != StockStatus.HOLDING:
-            raise Exception(f"stock {self.stock_code} {order.stock_holding_id} status is not HOLDING")
-        if stock.quantity != order.quantity:
-            raise Exception(f"stock {self.stock_code} {order.stock_holding_id} quantity is not {order.quantity}")
-        stock.status = StockStatus.SELLING
-        stock.sell_price = order.price
-        stock.sell_total_amount = order.total_amount
-        stock.sell_all_ext_fee = order.ext_fee
-        stock.sell_order_id = order.order_id
-        stock_repo.save(stock)
+        with self.unit_of_work():
+            stock = self.position_book.get(order.stock_holding_id)
+            if stock is None:
+                raise Exception(f"stock {self.stock_code} {order.stock_holding_id} not found")
+            if stock.status != StockStatus.HOLDING:
+                raise Exception(f"stock {self.stock_code} {order.stock_holding_id} status is not HOLDING")
+            if stock.quantity != order.quantity:
+                raise Exception(f"stock {self.stock_code} {order.stock_holding_id} quantity is not {order.quantity}")
+            stock.status = StockStatus.SELLING
+            stock.sell_price = order.price
+            stock.sell_total_amount = order.total_amount
+            stock.sell_all_ext_fee = order.ext_fee
+            stock.sell_order_id = order.order_id
+            self.position_book.save(stock)
 
     def on_stock_sell_status_change(self, order: TradeOrderDto):
         """
@@ -80,37 +115,39 @@ class StockManager(object):
         :param order:
         :return:
         """
-        ctx = get_context()
-        ctx.validate_account(self.account.acc_dto)
-        stock_repo = ctx.backend().stock_repo(self.account.account_name)
-        stock = stock_repo.query_by_holding_id(order.stock_code, order.stock_holding_id)
-        if stock is None:
-            raise Exception(f"stock {self.stock_code} {order.stock_holding_id} not found")
-        if stock.status != StockStatus.SELLING:
-            raise Exception(f"stock {self.stock_code} {order.stock_holding_id} status is not SELLING")
-        if order.order_status == TradeOrderStatus.ALL_TRADED:
-            # 全部卖出
-            stock.status = StockStatus.SOLD
-            stock.sell_price = order.price
-            stock.sell_total_amount = order.total_amount
-            stock.sell_all_ext_fee = order.ext_fee
-            stock.sell_time = order.complete_time
-            # 计算收益
-            stock.trade_profit = stock.sell_total_amount - stock.buy_total_amount - stock.sell_all_ext_fee - stock.buy_all_ext_fee
-            # 交易费用结算
-            self.account.add_balance(order.total_amount, f"卖出股票 {order.stock_code} {order.stock_holding_id}")
-            self.account.sub_balance(order.ext_fee, f"交易费用 {order.stock_code} {order.order_id}")
-            stock_repo.save(stock)
-        elif order.order_status == TradeOrderStatus.CANCELLED:
-            # 取消卖出
-            stock.status = StockStatus.HOLDING
-            stock.sell_price = 0
-            stock.sell_total_amount = 0
-            stock.sell_all_ext_fee = 0
-            stock_repo.save(stock)
-        else:
-            # 其他状态
-            self.logger.info(f"stock {self.stock_code} {order.stock_holding_id} {order.order_status} ignored.")
+        with self.unit_of_work():
+            stock = self.position_book.get(order.stock_holding_id)
+            if stock is None:
+                raise Exception(f"stock {self.stock_code} {order.stock_holding_id} not found")
+            if stock.status != StockStatus.SELLING:
+                raise Exception(f"stock {self.stock_code} {order.stock_holding_id} status is not SELLING")
+            if order.order_status == TradeOrderStatus.ALL_TRADED:
+                # 全部卖出，按成交均价结算
+                _, dealt_avg_price = self._get_dealt(order)
+                stock.status = StockStatus.SOLD
+                stock.sell_price = dealt_avg_price
+                stock.sell_total_amount = dealt_avg_price * order.quantity
+                stock.sell_all_ext_fee, _ = calc_hk_ext_fee(stock.sell_total_amount)
+                stock.sell_time = order.complete_time
+                # 计算收益
+                stock.trade_profit = stock.sell_total_amount - stock.buy_total_amount - stock.sell_all_ext_fee - stock.buy_all_ext_fee
+                # 交易费用结算
+                self.account.add_balance(stock.sell_total_amount, f"卖出股票 {order.stock_code} {order.stock_holding_id}")
+                self.account.sub_balance(stock.sell_all_ext_fee, f"交易费用 {order.stock_code} {order.order_id}")
+                self.position_book.save(stock)
+            elif order.order_status == TradeOrderStatus.PART_CANCELLED:
+                # 部分卖出后撤单
+                self._settle_part_sold(stock, order)
+            elif order.order_status == TradeOrderStatus.CANCELLED:
+                # 取消卖出
+                stock.status = StockStatus.HOLDING
+                stock.sell_price = 0
+                stock.sell_total_amount = 0
+                stock.sell_all_ext_fee = 0
+                self.position_book.save(stock)
+            else:
+                # 其他状态
+                self.logger.info(f"stock {self.stock_code} {order.stock_holding_id} {order.order_status} ignored.")
 
     def on_stock_submit_buying(self, order: TradeOrderDto):
         """
@@ -118,19 +155,17 @@ class StockManager(object):
         :param order:
         :return:
         """
-        ctx = get_context()
-        ctx.validate_account(self.account.acc_dto)
-        stock_repo = ctx.backend().stock_repo(self.account.account_name)
-        # 扣除余额
-        if not self.account.check_balance_enough(order.total_amount + order.ext_fee):
-            raise Exception("账户余额不足")
-        if not self.account.sub_balance(order.total_amount, f"购买股票 {order.stock_code} {order.stock_holding_id}"):
-            raise Exception(f"账户余额不足")
-        if not self.account.sub_balance(order.ext_fee, f"交易费用 {order.stock_code} {order.order_id}"):
-            raise Exception(f"账户余额不足")
-        stock = self._build_stock_from_order(order)
-        stock.status = StockStatus.BUYING
-        stock_repo.save(stock)
+        with self.unit_of_work():
+            # 扣除余额
+            if not self.account.check_balance_enough(order.total_amount + order.ext_fee):
+                raise Exception("账户余额不足")
+            if not self.account.sub_balance(order.total_amount, f"购买股票 {order.stock_code} {order.stock_holding_id}"):
+                raise Exception(f"账户余额不足")
+            if not self.account.sub_balance(order.ext_fee, f"交易费用 {order.stock_code} {order.order_id}"):
+                raise Exception(f"账户余额不足")
+            stock = self._build_stock_from_order(order)
+            stock.status = StockStatus.BUYING
+            self.position_book.save(stock)
 
     def on_stock_buy_status_change(self, order: TradeOrderDto):
         """
@@ -138,32 +173,117 @@ class StockManager(object):
         :param order:
         :return:
         """
-        ctx = get_context()
-        ctx.validate_account(self.account.acc_dto)
-        stock_repo = ctx.backend().stock_repo(self.account.account_name)
-        stock = stock_repo.query_by_holding_id(order.stock_code, order.stock_holding_id)
-        if stock is None:
-            raise Exception(f"stock {self.stock_code} {order.stock_holding_id} not found")
-        if stock.status != StockStatus.BUYING:
-            raise Exception(f"stock {self.stock_code} {order.stock_holding_id} status is not BUYING")
-        if order.order_status == TradeOrderStatus.ALL_TRADED:
-            # 全部买入
-            stock.status = StockStatus.HOLDING
-            stock.buy_price = order.price
-            stock.buy_total_amount = order.total_amount
-            stock.buy_all_ext_fee = order.ext_fee
-            stock.buy_time = order.complete_time
-            stock_repo.save(stock)
-        elif order.order_status == TradeOrderStatus.CANCELLED:
-            # 取消买入
-            stock.status = StockStatus.DELETED
-            stock_repo.save(stock)
-            # 将资金退回
-            self.account.add_balance(order.total_amount, f"【退款】买入股票 {order.stock_code} {order.stock_holding_id}")
-            self.account.add_balance(order.ext_fee, f"【退款】交易费用 {order.stock_code} {order.order_id}")
-        else:
-            # 其他状态
-            self.logger.info(f"stock {self.stock_code} {order.stock_holding_id} {order.order_status} ignored.")
+        with self.unit_of_work():
+            stock = self.position_book.get(order.stock_holding_id)
+            if stock is None:
+                raise Exception(f"stock {self.stock_code} {order.stock_holding_id} not found")
+            if stock.status != StockStatus.BUYING:
+                raise Exception(f"stock {self.stock_code} {order.stock_holding_id} status is not BUYING")
+            if order.order_status in (TradeOrderStatus.ALL_TRADED, TradeOrderStatus.PART_CANCELLED):
+                # 全部买入 / 部分买入后撤单：持有已成交部分，按成交均价结算与冻结资金的差额
+                dealt_qty, dealt_avg_price = self._get_dealt(order)
+                if order.order_status == TradeOrderStatus.ALL_TRADED:
+                    dealt_qty = order.quantity
+                dealt_amount = dealt_qty * dealt_avg_price
+                dealt_fee, _ = calc_hk_ext_fee(dealt_amount)
+                stock.status = StockStatus.HOLDING
+                stock.quantity = dealt_qty
+                stock.buy_price = dealt_avg_price
+                stock.buy_total_amount = dealt_amount
+                stock.buy_all_ext_fee = dealt_fee
+                stock.buy_time = order.complete_time
+                self.position_book.save(stock)
+                self._settle_frozen(order, dealt_amount + dealt_fee,
+                                    f"买入股票 {order.stock_code} {order.stock_holding_id} 成交 {dealt_qty}/{order.quantity}"
+                                    f" 均价 {dealt_avg_price}")
+            elif order.order_status == TradeOrderStatus.CANCELLED:
+                # 取消买入
+                stock.status = StockStatus.DELETED
+                self.position_book.save(stock)
+                # 将资金退回
+                self.account.add_balance(order.total_amount, f"【退款】买入股票 {order.stock_code} {order.stock_holding_id}")
+                self.account.add_balance(order.ext_fee, f"【退款】交易费用 {order.stock_code} {order.order_id}")
+            else:
+                # 其他状态
+                self.logger.info(f"stock {self.stock_code} {order.stock_holding_id} {order.order_status} ignored.")
+
+    def on_stock_order_submitted(self, order: TradeOrderDto):
+        """
+        异步下单时券商确认订单后回填持股的订单id
+        :param order:
+        :return:
+        """
+        with self.unit_of_work():
+            stock = self.position_book.get(order.stock_holding_id)
+            if stock is None:
+                raise Exception(f"stock {self.stock_code} {order.stock_holding_id} not found")
+            if order.trade_side == TrdSide.BUY:
+                stock.buy_order_id = order.order_id
+            else:
+                stock.sell_order_id = order.order_id
+            self.position_book.save(stock)
+
+    def _settle_part_sold(self, stock: StockDto, order: TradeOrderDto):
+        """
+        部分卖出后撤单：已卖出部分拆分为一条已卖出的持股记录（按数量分摊买入成本）并结算，剩余部分恢复持有
+        :param stock: 卖出中的持股
+        :param order:
+        :return:
+        """
+        dealt_qty, dealt_avg_price = self._get_dealt(order)
+        if dealt_qty <= 0 or dealt_qty >= stock.quantity:
+            raise Exception(f"stock {self.stock_code} {order.stock_holding_id} part sold quantity {dealt_qty}"
+                            f" invalid, holding {stock.quantity}")
+        sold_amount = dealt_qty * dealt_avg_price
+        sold_fee, _ = calc_hk_ext_fee(sold_amount)
+        sold = StockDto()
+        DtoUtil.copy(stock, sold)
+        sold.stock_holding_id = f"{stock.stock_holding_id}_{order.order_id}"
+        sold.create_time = datetime.now()
+        sold.modify_time = datetime.now()
+        sold.quantity = dealt_qty
+        sold.buy_total_amount = stock.buy_total_amount * dealt_qty / stock.quantity
+        sold.buy_all_ext_fee = stock.buy_all_ext_fee * dealt_qty / stock.quantity
+        sold.status = StockStatus.SOLD
+        sold.sell_price = dealt_avg_price
+        sold.sell_total_amount = sold_amount
+        sold.sell_all_ext_fee = sold_fee
+        sold.sell_order_id = order.order_id
+        sold.sell_time = order.complete_time
+        sold.trade_profit = sold.sell_total_amount - sold.buy_total_amount - sold.sell_all_ext_fee - sold.buy_all_ext_fee
+        # 剩余部分
+        stock.quantity -= dealt_qty
+        stock.buy_total_amount -= sold.buy_total_amount
+        stock.buy_all_ext_fee -= sold.buy_all_ext_fee
+        stock.status = StockStatus.HOLDING
+        stock.sell_price = 0
+        stock.sell_total_amount = 0
+        stock.sell_all_ext_fee = 0
+        self.position_book.save(sold)
+        self.position_book.save(stock)
+        self.account.add_balance(sold_amount, f"部分卖出股票 {order.stock_code} {order.stock_holding_id}"
+                                              f" 成交 {dealt_qty}/{order.quantity}")
+        self.account.sub_balance(sold_fee, f"交易费用 {order.stock_code} {order.order_id}")
+
+    def _settle_frozen(self, order: TradeOrderDto, dealt_cost: float, desc: str):
+        """
+        买单完成时结算下单时冻结的资金（委托金额 + 费用）与实际成交金额 + 费用的差额
+        """
+        diff = round(order.total_amount + order.ext_fee - dealt_cost, 4)
+        if diff > 0:
+            self.account.add_balance(diff, f"【退款】{desc}")
+        elif diff < 0:
+            self.account.sub_balance(-diff, f"【补扣】{desc}")
+
+    @staticmethod
+    def _get_dealt(order: TradeOrderDto) -> typing.Tuple[int, float]:
+        """
+        订单的成交数量和成交均价，交易类没有记录时按委托数量和委托价格
+        """
+        ext_detail = order.ext_detail or {}
+        dealt_qty = int(ext_detail.get("dealt_qty", order.quantity))
+        dealt_avg_price = float(ext_detail.get("dealt_avg_price") or order.price)
+        return dealt_qty, dealt_avg_price
 
     @staticmethod
     def _build_stock_from_order(order: TradeOrderDto) -> StockDto:
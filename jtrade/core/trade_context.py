@@ -6,9 +6,12 @@
 @create: 2024/10/18
 """
 import typing
+import threading
 
 from futu import TrdMarket, TrdEnv
 from jtrade.models.mysql_backend import MysqlBackend, TradeAccountDto
+from jtrade.models.memory_backend import MemoryBackend
+from jtrade.models.kline_column_store import StockKLineColumnStore
 from jtrade.core.futu_sdk import FutuSdk
 
 
@@ -18,9 +21,13 @@ class TradeContext(object):
         self.trade_env = TrdEnv.SIMULATE
         self.trade_market = TrdMarket.HK
         self.account_name: str = ""
-        self._back_end: typing.Optional[MysqlBackend] = None
+        self._back_end: typing.Optional[typing.Union[MysqlBackend, MemoryBackend]] = None
+        self.kline_store_dir: typing.Optional[str] = None
+        self.futu_config: dict = {}
+        self._futu_sdk: typing.Optional[FutuSdk] = None
+        self._futu_sdk_lock = threading.Lock()
 
-    def backend(self) -> MysqlBackend:
+    def backend(self) -> typing.Union[MysqlBackend, MemoryBackend]:
         if self._back_end is None:
             raise Exception("TradeContext not initialized. backend is None")
         return self._back_end
@@ -37,24 +44,84 @@ class TradeContext(object):
                             f"consist with {self.account_name}")
         return True
 
-    @staticmethod
-    def futu_sdk() -> FutuSdk:
-        return FutuSdk()
+    def kline_column_store(self, stock_code: str, time_unit: int = 1) -> typing.Optional[StockKLineColumnStore]:
+        """
+        本地K线列式存储，未配置存储目录时返回 None
+        :param stock_code:
+        :param time_unit:
+        :return:
+        """
+        if self.kline_store_dir is None:
+            return None
+        return StockKLineColumnStore(self.kline_store_dir, stock_code, time_unit)
+
+    def kline_coverage_repo(self, stock_code: str, time_unit: int = 1):
+        """
+        K线覆盖索引的存储：内存后端在进程结束后不保留，配置了本地列式存储时与列式存储一起保存，
+        否则使用后端的 stock_k_line_coverage_repo
+        :param stock_code:
+        :param time_unit:
+        :return:
+        """
+        if isinstance(self.backend(), MemoryBackend) and self.kline_store_dir is not None:
+            return self.kline_column_store(stock_code, time_unit).coverage_repo()
+        return self.backend().stock_k_line_coverage_repo(stock_code, time_unit)
+
+    def futu_sdk(self) -> FutuSdk:
+        """
+        进程内共享的富途sdk（内部维护行情连接池）
+        :return:
+        """
+        if self._futu_sdk is None:
+            with self._futu_sdk_lock:
+                if self._futu_sdk is None:
+                    self._futu_sdk = FutuSdk(
+                        host=self.futu_config.get("host", "127.0.0.1"),
+                        port=self.futu_config.get("port", 11111),
+                        pool_size=self.futu_config.get("pool_size", 4)
+                    )
+        return self._futu_sdk
 
 
 __TRADE_CONTEXT__ = TradeContext()
 
 
-def init_context(trade_env: str, trade_market: str, account_name: str, db_config: dict):
+def init_context(trade_env: str, trade_market: str, account_name: str, db_config: dict,
+                 kline_store_dir: typing.Optional[str] = None, futu_config: typing.Optional[dict] = None,
+                 backend_type: str = "mysql"):
+    """
+    :param db_config: mysql: host / port / user / password / kline_bulk_chunk_size /
+                             pool_size / max_overflow / pool_timeout / pool_recycle / pool_pre_ping；
+                      memory: snapshot_path（结束时快照到的 SQLite 文件，可选） / snapshot_kline
+    :param backend_type: mysql / memory（纯内存，用于回测）
+    """
+    if backend_type not in ("mysql", "memory"):
+        raise Exception(f"unknown backend type {backend_type}")
     __TRADE_CONTEXT__.trade_env = trade_env
     __TRADE_CONTEXT__.trade_market = trade_market
     __TRADE_CONTEXT__.account_name = account_name
+    __TRADE_CONTEXT__.kline_store_dir = kline_store_dir
+    __TRADE_CONTEXT__.futu_config = futu_config or {}
+    if __TRADE_CONTEXT__._futu_sdk is not None:
+        __TRADE_CONTEXT__._futu_sdk.close()
+        __TRADE_CONTEXT__._futu_sdk = None
+    if backend_type == "memory":
+        __TRADE_CONTEXT__._back_end = MemoryBackend(trade_env, trade_market,
+                                                    snapshot_path=db_config.get("snapshot_path"),
+                                                    snapshot_kline=db_config.get("snapshot_kline", False))
+        return
     __TRADE_CONTEXT__._back_end = MysqlBackend(trade_env, trade_market,
                                                host=db_config.get("host", "127.0.0.1"),
                                                port=db_config.get("port", 3306),
                                                user=db_config.get("user", "root"),
                                                password=db_config["password"],
-                                               echo_stdout=False
+                                               echo_stdout=False,
+                                               kline_bulk_chunk_size=db_config.get("kline_bulk_chunk_size", 2000),
+                                               pool_size=db_config.get("pool_size", 5),
+                                               max_overflow=db_config.get("max_overflow", 10),
+                                               pool_timeout=db_config.get("pool_timeout", 30),
+                                               pool_recycle=db_config.get("pool_recycle", 3600),
+                                               pool_pre_ping=db_config.get("pool_pre_ping", True)
                                                )
 
 
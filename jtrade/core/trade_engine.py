@@ -13,7 +13,9 @@ import pytz
 import datetime
 from jtrade.core.stock_manager import StockManager
 from jtrade.core.stock_k_linke_lib import StockKLineLib
+from jtrade.core.kline_window import KLineWindow
 from jtrade.utils import date_utils
+from jtrade.utils.latency_stats import span
 from jtrade.core.trade_alg_base import TradeAlgBase, TradeDecision
 from jtrade.core.trader import StockTraderBase
 from jtrade.core.account import Account
@@ -22,6 +24,9 @@ from jtrade.core.trade_context import get_context
 from jtrade.utils.fee_util import calc_hk_ext_fee
 from futu import TrdSide
 
+if typing.TYPE_CHECKING:
+    from jtrade.core.order_gateway import AsyncOrderGateway
+
 
 class TradeEngine(object):
     """
@@ -29,13 +34,21 @@ class TradeEngine(object):
     """
 
     def __init__(self, stock_manager: StockManager, kline_lib: StockKLineLib,
-                 trade_alg: TradeAlgBase, trader: StockTraderBase):
+                 trade_alg: TradeAlgBase, trader: StockTraderBase,
+                 order_gateway: typing.Optional["AsyncOrderGateway"] = None):
+        """
+        :param order_gateway: 异步订单网关，设置后下单不等待券商返回，订单确认和成交通过网关事件更新
+        """
         self.stock_code = stock_manager.stock_code
         self.account: Account = stock_manager.account
         self.stock_manager: StockManager = stock_manager
         self.kline_lib: StockKLineLib = kline_lib
         self.trade_alg: TradeAlgBase = trade_alg
         self.trader: StockTraderBase = trader
+        self.order_gateway = order_gateway
+        if order_gateway is not None:
+            order_gateway.register_stock_manager(stock_manager)
+        self.kline_window = KLineWindow(kline_lib)
         self.timezone = pytz.timezone('Asia/Shanghai')
 
     def on_rt_data(self, cur_data: dict):
@@ -53,19 +66,55 @@ class TradeEngine(object):
             avg_price	float	平均价格 对于期权，该字段为 None
             volume	float	成交量
             turnover	float	成交金额
-        :return:
+        :return: 本周期生成的交易决策
+        """
+        # 一次实时数据处理中的数据库读写共用一个连接
+        with span("engine.on_rt_data"), get_context().backend().session_scope():
+            decisions = self.gen_decisions(cur_data)
+            # 执行交易决策
+            for decision in decisions:
+                with span("engine.execute_decision"):
+                    self._execute_decision(decision)
+            return decisions
+
+    def gen_decisions(self, cur_data: dict, account_state: typing.Optional[dict] = None) -> typing.List[TradeDecision]:
+        """
+        只生成交易决策，不执行
+        :param cur_data: 实时分时回调数据，同 on_rt_data
+        :param account_state: 账户状态快照（account_state() 的返回），为空时读取本引擎的账户和持股；
+            分片工作进程中使用主进程发来的快照，决策由主进程执行
+        :return: 本周期生成的交易决策
         """
         assert cur_data["code"] == self.stock_code
-        # 准备算法参数
-        alg_params = self._prepare_alg_params(cur_data)
-        # 生成交易决策
-        decisions = self.trade_alg.gen_decision(alg_params)
-        self._print_decisions(decisions, alg_params)
-        # 执行交易决策
-        for decision in decisions:
-            self._execute_decision(decision)
+        with get_context().backend().session_scope():
+            # 准备算法参数
+            with span("engine.prepare_alg_params"):
+                alg_params = self._prepare_alg_params(cur_data, account_state)
+            # 生成交易决策
+            with span("engine.gen_decision"):
+                decisions = self.trade_alg.gen_decision(alg_params)
+            self._print_decisions(decisions, alg_params)
+            return decisions
+
+    def execute_decisions(self, decisions: typing.List[TradeDecision]):
+        """
+        执行交易决策（如分片工作进程生成的决策）
+        """
+        with span("engine.execute_decisions"), get_context().backend().session_scope():
+            for decision in decisions:
+                with span("engine.execute_decision"):
+                    self._execute_decision(decision)
+
+    def account_state(self) -> dict:
+        """
+        生成决策需要的账户状态快照： 可用资金和本股票的有效持股
+        """
+        return {
+            "available_balance": self.account.get_available_balance(),
+            "stocks": self.stock_manager.load_all_valid_stocks()
+        }
 
-    def _prepare_alg_params(self, cur_data: dict):
+    def _prepare_alg_params(self, cur_data: dict, account_state: typing.Optional[dict] = None):
         cur_timestamp = date_utils.timeStr2timestamp(
             cur_data["time"],
             self.timezone
@@ -73,10 +122,19 @@ class TradeEngine(object):
         kline_end_timestamp = cur_timestamp - 60
         kline_end_timestamp = kline_end_timestamp / 60 * 60.0
         kline_start_timestamp = kline_end_timestamp - 24 * 3600 * 360
-        kline_df = self.kline_lib.query(kline_start_timestamp, kline_end_timestamp)
-        x = kline_df["time_key"].values
-        y = kline_df["close"].values
-        available_balance = self.account.get_available_balance()
+        # 滑动窗口只向前移动，x / y / kline_df 都是K线缓存的视图
+        with span("engine.kline_query"):
+            self.kline_window.update(kline_start_timestamp, kline_end_timestamp)
+            kline_df = self.kline_window.kline_df
+            x = self.kline_window.x
+            y = self.kline_window.y
+        if account_state is not None:
+            available_balance = account_state["available_balance"]
+            stocks = account_state["stocks"]
+        else:
+            available_balance = self.account.get_available_balance()
+            with span("engine.load_all_valid_stocks"):
+                stocks = self.stock_manager.load_all_valid_stocks()
         return {
             "stock_code": cur_data["code"],
             "cur_timestamp": cur_timestamp,
@@ -86,7 +144,7 @@ class TradeEngine(object):
             "kline_df": kline_df,
             "x": x,
             "y": y,
-            "stocks": self.stock_manager.load_all_valid_stocks(),
+            "stocks": stocks,
             "cur_data": cur_data
         }
 
@@ -99,23 +157,69 @@ class TradeEngine(object):
         if decision is None:
             return
         assert decision.is_valid()
-        ctx = get_context()
+        if self.order_gateway is not None:
+            self._submit_decision_async(decision)
+            return
+        if decision.trade_op == TradeDecision.TRADE_OP_BUY:
+            # 买入股票：先冻结资金并新增买入中的股票信息（事务提交后释放账户锁）
+            order = self._build_buy_order(decision)
+            with span("engine.stock_manager.on_stock_submit_buying"):
+                self.stock_manager.on_stock_submit_buying(order)
+            place_order, span_name = self.trader.open_position, "engine.trader.open_position"
+        else:
+            # 卖出股票：先更新卖出的股票状态
+            order = self._build_sell_order(decision)
+            with span("engine.stock_manager.on_stock_submit_selling"):
+                self.stock_manager.on_stock_submit_selling(order)
+            place_order, span_name = self.trader.close_position, "engine.trader.close_position"
+        # 券商下单在事务之外，不占用数据库连接和账户锁
+        try:
+            with span(span_name):
+                place_order(order)
+        except Exception:
+            self._release_submitted(order)
+            raise
+        # 回填订单id并保存订单
+        with span("engine.order_store"), self.stock_manager.unit_of_work():
+            self.stock_manager.on_stock_order_submitted(order)
+            get_context().backend().trade_order_repo(self.account.account_name).store(order)
+
+    def _release_submitted(self, order: TradeOrderDto):
+        """
+        下单失败时按撤单退回已冻结的资金 / 持股
+        :param order:
+        :return:
+        """
+        order.order_status = TradeOrderStatus.CANCELLED
+        if order.trade_side == TrdSide.BUY:
+            self.stock_manager.on_stock_buy_status_change(order)
+        else:
+            self.stock_manager.on_stock_sell_status_change(order)
+
+    def _submit_decision_async(self, decision: TradeDecision):
+        """
+        先冻结资金 / 持股，事务提交后再通过订单网关异步下单，订单在券商确认后写库；
+        提交到网关失败时退回冻结的资金 / 持股
+        :param decision:
+        :return:
+        """
+        if not self.order_gateway.is_started():
+            raise Exception("order gateway not started")
         if decision.trade_op == TradeDecision.TRADE_OP_BUY:
-            # 买入股票
-            buy_order = self._build_buy_order(decision)
-            self.trader.open_position(buy_order)
-            # 新增买入中的股票信息
-            self.stock_manager.on_stock_submit_buying(buy_order)
-            # 保存订单
-            ctx.backend().trade_order_repo(self.account.account_name).store(buy_order)
+            order = self._build_buy_order(decision)
+            with span("engine.stock_manager.on_stock_submit_buying"):
+                self.stock_manager.on_stock_submit_buying(order)
+            submit = self.order_gateway.submit_open
         else:
-            # 卖出股票
-            sell_order = self._build_sell_order(decision)
-            self.trader.close_position(sell_order)
-            # 更新卖出的股票状态
-            self.stock_manager.on_stock_submit_selling(sell_order)
-            # 保存订单
-            ctx.backend().trade_order_repo(self.account.account_name).store(sell_order)
+            order = self._build_sell_order(decision)
+            with span("engine.stock_manager.on_stock_submit_selling"):
+                self.stock_manager.on_stock_submit_selling(order)
+            submit = self.order_gateway.submit_close
+        try:
+            submit(order)
+        except Exception:
+            self._release_submitted(order)
+            raise
 
     def _build_buy_order(self, decision: TradeDecision) -> TradeOrderDto:
         """
@@ -8,11 +8,26 @@
 from jtrade.models.dto import TradeOrderDto, TradeOrderStatus, StockStatus
 from jtrade.utils import date_utils
 from jtrade.core.stock_manager import StockManager
-import random
+from futu import TrdSide
+import threading
+import itertools
+import typing
+import heapq
 
 
 class StockTraderBase(object):
 
+    # 订单状态变化（成交、部分成交、撤单）回调，为空时由交易类直接更新 StockManager
+    order_listener: typing.Optional[typing.Callable[[TradeOrderDto], None]] = None
+
+    def set_order_listener(self, listener: typing.Optional[typing.Callable[[TradeOrderDto], None]]):
+        """
+        设置订单状态变化回调（如 AsyncOrderGateway.on_order_status）
+        :param listener:
+        :return:
+        """
+        self.order_listener = listener
+
     def open_position(self, order: TradeOrderDto):
         """
         开仓买入股票
@@ -33,12 +48,29 @@ class StockTraderBase(object):
 class KLineMockTrader(StockTraderBase):
     """
    用于测试的模拟交易类
+   挂单按价格排序（买单按价格从高到低、卖单按价格从低到高的堆），每根K线只撮合与最高 / 最低价交叉的订单：
+   买单价格 >= K线最低价成交，卖单价格 <= K线最高价成交，按挂单价成交；16:00 之后批量撤销剩余挂单。
+   回测时每根K线需先调用 on_kline_update 再处理该K线的实时数据（下单），订单只与之后的K线撮合
     """
 
-    def __init__(self, stock_manager: StockManager):
+    def __init__(self, stock_manager: StockManager, print_positions: bool = False):
+        """
+        :param stock_manager:
+        :param print_positions: 有成交时是否打印持仓
+        """
         self.buy_orders: dict[str, TradeOrderDto] = {}
         self.sell_orders: dict[str, TradeOrderDto] = {}
         self.stock_manager = stock_manager
+        self.print_positions = print_positions
+        # (-price, seq, order_id) / (price, seq, order_id)，撤单后的堆元素在出堆时跳过
+        self._bids: typing.List[typing.Tuple[float, int, str]] = []
+        self._asks: typing.List[typing.Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._order_seq = itertools.count(1)
+        # 上一根K线的时间 yyyy-mm-dd HH:MM:SS
+        self._last_kline_time: typing.Optional[str] = None
+        # 下单（订单网关线程）和撮合（行情线程）可能在不同线程
+        self._lock = threading.RLock()
 
     def open_position(self, order: TradeOrderDto):
         """
@@ -46,8 +78,10 @@ class KLineMockTrader(StockTraderBase):
         :param order:
         :return:
         """
-        order.order_id = date_utils.now_time_str("%Y%m%d%H%M%S") + str(random.randint(100, 999))
-        self.buy_orders[order.order_id] = order
+        order.order_id = self._new_order_id()
+        with self._lock:
+            self.buy_orders[order.order_id] = order
+            heapq.heappush(self._bids, (-order.price, next(self._seq), order.order_id))
         return order.order_id
 
     def close_position(self, order: TradeOrderDto):
@@ -56,61 +90,110 @@ class KLineMockTrader(StockTraderBase):
         :param order:
         :return:
         """
-        order.order_id = date_utils.now_time_str("%Y%m%d%H%M%S") + str(random.randint(100, 999))
-        self.sell_orders[order.order_id] = order
+        order.order_id = self._new_order_id()
+        with self._lock:
+            self.sell_orders[order.order_id] = order
+            heapq.heappush(self._asks, (order.price, next(self._seq), order.order_id))
         return order.order_id
 
-    def on_kline_update(self, cur_time: str, cur_price: float):
+    def _new_order_id(self) -> str:
+        # 同一秒内的多个订单用递增序号区分（随机数在回测时会重复）
+        return date_utils.now_time_str("%Y%m%d%H%M%S") + f"{next(self._order_seq):06d}"
+
+    def cancel_order(self, order: TradeOrderDto):
+        """
+        撤销挂单
+        :param order:
+        :return:
+        """
+        with self._lock:
+            order = self.buy_orders.pop(order.order_id, None) or self.sell_orders.pop(order.order_id, None)
+            if order is None:
+                return
+            order.order_status = TradeOrderStatus.CANCELLED
+        self._notify_orders([order])
+
+    def _on_order_status_change(self, order: TradeOrderDto):
+        if self.order_listener is not None:
+            self.order_listener(order)
+        elif order.trade_side == TrdSide.BUY:
+            self.stock_manager.on_stock_buy_status_change(order)
+        else:
+            self.stock_manager.on_stock_sell_status_change(order)
+
+    def _notify_orders(self, orders: typing.List[TradeOrderDto]):
+        """
+        状态回调在锁外调用（回调中会获取账户锁），直接更新 StockManager 时一根K线的变化在一个事务中写库
+        """
+        if len(orders) == 0:
+            return
+        if self.order_listener is not None:
+            for order in orders:
+                self._on_order_status_change(order)
+            return
+        with self.stock_manager.unit_of_work():
+            for order in orders:
+                self._on_order_status_change(order)
+
+    def _cancel_all(self) -> typing.List[TradeOrderDto]:
+        cancelled_orders = list(self.buy_orders.values()) + list(self.sell_orders.values())
+        for order in cancelled_orders:
+            order.order_status = TradeOrderStatus.CANCELLED
+        self.buy_orders = {}
+        self.sell_orders = {}
+        self._bids = []
+        self._asks = []
+        return cancelled_orders
+
+    @staticmethod
+    def _pop_crossed(book: typing.List[typing.Tuple[float, int, str]], orders: dict[str, TradeOrderDto],
+                     is_crossed: typing.Callable[[float], bool]) -> typing.List[TradeOrderDto]:
+        crossed = []
+        while len(book) > 0:
+            key, _, order_id = book[0]
+            order = orders.get(order_id)
+            if order is None:
+                # 已撤销
+                heapq.heappop(book)
+                continue
+            if not is_crossed(key):
+                break
+            heapq.heappop(book)
+            del orders[order_id]
+            crossed.append(order)
+        return crossed
+
+    def on_kline_update(self, cur_time: str, cur_price: float,
+                        high: typing.Optional[float] = None, low: typing.Optional[float] = None):
         """
         用于模拟交易，更新股票价格
         :param cur_time:
-        :param cur_price:
+        :param cur_price: 收盘价
+        :param high: K线最高价，为空时使用 cur_price
+        :param low: K线最低价，为空时使用 cur_price
         :return:
         """
-        stock_has_change = False
-        # 检查所有买入订单，如果当前价格小于买入价格，则执行买入操作
-        need_del_buy_order_id = []
-        for order_id in self.buy_orders.keys():
-            order = self.buy_orders[order_id]
-            if order.price >= cur_price:
-                # order.price = cur_price
-                # order.total_amount = order.price * order.quantity
-                # order.ext_fee, order.ext_detail = calc_hk_ext_fee(order.total_amount)
-                order.order_status = TradeOrderStatus.ALL_TRADED
-                order.complete_time = cur_time
-                self.stock_manager.on_stock_buy_status_change(order)
-                need_del_buy_order_id.append(order.order_id)
-                stock_has_change = True
-        for order_id in need_del_buy_order_id:
-            del self.buy_orders[order_id]
-        # 检查所有卖出订单，如果当前价格大于卖出价格，则执行卖出操作
-        need_del_sell_order_id = []
-        for order_id in self.sell_orders.keys():
-            order = self.sell_orders[order_id]
-            if order.price <= cur_price:
-                # order.price = cur_price
-                # order.total_amount = order.price * order.quantity
-                # order.ext_fee, order.ext_detail = calc_hk_ext_fee(order.total_amount)
+        high = cur_price if high is None else high
+        low = cur_price if low is None else low
+        with self._lock:
+            expired_orders = []
+            if self._last_kline_time is not None and self._last_kline_time[:10] != cur_time[:10]:
+                # 上一交易日收盘后提交的挂单不跨日撮合
+                expired_orders = self._cancel_all()
+            self._last_kline_time = cur_time
+            # 买单价格不低于最低价时成交（-price <= -low）
+            filled_orders = self._pop_crossed(self._bids, self.buy_orders, lambda key: -key >= low)
+            # 卖单价格不高于最高价时成交
+            filled_orders += self._pop_crossed(self._asks, self.sell_orders, lambda key: key <= high)
+            for order in filled_orders:
                 order.order_status = TradeOrderStatus.ALL_TRADED
                 order.complete_time = cur_time
-                self.stock_manager.on_stock_sell_status_change(order)
-                need_del_sell_order_id.append(order.order_id)
-                stock_has_change = True
-        for order_id in need_del_sell_order_id:
-            del self.sell_orders[order_id]
-        # 如果当前时间在16:00:00之后，则取消所有订单
-        if cur_time[-8:] >= "16:00:00":
-            for order_id in self.buy_orders.keys():
-                order = self.buy_orders[order_id]
-                order.order_status = TradeOrderStatus.CANCELLED
-                self.stock_manager.on_stock_buy_status_change(order)
-            self.buy_orders = {}
-            for order_id in self.sell_orders.keys():
-                order = self.sell_orders[order_id]
-                order.order_status = TradeOrderStatus.CANCELLED
-                self.stock_manager.on_stock_sell_status_change(order)
-            self.sell_orders = {}
-        if stock_has_change:
+            cancelled_orders = []
+            # 如果当前时间在16:00:00之后，则取消所有订单
+            if cur_time[-8:] >= "16:00:00":
+                cancelled_orders = self._cancel_all()
+        self._notify_orders(expired_orders + filled_orders + cancelled_orders)
+        if self.print_positions and len(filled_orders) > 0:
             # 打印所有股票信息
             stocks = self.stock_manager.load_all_valid_stocks()
             print(f"> 持仓信息")
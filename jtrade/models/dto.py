@@ -5,9 +5,10 @@
 @author: jkguo
 @create: 2024/10/18
 """
+import copy
 from datetime import datetime
 import sqlalchemy
-from sqlalchemy import String, JSON, Integer, Float, DateTime, sql, Column, PrimaryKeyConstraint
+from sqlalchemy import String, JSON, Integer, BigInteger, Float, DateTime, sql, Column, PrimaryKeyConstraint
 from sqlalchemy.orm import Mapped
 DtoBase = sqlalchemy.orm.declarative_base()
 
@@ -37,6 +38,19 @@ class DtoUtil(object):
     def copy(cls, src: any, dst: any):
         DtoUtil.from_dict(dst, DtoUtil.to_dict(src))
 
+    @classmethod
+    def clone(cls, src: any):
+        """
+        复制为一个新的（不关联 session 的）同类对象：复制所有映射列，dict / list 列（如 ext_detail）深拷贝
+        """
+        dst = type(src)()
+        for attr in sqlalchemy.inspect(type(src)).column_attrs:
+            value = getattr(src, attr.key)
+            if isinstance(value, (dict, list)):
+                value = copy.deepcopy(value)
+            setattr(dst, attr.key, value)
+        return dst
+
 
 class TradeAccountDto(DtoBase):
     """
@@ -147,7 +161,7 @@ class StockDto(DtoBase):
 
 class TradeOrderStatus(object):
     """
-    订单状态： 0 初始化, 1: 未成交 / 2: 部分成交 / 3: 全部成交 / 4: 已撤单 / 5: 已删除
+    订单状态： 0 初始化, 1: 未成交 / 2: 部分成交 / 3: 全部成交 / 4: 已撤单 / 5: 已删除 / 6: 部分成交后撤单
     """
 
     INITIALIZED = 0
@@ -156,6 +170,8 @@ class TradeOrderStatus(object):
     ALL_TRADED = 3
     CANCELLED = 4
     DELETED = 5
+    # 部分成交后撤单（终止状态），成交数量和均价记录在 ext_detail.dealt_qty / dealt_avg_price
+    PART_CANCELLED = 6
 
 
 class TradeOrderDto(DtoBase):
@@ -173,7 +189,7 @@ class TradeOrderDto(DtoBase):
     account_name: Mapped[str] = Column('account_name', String(128), comment='账户名称')
     order_id: Mapped[str] = Column('order_id', String(64), comment='订单id')
     trade_side: Mapped[str] = Column('trade_side', String(16), comment='订单类型：TrdSide.BUY / TrdSide.SELL')
-    order_status: Mapped[int] = Column('order_status', Integer, comment='订单状态： 0 初始化, , 1: 未成交 / 2: 部分成交 / 3: 全部成交 / 4: 已撤单 / 5: 已删除')
+    order_status: Mapped[int] = Column('order_status', Integer, comment='订单状态： 0 初始化, , 1: 未成交 / 2: 部分成交 / 3: 全部成交 / 4: 已撤单 / 5: 已删除 / 6: 部分成交后撤单')
     stock_code: Mapped[str] = Column('stock_code', String(128), index=True, comment='股票代码')
     stock_holding_id: Mapped[str] = Column('stock_holding_id', String(64), comment='股票持有id')
     quantity: Mapped[int] = Column('quantity', Integer, comment='数量')
@@ -230,3 +246,24 @@ class StockKLineDto(DtoBase):
         "time_key", "stock_code", "time_unit", "open", "close", "high", "low", "pe_ratio", "turnover_rate", "volume",
         "turnover", "change_rate", "last_close"
     ]
+
+
+class StockKLineCoverageDto(DtoBase):
+    """
+    股票K线数据已同步的时间区间
+    """
+    __tablename__ = "t_stock_k_line_coverage"
+    __table_args__ = (PrimaryKeyConstraint(
+        "stock_code", "time_unit", "begin_time"
+    ), {
+                          "mysql_default_charset": "utf8"
+                      })
+    stock_code: Mapped[str] = Column('stock_code', String(128), comment='股票代码')
+    time_unit: Mapped[int] = Column('time_unit', Integer, comment='时间单位 min')
+    begin_time: Mapped[int] = Column('begin_time', BigInteger, comment='开始时间 epoch 分钟（包含）')
+    end_time: Mapped[int] = Column('end_time', BigInteger, comment='结束时间 epoch 分钟（包含）')
+    modify_time: Mapped[datetime] = Column('modify_time', DateTime, index=True, default=datetime.now(),
+                                           server_default=sql.func.now(), comment='修改时间')
+    columns = [
+        "stock_code", "time_unit", "begin_time", "end_time", "modify_time"
+    ]
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: kline_column_store
+@author: jkguo
+@create: 2024/10/21
+"""
+import os
+import json
+import bisect
+import shutil
+import typing
+import logging
+import numpy as np
+import pandas as pd
+from jtrade.utils import date_utils
+
+logger = logging.getLogger("kline.column_store")
+
+
+class StockKLineColumnStore(object):
+    """
+    股票K线本地列式存储
+    每个 (stock_code, time_unit) 对应一个目录，数据按时间分为互不重叠的段（子目录），
+    每段的每一列保存为一个 .npy 文件，读取时以内存映射方式打开。
+    追加新K线时只写新的段，与已有段时间重叠的写入只重写重叠的段；段数超过 MAX_SEGMENTS 时合并为一段（也可调用 compact）。
+    所有列按 time（int64 epoch 分钟）升序排列，范围查询为二分查找 + 切片，范围在一个段内时不产生拷贝。
+    """
+
+    COLUMNS = ['time', 'open', 'close', 'high', 'low', 'pe_ratio', 'turnover_rate', 'volume', 'turnover',
+               'change_rate', 'last_close']
+    COLUMN_DTYPES = {
+        'time': 'int64'
+    }
+    DF_COLUMNS = ['time_key', 'open', 'close', 'high', 'low', 'pe_ratio', 'turnover_rate', 'volume', 'turnover',
+                  'change_rate', 'last_close', 'time']
+    META_FILE = "meta.json"
+    VERSION = 2
+    # 段数超过时自动合并
+    MAX_SEGMENTS = 16
+
+    def __init__(self, root_dir: str, stock_code: str, time_unit: int = 1):
+        self.stock_code = stock_code
+        self.time_unit = time_unit
+        self.store_dir = os.path.join(root_dir, stock_code, str(time_unit))
+        self._meta: typing.Optional[dict] = None
+        self._meta_mtime_ns = None
+        # 按时间排序的段： (段名, 列名 -> 内存映射 ndarray)
+        self._segments: typing.List[typing.Tuple[str, typing.Dict[str, np.ndarray]]] = []
+        # 各段的开始时间，用于二分查找
+        self._segment_begins: typing.List[int] = []
+
+    def coverage_repo(self) -> "StockKLineColumnStoreCoverageRepo":
+        """
+        保存在本地存储目录中的K线覆盖索引（接口同 StockKLineCoverageRepo），
+        用于状态后端不持久化（内存后端）时记录已同步区间，与本地存储一起保留 / 删除
+        """
+        return StockKLineColumnStoreCoverageRepo(self.store_dir)
+
+    def begin_time(self) -> typing.Optional[int]:
+        """
+        本地存储已经覆盖的最早查询时间
+        :return: epoch 分钟
+        """
+        self._reload_if_changed()
+        if self._meta is None:
+            return None
+        return self._meta.get("begin_time")
+
+    def end_time(self) -> typing.Optional[int]:
+        """
+        本地存储中最后一根K线的时间
+        :return: epoch 分钟
+        """
+        self._reload_if_changed()
+        if len(self._segments) == 0:
+            return None
+        return int(self._segments[-1][1]['time'][-1])
+
+    def count(self) -> int:
+        self._reload_if_changed()
+        return sum(len(columns['time']) for _, columns in self._segments)
+
+    def segment_count(self) -> int:
+        self._reload_if_changed()
+        return len(self._segments)
+
+    def query_columns(self, begin_time: int, end_time: int,
+                      columns: typing.Optional[typing.List[str]] = None) -> typing.Dict[str, np.ndarray]:
+        """
+        查询 [begin_time, end_time] 范围内的列数据
+        :param begin_time: epoch 分钟
+        :param end_time: epoch 分钟
+        :param columns: 需要的列，默认全部
+        :return: 列名 -> 只读 ndarray（范围在一个段内时为内存映射视图，跨段时为拼接后的拷贝）
+        """
+        self._reload_if_changed()
+        if columns is None:
+            columns = self.COLUMNS
+        first_idx = max(bisect.bisect_right(self._segment_begins, begin_time) - 1, 0)
+        last_idx = bisect.bisect_right(self._segment_begins, end_time)
+        parts = []
+        for _, segment in self._segments[first_idx: last_idx]:
+            times = segment['time']
+            begin_idx = int(np.searchsorted(times, begin_time, side='left'))
+            end_idx = int(np.searchsorted(times, end_time, side='right'))
+            if end_idx > begin_idx:
+                parts.append({c: segment[c][begin_idx: end_idx] for c in columns})
+        if len(parts) == 0:
+            return {c: np.empty(0, dtype=self.COLUMN_DTYPES.get(c, 'float64')) for c in columns}
+        if len(parts) == 1:
+            return parts[0]
+        return {c: np.concatenate([part[c] for part in parts]) for c in columns}
+
+    def query(self, begin_time: int, end_time: int) -> pd.DataFrame:
+        """
+        查询K线
+        :param begin_time: epoch 分钟
+        :param end_time: epoch 分钟
+        :return: pd.DataFrame
+            列名： code,time_key,open,close,high,low,pe_ratio,turnover_rate,volume,turnover,change_rate,last_close,time
+        """
+        data = self.query_columns(begin_time, end_time)
+        data['time_key'] = date_utils.epoch_mins2time_strs(data['time'])
+        df = pd.DataFrame(data, columns=self.DF_COLUMNS)
+        df.insert(0, 'code', self.stock_code)
+        return df
+
+    def store(self, df: pd.DataFrame, begin_time: typing.Optional[int] = None):
+        """
+        将K线合并写入本地存储，time 相同的行以新数据为准；
+        晚于已有数据的K线写为新的段，与已有段重叠时只重写重叠的段
+        :param df: 包含 time_key,open,close,... 列的 DataFrame，缺少 time 列时由 time_key 换算
+        :param begin_time: 本次写入数据对应的查询开始时间（epoch 分钟），用于记录本地存储的覆盖范围
+        :return:
+        """
+        self._reload_if_changed()
+        meta = self._new_meta()
+        if begin_time is not None and (meta["begin_time"] is None or begin_time < meta["begin_time"]):
+            meta["begin_time"] = begin_time
+        if df is None or len(df) == 0:
+            if meta != self._meta:
+                self._write(meta, [], [])
+            return
+        new_columns = {}
+        for c in self.COLUMNS:
+            if c == 'time' and c not in df.columns:
+                new_columns[c] = date_utils.time_strs2epoch_mins(df['time_key'].to_numpy())
+            else:
+                new_columns[c] = df[c].to_numpy(dtype=self.COLUMN_DTYPES.get(c, 'float64'))
+        new_columns = self._sort_unique(new_columns)
+        new_times = new_columns['time']
+        new_begin, new_end = int(new_times[0]), int(new_times[-1])
+        # 与新数据时间范围重叠的段，和新数据合并为一段
+        overlapped = [(name, columns) for name, columns in self._segments
+                      if int(columns['time'][0]) <= new_end and int(columns['time'][-1]) >= new_begin]
+        if len(overlapped) > 0:
+            new_columns = self._sort_unique({
+                c: np.concatenate([columns[c] for _, columns in overlapped] + [new_columns[c]]) for c in self.COLUMNS
+            })
+        if meta["begin_time"] is None or new_columns['time'][0] < meta["begin_time"]:
+            meta["begin_time"] = int(new_columns['time'][0])
+        removed = [name for name, _ in overlapped]
+        new_segment = self._new_segment_name(meta)
+        meta["segments"] = sorted(
+            [seg for seg in meta["segments"] if seg["name"] not in removed] +
+            [{"name": new_segment, "begin": int(new_columns['time'][0]), "end": int(new_columns['time'][-1]),
+              "count": len(new_columns['time'])}],
+            key=lambda seg: seg["begin"]
+        )
+        meta["count"] = sum(seg["count"] for seg in meta["segments"])
+        self._write(meta, [(new_segment, new_columns)], removed)
+        logger.info(f"store kline columns ok. code {self.stock_code} unit {self.time_unit}"
+                    f" new {len(df)} total {meta['count']} segments {len(meta['segments'])}")
+        if len(meta["segments"]) > self.MAX_SEGMENTS:
+            self.compact()
+
+    def compact(self):
+        """
+        把所有段合并为一段（范围查询不再需要跨段拼接）
+        """
+        self._reload_if_changed()
+        if len(self._segments) <= 1:
+            return
+        meta = self._new_meta()
+        merged = {c: np.concatenate([columns[c] for _, columns in self._segments]) for c in self.COLUMNS}
+        removed = [name for name, _ in self._segments]
+        new_segment = self._new_segment_name(meta)
+        meta["segments"] = [{"name": new_segment, "begin": int(merged['time'][0]), "end": int(merged['time'][-1]),
+                             "count": len(merged['time'])}]
+        self._write(meta, [(new_segment, merged)], removed)
+        logger.info(f"compact kline columns ok. code {self.stock_code} unit {self.time_unit}"
+                    f" segments {len(removed)} -> 1 total {meta['count']}")
+
+    def _new_meta(self) -> dict:
+        if self._meta is not None:
+            meta = dict(self._meta)
+            meta["segments"] = list(meta.get("segments", []))
+            return meta
+        return {
+            "stock_code": self.stock_code,
+            "time_unit": self.time_unit,
+            "version": self.VERSION,
+            "begin_time": None,
+            "count": 0,
+            "next_segment": 0,
+            "segments": []
+        }
+
+    @staticmethod
+    def _new_segment_name(meta: dict) -> str:
+        seq = meta.get("next_segment", 0)
+        meta["next_segment"] = seq + 1
+        return f"seg_{seq:08d}"
+
+    @staticmethod
+    def _sort_unique(columns: typing.Dict[str, np.ndarray]) -> typing.Dict[str, np.ndarray]:
+        """
+        按 time 稳定排序后去重，重复时保留最后出现的行
+        """
+        times = columns['time']
+        if bool(np.all(times[:-1] < times[1:])):
+            return columns
+        order = np.argsort(times, kind='stable')
+        sorted_times = times[order]
+        keep = np.ones(len(sorted_times), dtype=bool)
+        keep[:-1] = sorted_times[:-1] != sorted_times[1:]
+        order = order[keep]
+        return {c: v[order] for c, v in columns.items()}
+
+    def _write(self, meta: dict, new_segments: typing.List[typing.Tuple[str, typing.Dict[str, np.ndarray]]],
+               removed_segments: typing.List[str]):
+        os.makedirs(self.store_dir, exist_ok=True)
+        for name, columns in new_segments:
+            segment_dir = os.path.join(self.store_dir, name)
+            os.makedirs(segment_dir, exist_ok=True)
+            for c, values in columns.items():
+                with open(os.path.join(segment_dir, c + ".npy"), "wb") as fp:
+                    np.save(fp, values)
+        # meta 最后写入，作为一次写入完成的标记；新段在 meta 引用之前对读取方不可见
+        meta_path = os.path.join(self.store_dir, self.META_FILE)
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(meta, fp)
+        os.replace(tmp_path, meta_path)
+        # 已经打开的内存映射在文件删除后仍然有效
+        for name in removed_segments:
+            shutil.rmtree(os.path.join(self.store_dir, name), ignore_errors=True)
+        self._meta_mtime_ns = None
+        self._reload_if_changed()
+
+    def _reload_if_changed(self):
+        meta_path = os.path.join(self.store_dir, self.META_FILE)
+        try:
+            mtime_ns = os.stat(meta_path).st_mtime_ns
+        except FileNotFoundError:
+            self._meta = None
+            self._meta_mtime_ns = None
+            self._segments = []
+            self._segment_begins = []
+            return
+        if mtime_ns == self._meta_mtime_ns:
+            return
+        with open(meta_path, "r") as fp:
+            self._meta = json.load(fp)
+        # 未变化的段复用已打开的内存映射
+        opened = dict(self._segments)
+        segments = []
+        for seg in self._meta.get("segments", []):
+            columns = opened.get(seg["name"])
+            if columns is None:
+                segment_dir = os.path.join(self.store_dir, seg["name"])
+                columns = {c: np.load(os.path.join(segment_dir, c + ".npy"), mmap_mode='r') for c in self.COLUMNS}
+            segments.append((seg["name"], columns))
+        self._segments = segments
+        self._segment_begins = [seg["begin"] for seg in self._meta.get("segments", [])]
+        self._meta_mtime_ns = mtime_ns
+
+
+class StockKLineColumnStoreCoverageRepo(object):
+    """
+    K线覆盖索引的本地文件存储，区间列表保存为 store_dir 下的 coverage.json
+    """
+
+    COVERAGE_FILE = "coverage.json"
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.path = os.path.join(store_dir, self.COVERAGE_FILE)
+
+    def query(self) -> typing.List[typing.Tuple[int, int]]:
+        try:
+            with open(self.path, "r") as fp:
+                intervals = json.load(fp)
+        except FileNotFoundError:
+            return []
+        return [(int(b), int(e)) for b, e in intervals]
+
+    def save(self, intervals: typing.List[typing.Tuple[int, int]]):
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump([[int(b), int(e)] for b, e in intervals], fp)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: memory_backend
+@author: jkguo
+@create: 2024/10/25
+"""
+import bisect
+import contextlib
+import logging
+import threading
+import typing
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from jtrade.utils.latency_stats import timed_methods
+from jtrade.models.dto import DtoBase, DtoUtil, TradeAccountDto, StockDto, TradeOrderDto, StockKLineDto, \
+    StockKLineCoverageDto
+
+logger = logging.getLogger("memory.backend")
+
+
+def _copy_dto(dto: DtoBase) -> DtoBase:
+    """
+    按表字段复制 DTO（保留 datetime 等原始类型），存入 / 取出时复制，调用方修改对象不影响已保存的数据
+    """
+    new_dto = type(dto)()
+    for c in dto.__table__.columns.keys():
+        setattr(new_dto, c, getattr(dto, c))
+    return new_dto
+
+
+class MemoryUnitOfWork(object):
+    """
+    内存后端的工作单元： unit_of_work() 范围中的写操作先缓存，结束时一次应用；
+    异常时丢弃并调用 on_rollback 注册的回调，接口与 mysql_backend.UnitOfWork 一致
+    """
+
+    _local = threading.local()
+
+    def __init__(self, backend: "MemoryBackend"):
+        self.backend = backend
+        self._writes: typing.List[typing.Callable[[], None]] = []
+        self._rollback_callbacks: typing.List[typing.Callable[[], None]] = []
+
+    def on_rollback(self, callback: typing.Callable[[], None]):
+        if callback not in self._rollback_callbacks:
+            self._rollback_callbacks.append(callback)
+
+    @classmethod
+    def current(cls) -> typing.Optional["MemoryUnitOfWork"]:
+        return getattr(cls._local, "uow", None)
+
+    @classmethod
+    def write(cls, backend: "MemoryBackend", apply: typing.Callable[[], None]):
+        """
+        在当前工作单元中缓存写操作，没有工作单元时立即写入
+        """
+        uow = cls.current()
+        if uow is not None and uow.backend is backend:
+            uow._writes.append(apply)
+            return
+        with backend.lock:
+            apply()
+
+    def commit(self):
+        with self.backend.lock:
+            for apply in self._writes:
+                apply()
+        self._writes = []
+
+
+@timed_methods("memory")
+class MemoryTradeAccountRepo(object):
+
+    def __init__(self, backend: "MemoryBackend"):
+        self.backend = backend
+
+    def get(self, account_name: str) -> typing.Optional[TradeAccountDto]:
+        with self.backend.lock:
+            acc_dto = self.backend.accounts.get(account_name)
+            return _copy_dto(acc_dto) if acc_dto is not None else None
+
+    def save(self, acc_dto: TradeAccountDto):
+        acc_dto = _copy_dto(acc_dto)
+        MemoryUnitOfWork.write(self.backend, lambda: self.backend.accounts.__setitem__(acc_dto.account_name, acc_dto))
+
+
+@timed_methods("memory")
+class MemoryStockRepo(object):
+
+    def __init__(self, backend: "MemoryBackend", account_name: str):
+        self.backend = backend
+        self.account_name = account_name
+
+    def query_all(self, stock_code: str, stock_status_list: list[str] = None) -> typing.List[StockDto]:
+        with self.backend.lock:
+            stocks = self.backend.stocks.get((self.account_name, stock_code), {})
+            return [
+                _copy_dto(stock) for stock in stocks.values()
+                if not stock_status_list or stock.status in stock_status_list
+            ]
+
+    def query_by_holding_id(self, stock_code: str, holding_id: str) -> typing.Optional[StockDto]:
+        with self.backend.lock:
+            stock = self.backend.stocks.get((self.account_name, stock_code), {}).get(holding_id)
+            return _copy_dto(stock) if stock is not None else None
+
+    def save(self, stock: StockDto):
+        stock = _copy_dto(stock)
+        MemoryUnitOfWork.write(self.backend, lambda: self._put(stock))
+        return True
+
+    def save_all(self, stocks: typing.List[StockDto]):
+        stocks = [_copy_dto(stock) for stock in stocks]
+
+        def apply():
+            for stock in stocks:
+                self._put(stock)
+        MemoryUnitOfWork.write(self.backend, apply)
+        return True
+
+    def _put(self, stock: StockDto):
+        self.backend.stocks.setdefault((self.account_name, stock.stock_code), {})[stock.stock_holding_id] = stock
+
+
+@timed_methods("memory")
+class MemoryTradeOrderRepo(object):
+
+    def __init__(self, backend: "MemoryBackend", account_name: str):
+        self.backend = backend
+        self.account_name = account_name
+
+    def store(self, order: TradeOrderDto):
+        order = _copy_dto(order)
+        MemoryUnitOfWork.write(
+            self.backend, lambda: self.backend.orders.setdefault(self.account_name, {}).__setitem__(order.order_id, order)
+        )
+
+    def query_all(self) -> typing.List[TradeOrderDto]:
+        with self.backend.lock:
+            return [_copy_dto(order) for order in self.backend.orders.get(self.account_name, {}).values()]
+
+
+@timed_methods("memory")
+class MemoryStockKLineRepo(object):
+    """
+    K线按 time_key 有序保存（time_key 有序数组 + time_key -> 行）
+    """
+
+    def __init__(self, backend: "MemoryBackend", stock_code: str, time_unit: int):
+        self.backend = backend
+        self.stock_code = stock_code
+        self.time_unit = time_unit
+
+    def _table(self) -> typing.Tuple[typing.List[str], typing.Dict[str, dict]]:
+        return self.backend.klines.setdefault((self.stock_code, self.time_unit), ([], {}))
+
+    def _range_keys(self, begin_time: str, end_time: str) -> typing.List[str]:
+        time_keys, _ = self._table()
+        return time_keys[bisect.bisect_left(time_keys, begin_time): bisect.bisect_right(time_keys, end_time)]
+
+    def query(self, begin_time: str, end_time: str) -> typing.List[StockKLineDto]:
+        with self.backend.lock:
+            _, rows = self._table()
+            return [DtoUtil.from_dict(StockKLineDto(), rows[k]) for k in self._range_keys(begin_time, end_time)]
+
+    def count_by_day(self, begin_time: str, end_time: str) -> typing.Dict[str, int]:
+        counts = {}
+        with self.backend.lock:
+            for time_key in self._range_keys(begin_time, end_time):
+                counts[time_key[:10]] = counts.get(time_key[:10], 0) + 1
+        return counts
+
+    def store(self, stock_kline_list: typing.List[StockKLineDto]):
+        return self.bulk_store([DtoUtil.to_dict(stock_kline) for stock_kline in stock_kline_list])
+
+    def bulk_store(self, rows: typing.List[dict]) -> int:
+        if len(rows) == 0:
+            return 0
+        new_rows = {}
+        for row in rows:
+            if row["stock_code"] != self.stock_code:
+                raise Exception("stock code not match")
+            if row["time_unit"] != self.time_unit:
+                raise Exception("time unit not match")
+            new_rows[row["time_key"]] = {c: row.get(c) for c in StockKLineDto.columns}
+        with self.backend.lock:
+            time_keys, table_rows = self._table()
+            new_keys = sorted(k for k in new_rows if k not in table_rows)
+            table_rows.update(new_rows)
+            # 一般是追加更新的K线，只有插入到中间时才需要重新排序
+            need_sort = len(new_keys) > 0 and len(time_keys) > 0 and new_keys[0] < time_keys[-1]
+            time_keys.extend(new_keys)
+            if need_sort:
+                time_keys.sort()
+        return len(rows)
+
+
+@timed_methods("memory")
+class MemoryStockKLineCoverageRepo(object):
+
+    def __init__(self, backend: "MemoryBackend", stock_code: str, time_unit: int):
+        self.backend = backend
+        self.stock_code = stock_code
+        self.time_unit = time_unit
+
+    def query(self) -> typing.List[typing.Tuple[int, int]]:
+        with self.backend.lock:
+            return sorted(self.backend.kline_coverage.get((self.stock_code, self.time_unit), []))
+
+    def save(self, intervals: typing.List[typing.Tuple[int, int]]):
+        with self.backend.lock:
+            self.backend.kline_coverage[(self.stock_code, self.time_unit)] = [(b, e) for b, e in intervals]
+
+
+class MemoryBackend(object):
+    """
+    纯内存状态后端，repo 接口与 MysqlBackend 一致，用于回测（不需要数据库）；
+    可在结束时把账户、持股、订单（可选K线）快照到 SQLite 文件
+    """
+
+    def __init__(self, trade_env: str, trade_market: str, snapshot_path: typing.Optional[str] = None,
+                 snapshot_kline: bool = False) -> None:
+        """
+        :param trade_env: 交易环境：真实 / 模拟
+        :param trade_market: 交易市场
+        :param snapshot_path: close 时快照到的 SQLite 文件，为空时不快照
+        :param snapshot_kline: 快照是否包含K线
+        """
+        self.trade_env = trade_env
+        self.trade_market = trade_market
+        self.snapshot_path = snapshot_path
+        self.snapshot_kline = snapshot_kline
+        self.lock = threading.RLock()
+        self.accounts: typing.Dict[str, TradeAccountDto] = {}
+        # (account_name, stock_code) -> stock_holding_id -> StockDto
+        self.stocks: typing.Dict[typing.Tuple[str, str], typing.Dict[str, StockDto]] = {}
+        # account_name -> order_id -> TradeOrderDto
+        self.orders: typing.Dict[str, typing.Dict[str, TradeOrderDto]] = {}
+        # (stock_code, time_unit) -> ([time_key 有序], time_key -> 行)
+        self.klines: typing.Dict[typing.Tuple[str, int], typing.Tuple[typing.List[str], typing.Dict[str, dict]]] = {}
+        # (stock_code, time_unit) -> [(begin_time, end_time)]
+        self.kline_coverage: typing.Dict[typing.Tuple[str, int], typing.List[typing.Tuple[int, int]]] = {}
+
+    @contextlib.contextmanager
+    def unit_of_work(self) -> typing.Iterator[MemoryUnitOfWork]:
+        """
+        与 MysqlBackend.unit_of_work 一致，嵌套调用时加入外层工作单元
+        """
+        current = MemoryUnitOfWork.current()
+        if current is not None:
+            yield current
+            return
+        uow = MemoryUnitOfWork(self)
+        MemoryUnitOfWork._local.uow = uow
+        try:
+            yield uow
+            MemoryUnitOfWork._local.uow = None
+            uow.commit()
+        except BaseException:
+            MemoryUnitOfWork._local.uow = None
+            for callback in uow._rollback_callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"unit of work rollback callback error: {e}")
+            raise
+        finally:
+            MemoryUnitOfWork._local.uow = None
+
+    @contextlib.contextmanager
+    def session_scope(self) -> typing.Iterator[None]:
+        """
+        与 MysqlBackend.session_scope 接口一致，内存后端没有连接
+        """
+        yield None
+
+    def pool_stats(self) -> dict:
+        return {}
+
+    def init_backend(self):
+        pass
+
+    def trade_account_repo(self) -> MemoryTradeAccountRepo:
+        return MemoryTradeAccountRepo(self)
+
+    def stock_repo(self, account_name: str):
+        return MemoryStockRepo(self, account_name)
+
+    def stock_k_line_repo(self, stock_code: str, time_unit: int = 1):
+        return MemoryStockKLineRepo(self, stock_code, time_unit)
+
+    def stock_k_line_coverage_repo(self, stock_code: str, time_unit: int = 1):
+        return MemoryStockKLineCoverageRepo(self, stock_code, time_unit)
+
+    def trade_order_repo(self, account_name: str):
+        return MemoryTradeOrderRepo(self, account_name)
+
+    def snapshot(self, sqlite_path: str, include_kline: bool = False):
+        """
+        把内存数据写入 SQLite 文件（表结构与 MySQL 一致，已存在的记录覆盖）
+        :param sqlite_path:
+        :param include_kline: 是否包含K线
+        :return:
+        """
+        start_time = time.time()
+        db_engine = create_engine(f"sqlite:///{sqlite_path}")
+        DtoBase.metadata.create_all(db_engine)
+        session = sessionmaker(bind=db_engine)()
+        try:
+            with self.lock:
+                dto_list = list(self.accounts.values())
+                for stocks in self.stocks.values():
+                    dto_list.extend(stocks.values())
+                for orders in self.orders.values():
+                    dto_list.extend(orders.values())
+                for dto in dto_list:
+                    session.merge(_copy_dto(dto))
+                now = datetime.now()
+                for (stock_code, time_unit), intervals in self.kline_coverage.items():
+                    for begin_time, end_time in intervals:
+                        dto = StockKLineCoverageDto()
+                        dto.stock_code = stock_code
+                        dto.time_unit = time_unit
+                        dto.begin_time = begin_time
+                        dto.end_time = end_time
+                        dto.modify_time = now
+                        session.merge(dto)
+                kline_count = 0
+                if include_kline:
+                    for time_keys, rows in self.klines.values():
+                        for time_key in time_keys:
+                            session.merge(DtoUtil.from_dict(StockKLineDto(), rows[time_key]))
+                        kline_count += len(time_keys)
+            session.commit()
+            logger.info(f"snapshot memory backend to {sqlite_path} ok. records {len(dto_list)} kline {kline_count}"
+                        f" cost {round(time.time() - start_time, 3)}s")
+        except Exception as e:
+            session.rollback()
+            logger.error(f"snapshot memory backend to {sqlite_path} error: {e}")
+            raise
+        finally:
+            session.close()
+            db_engine.dispose()
+
+    def close(self):
+        """
+        配置了 snapshot_path 时写快照
+        """
+        if self.snapshot_path is not None:
+            self.snapshot(self.snapshot_path, self.snapshot_kline)
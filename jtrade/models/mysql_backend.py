@@ -5,24 +5,115 @@
 @author: jkguo
 @create: 2024/10/17
 """
+import contextlib
 import logging
+import threading
 import typing
+import time
 from datetime import datetime
 
 import sqlalchemy
 from sqlalchemy import create_engine
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql import text
+from sqlalchemy.pool import NullPool
 import json
-from jtrade.models.dto import DtoBase, DtoUtil, TradeAccountDto, TradeStockPropsDto, StockDto, TradeOrderDto, StockKLineDto
+from jtrade.utils.latency_stats import timed_methods, span
+from jtrade.models.dto import DtoBase, DtoUtil, TradeAccountDto, TradeStockPropsDto, StockDto, TradeOrderDto, StockKLineDto, \
+    StockKLineCoverageDto
 
 func_declarative_base = declarative_base
 logger = logging.getLogger("mysql.backend")
 
 
+class SessionScope(object):
+    """
+    会话作用域： 同一线程内 MysqlBackend.session_scope() 范围中的读写和工作单元共用一个 session，
+    session 绑定在作用域借出的一个连接上；作用域外的写操作仍然各自提交，工作单元在结束时提交。
+    作用域中的 session 提交后不过期对象，读到的对象在作用域结束后仍可直接使用；
+    作用域中的查询总是用数据库的结果刷新 identity map 中已有的对象（populate_existing），不会返回过期的对象。
+    """
+
+    _local = threading.local()
+
+    def __init__(self, session_maker, connection):
+        self.session_maker = session_maker
+        self.connection = connection
+        self.session: Session = session_maker(bind=connection, expire_on_commit=False)
+        sqlalchemy.event.listen(self.session, "do_orm_execute", self._refresh_on_read)
+
+    @staticmethod
+    def _refresh_on_read(orm_execute_state):
+        # SQLAlchemy 1.4 在事件之前已经把 populate_existing 等执行选项解析为加载选项，这里直接修改加载选项
+        if orm_execute_state.is_select:
+            orm_execute_state.update_execution_options(
+                _sa_orm_load_options=orm_execute_state.load_options + {"_populate_existing": True}
+            )
+
+    def close(self):
+        self.session.close()
+        self.connection.close()
+
+    @classmethod
+    def current(cls) -> typing.Optional["SessionScope"]:
+        return getattr(cls._local, "scope", None)
+
+    @classmethod
+    def read_session(cls, session_maker) -> typing.Tuple[Session, bool]:
+        """
+        获取读操作使用的 session
+        :return: (session, 是否由调用方关闭)
+        """
+        scope = cls.current()
+        if scope is not None and scope.session_maker is session_maker:
+            return scope.session, False
+        return session_maker(), True
+
+
+class UnitOfWork(object):
+    """
+    工作单元： 同一线程内 MysqlBackend.unit_of_work() 范围中的所有写操作共用一个 session，最后一次提交；
+    异常时整体回滚并调用 on_rollback 注册的回调（用于恢复内存状态）。
+    """
+
+    _local = threading.local()
+
+    def __init__(self, session_maker):
+        self.session_maker = session_maker
+        scope = SessionScope.current()
+        # 在会话作用域中时使用作用域的 session（同一个连接），由作用域负责关闭
+        self.owns_session = scope is None or scope.session_maker is not session_maker
+        self.session: Session = session_maker() if self.owns_session else scope.session
+        self._rollback_callbacks: typing.List[typing.Callable[[], None]] = []
+
+    def on_rollback(self, callback: typing.Callable[[], None]):
+        if callback not in self._rollback_callbacks:
+            self._rollback_callbacks.append(callback)
+
+    @classmethod
+    def current(cls) -> typing.Optional["UnitOfWork"]:
+        return getattr(cls._local, "uow", None)
+
+    @classmethod
+    def write_session(cls, session_maker) -> typing.Tuple[Session, bool, bool]:
+        """
+        获取写操作使用的 session
+        :return: (session, 是否由调用方提交, 是否由调用方关闭)
+        """
+        uow = cls.current()
+        if uow is not None and uow.session_maker is session_maker:
+            return uow.session, False, False
+        scope = SessionScope.current()
+        if scope is not None and scope.session_maker is session_maker:
+            return scope.session, True, False
+        return session_maker(), True, True
+
+
+@timed_methods("mysql")
 class TradeAccountRepo(object):
 
     def __init__(self, trade_env: str, trade_market: str, session_maker):
@@ -31,7 +122,7 @@ class TradeAccountRepo(object):
         self.session_maker = session_maker
 
     def get(self, account_name: str) -> typing.Optional[TradeAccountDto]:
-        session: Session = self.session_maker()
+        session, need_close = SessionScope.read_session(self.session_maker)
         try:
             db_dto = session.query(TradeAccountDto).filter(
                 TradeAccountDto.trade_env == self.trade_env).filter(
@@ -45,20 +136,26 @@ class TradeAccountRepo(object):
             logger.error(f"TradeAccountRepo get {account_name} error: ", e)
             raise
         finally:
-            session.close()
+            if need_close:
+                session.close()
 
     def save(self, acc_dto: TradeAccountDto):
-        session: Session = self.session_maker()
+        session, need_commit, need_close = UnitOfWork.write_session(self.session_maker)
         try:
             session.merge(acc_dto)
-            session.commit()
+            if need_commit:
+                session.commit()
         except Exception as e:
             logger.error(f"TradeAccountRepo save {acc_dto.account_name} error: ", e)
+            if need_commit:
+                session.rollback()
             raise
         finally:
-            session.close()
+            if need_close:
+                session.close()
 
 
+@timed_methods("mysql")
 class StockRepo(object):
 
     def __init__(self, trade_env: str, trade_market: str, account_name: str, session_maker):
@@ -68,7 +165,7 @@ class StockRepo(object):
         self.session_maker = session_maker
 
     def query_all(self, stock_code: str, stock_status_list: list[str] = None) -> typing.List[StockDto]:
-        session: Session = self.session_maker()
+        session, need_close = SessionScope.read_session(self.session_maker)
         try:
             qry = session.query(StockDto).filter(
                 StockDto.trade_env == self.trade_env).filter(
@@ -85,10 +182,11 @@ class StockRepo(object):
             logger.error(f"StockRepo query_all {stock_code} error: ", e)
             raise
         finally:
-            session.close()
+            if need_close:
+                session.close()
 
     def query_by_holding_id(self, stock_code: str, holding_id: str) -> typing.Optional[StockDto]:
-        session: Session = self.session_maker()
+        session, need_close = SessionScope.read_session(self.session_maker)
         try:
             db_dto = session.query(StockDto).filter(
                 StockDto.trade_env == self.trade_env).filter(
@@ -104,22 +202,51 @@ class StockRepo(object):
             logger.error(f"StockRepo query_by_holding_id {stock_code} {holding_id} error: ", e)
             raise
         finally:
-            session.close()
+            if need_close:
+                session.close()
 
     def save(self, stock: StockDto):
-        session: Session = self.session_maker()
+        session, need_commit, need_close = UnitOfWork.write_session(self.session_maker)
         try:
             session.merge(stock)
-            session.commit()
+            if need_commit:
+                session.commit()
             logger.info(f"save stock {stock.stock_code} {stock.stock_holding_id} ok: {DtoUtil.to_dict(stock)}")
             return True
         except Exception as e:
             logger.error(f"StockRepo save {stock.stock_code} {stock.stock_holding_id} error: ", e)
+            if need_commit:
+                session.rollback()
             raise
         finally:
-            session.close()
+            if need_close:
+                session.close()
 
+    def save_all(self, stocks: typing.List[StockDto]):
+        """
+        在一个事务中保存多条持股记录
+        """
+        if len(stocks) == 0:
+            return True
+        session, need_commit, need_close = UnitOfWork.write_session(self.session_maker)
+        try:
+            for stock in stocks:
+                session.merge(stock)
+            if need_commit:
+                session.commit()
+            logger.info(f"save {len(stocks)} stocks ok: {[s.stock_holding_id for s in stocks]}")
+            return True
+        except Exception as e:
+            logger.error(f"StockRepo save_all {len(stocks)} stocks error: ", e)
+            if need_commit:
+                session.rollback()
+            raise
+        finally:
+            if need_close:
+                session.close()
 
+
+@timed_methods("mysql")
 class TradeOrderRepo(object):
 
     def __init__(self, trade_env: str, trade_market: str, account_name: str, session_maker):
@@ -129,27 +256,33 @@ class TradeOrderRepo(object):
         self.session_maker = session_maker
 
     def store(self, order: TradeOrderDto):
-        session: Session = self.session_maker()
+        session, need_commit, need_close = UnitOfWork.write_session(self.session_maker)
         try:
             session.merge(order)
-            session.commit()
+            if need_commit:
+                session.commit()
             logger.info(f"store order {order.order_id} ok: {DtoUtil.to_dict(order)}")
         except Exception as e:
             logger.error(f"StockOrderRepo store {order.order_id} error: ", e)
+            if need_commit:
+                session.rollback()
             raise
         finally:
-            session.close()
+            if need_close:
+                session.close()
 
 
+@timed_methods("mysql")
 class StockKLineRepo(object):
 
-    def __init__(self, stock_code: str, time_unit: int, session_maker):
+    def __init__(self, stock_code: str, time_unit: int, session_maker, bulk_chunk_size: int = 2000):
         self.stock_code = stock_code
         self.time_unit = time_unit
         self.session_maker = session_maker
+        self.bulk_chunk_size = bulk_chunk_size
 
     def query(self, begin_time: str, end_time: str) -> typing.List[StockKLineDto]:
-        session: Session = self.session_maker()
+        session, need_close = SessionScope.read_session(self.session_maker)
         try:
             qry = session.query(StockKLineDto).filter(
                 StockKLineDto.stock_code == self.stock_code).filter(
@@ -169,19 +302,71 @@ class StockKLineRepo(object):
             logger.error(f"StockKLineRepo query {begin_time} {end_time} error: ", e)
             raise
         finally:
-            session.close()
+            if need_close:
+                session.close()
+
+    def count_by_day(self, begin_time: str, end_time: str) -> typing.Dict[str, int]:
+        """
+        按天统计 [begin_time, end_time] 内的K线数量
+        :param begin_time:
+        :param end_time:
+        :return: yyyy-mm-dd -> count
+        """
+        session, need_close = SessionScope.read_session(self.session_maker)
+        try:
+            day = sqlalchemy.func.substr(StockKLineDto.time_key, 1, 10)
+            qry = session.query(day, sqlalchemy.func.count()).filter(
+                StockKLineDto.stock_code == self.stock_code).filter(
+                StockKLineDto.time_unit == self.time_unit).filter(
+                StockKLineDto.time_key >= begin_time).filter(
+                StockKLineDto.time_key <= end_time
+            ).group_by(day)
+            return {d: c for d, c in qry.all()}
+        except Exception as e:
+            logger.error(f"StockKLineRepo count_by_day {begin_time} {end_time} error: ", e)
+            raise
+        finally:
+            if need_close:
+                session.close()
 
     def store(self, stock_kline_list: typing.List[StockKLineDto]):
+        """
+        保存K线，走批量写入
+        :param stock_kline_list:
+        :return: 写入行数
+        """
+        return self.bulk_store([DtoUtil.to_dict(stock_kline) for stock_kline in stock_kline_list])
+
+    def bulk_store(self, rows: typing.List[dict]) -> int:
+        """
+        批量写入K线： 每 bulk_chunk_size 行一条 INSERT ... ON DUPLICATE KEY UPDATE 语句（executemany）
+        :param rows: 每行包含 StockKLineDto.columns 中的字段
+        :return: 写入行数
+        """
+        if len(rows) == 0:
+            return 0
+        columns = StockKLineDto.columns
+        stmt = mysql_insert(StockKLineDto.__table__)
+        stmt = stmt.on_duplicate_key_update({
+            c: stmt.inserted[c] for c in columns if c not in ("time_key", "stock_code", "time_unit")
+        })
         session: Session = self.session_maker()
+        start_time = time.time()
         try:
-            for stock_kline in stock_kline_list:
-                if stock_kline.stock_code != self.stock_code:
+            params = []
+            for row in rows:
+                if row["stock_code"] != self.stock_code:
                     raise Exception("stock code not match")
-                if stock_kline.time_unit != self.time_unit:
+                if row["time_unit"] != self.time_unit:
                     raise Exception("time unit not match")
-                session.merge(stock_kline)
+                params.append({c: row.get(c) for c in columns})
+            for i in range(0, len(params), self.bulk_chunk_size):
+                session.execute(stmt, params[i: i + self.bulk_chunk_size])
             session.commit()
-            logger.info(f"store stock kline ok. code {self.stock_code} unit {self.time_unit} count {len(stock_kline_list)}")
+            cost = max(time.time() - start_time, 1e-6)
+            logger.info(f"store stock kline ok. code {self.stock_code} unit {self.time_unit} count {len(rows)}"
+                        f" cost {round(cost, 3)}s rows/s {round(len(rows) / cost, 1)}")
+            return len(rows)
         except Exception as e:
             session.rollback()
             logger.error(f"store stock kline code {self.stock_code} unit {self.time_unit}"
@@ -191,13 +376,75 @@ class StockKLineRepo(object):
             session.close()
 
 
+@timed_methods("mysql")
+class StockKLineCoverageRepo(object):
+
+    def __init__(self, stock_code: str, time_unit: int, session_maker):
+        self.stock_code = stock_code
+        self.time_unit = time_unit
+        self.session_maker = session_maker
+
+    def query(self) -> typing.List[typing.Tuple[int, int]]:
+        """
+        查询已同步的时间区间
+        :return: [(begin_time, end_time)] epoch 分钟
+        """
+        session, need_close = SessionScope.read_session(self.session_maker)
+        try:
+            qry = session.query(StockKLineCoverageDto).filter(
+                StockKLineCoverageDto.stock_code == self.stock_code).filter(
+                StockKLineCoverageDto.time_unit == self.time_unit
+            ).order_by(StockKLineCoverageDto.begin_time.asc())
+            return [(item.begin_time, item.end_time) for item in qry.all()]
+        except Exception as e:
+            logger.error(f"StockKLineCoverageRepo query {self.stock_code} {self.time_unit} error: ", e)
+            raise
+        finally:
+            if need_close:
+                session.close()
+
+    def save(self, intervals: typing.List[typing.Tuple[int, int]]):
+        """
+        全量替换已同步的时间区间
+        :param intervals: [(begin_time, end_time)] epoch 分钟
+        :return:
+        """
+        session: Session = self.session_maker()
+        try:
+            session.query(StockKLineCoverageDto).filter(
+                StockKLineCoverageDto.stock_code == self.stock_code).filter(
+                StockKLineCoverageDto.time_unit == self.time_unit
+            ).delete(synchronize_session=False)
+            now = datetime.now()
+            for begin_time, end_time in intervals:
+                dto = StockKLineCoverageDto()
+                dto.stock_code = self.stock_code
+                dto.time_unit = self.time_unit
+                dto.begin_time = begin_time
+                dto.end_time = end_time
+                dto.modify_time = now
+                session.add(dto)
+            session.commit()
+            logger.info(f"save stock kline coverage ok. code {self.stock_code} unit {self.time_unit}"
+                        f" count {len(intervals)}")
+        except Exception as e:
+            session.rollback()
+            logger.error(f"StockKLineCoverageRepo save {self.stock_code} {self.time_unit} error: ", e)
+            raise
+        finally:
+            session.close()
+
+
 class MysqlBackend(object):
     """
         状态后端接口
         """
 
     def __init__(self, trade_env: str, trade_market: str, host: str, port: int,
-                 user: str, password: str, db_name: str = "j_stock_db", echo_stdout=True) -> None:
+                 user: str, password: str, db_name: str = "j_stock_db", echo_stdout=True,
+                 kline_bulk_chunk_size: int = 2000, pool_size: int = 5, max_overflow: int = 10,
+                 pool_timeout: float = 30, pool_recycle: int = 3600, pool_pre_ping: bool = True,
+                 scope_isolation_level: typing.Optional[str] = "READ COMMITTED") -> None:
         """
 
         :param trade_env: 交易环境：真实 / 模拟
@@ -207,19 +454,126 @@ class MysqlBackend(object):
         :param user: mysql 用户
         :param password:  mysql 密码
         :param db_name: 数据库名，默认： fptool_db
+        :param kline_bulk_chunk_size: K线批量写入时每条语句的行数
+        :param pool_size: 连接池常驻连接数
+        :param max_overflow: 连接池允许超出 pool_size 的连接数
+        :param pool_timeout: 借出连接的最长等待时间 s
+        :param pool_recycle: 连接最长使用时间 s，需要小于 MySQL wait_timeout，避免使用已被服务端断开的连接
+        :param pool_pre_ping: 借出连接前是否先检测连接可用
+        :param scope_isolation_level: 会话作用域连接的事务隔离级别，
+                                      READ COMMITTED 使作用域中的读能看到其他连接已提交的修改，None 使用数据库默认值
         """
         self.trade_env = trade_env
         self.trade_market = trade_market
+        self.kline_bulk_chunk_size = kline_bulk_chunk_size
+        self.scope_isolation_level = scope_isolation_level
         port = int(port)
 
         self.db_engine = create_engine(f"mysql+pymysql://{user}:{password}@{host}:{port}/{db_name}?charset=utf8",
-                                       echo=echo_stdout)
+                                       echo=echo_stdout, pool_size=pool_size, max_overflow=max_overflow,
+                                       pool_timeout=pool_timeout, pool_recycle=pool_recycle,
+                                       pool_pre_ping=pool_pre_ping)
+        # 只用于建库，不需要常驻连接
         self.check_db_engine = create_engine(f"mysql+pymysql://{user}:{password}@{host}:{port}?charset=utf8",
-                                             echo=echo_stdout)
+                                             echo=echo_stdout, poolclass=NullPool)
 
         # self.check_db_engine.logger = logging.getLogger("sqlalchemy")
         self.db_name = db_name
         self.DBSession = sessionmaker(bind=self.db_engine)
+        self._repos: typing.Dict[tuple, typing.Any] = {}
+        self._repos_lock = threading.Lock()
+        self._pool_events = {"connect": 0, "checkout": 0, "invalidate": 0}
+        # 连接池事件在多个线程中触发
+        self._pool_events_lock = threading.Lock()
+        self._listen_pool_events(self.db_engine)
+
+    def _listen_pool_events(self, db_engine):
+        def counter(name):
+            def on_event(*args):
+                with self._pool_events_lock:
+                    self._pool_events[name] += 1
+            return on_event
+        for name in self._pool_events:
+            sqlalchemy.event.listen(db_engine, name, counter(name))
+
+    def pool_stats(self) -> dict:
+        """
+        连接池统计
+        :return: size 常驻连接数， checked_in 空闲连接数， checked_out 借出连接数， overflow 超出 pool_size 的连接数，
+                 connect / checkout / invalidate 累计新建、借出、失效（如 pre_ping 检测到断开）次数
+        """
+        pool = self.db_engine.pool
+        with self._pool_events_lock:
+            stats = dict(self._pool_events)
+        for name, attr in (("size", "size"), ("checked_in", "checkedin"), ("checked_out", "checkedout"),
+                           ("overflow", "overflow")):
+            if hasattr(pool, attr):
+                stats[name] = getattr(pool, attr)()
+        return stats
+
+    @contextlib.contextmanager
+    def session_scope(self) -> typing.Iterator[SessionScope]:
+        """
+        会话作用域（如一次实时数据处理），范围内的读写共用一个连接，嵌套调用时加入外层作用域
+        with backend.session_scope():
+            ...
+        :return:
+        """
+        current = SessionScope.current()
+        if current is not None:
+            yield current
+            return
+        connection = self.db_engine.connect()
+        if self.scope_isolation_level is not None:
+            connection = connection.execution_options(isolation_level=self.scope_isolation_level)
+        scope = SessionScope(self.DBSession, connection)
+        SessionScope._local.scope = scope
+        try:
+            yield scope
+        finally:
+            SessionScope._local.scope = None
+            scope.close()
+
+    def _cached_repo(self, key: tuple, factory: typing.Callable[[], typing.Any]):
+        """
+        repo 没有可变状态，按参数缓存复用；只缓存账户级别的 repo（数量有限），按股票的 repo 每次新建
+        """
+        repo = self._repos.get(key)
+        if repo is None:
+            with self._repos_lock:
+                repo = self._repos.setdefault(key, factory())
+        return repo
+
+    @contextlib.contextmanager
+    def unit_of_work(self) -> typing.Iterator[UnitOfWork]:
+        """
+        在一个事务中执行账户、持股、订单等写操作，嵌套调用时加入外层事务
+        with backend.unit_of_work() as uow:
+            ...
+        :return:
+        """
+        current = UnitOfWork.current()
+        if current is not None:
+            yield current
+            return
+        uow = UnitOfWork(self.DBSession)
+        UnitOfWork._local.uow = uow
+        try:
+            yield uow
+            with span("mysql.UnitOfWork.commit"):
+                uow.session.commit()
+        except BaseException:
+            uow.session.rollback()
+            for callback in uow._rollback_callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"unit of work rollback callback error: {e}")
+            raise
+        finally:
+            UnitOfWork._local.uow = None
+            if uow.owns_session:
+                uow.session.close()
 
     def init_backend(self):
         """
@@ -243,17 +597,32 @@ class MysqlBackend(object):
         # init all tables
         DtoBase.metadata.create_all(self.db_engine)
 
+    def close(self):
+        self.db_engine.dispose()
+        self.check_db_engine.dispose()
+
     def trade_account_repo(self) -> TradeAccountRepo:
-        return TradeAccountRepo(self.trade_env, self.trade_market, self.DBSession)
+        return self._cached_repo(
+            ("trade_account",), lambda: TradeAccountRepo(self.trade_env, self.trade_market, self.DBSession)
+        )
 
     def stock_repo(self, account_name: str):
-        return StockRepo(self.trade_env, self.trade_market, account_name, self.DBSession)
+        return self._cached_repo(
+            ("stock", account_name),
+            lambda: StockRepo(self.trade_env, self.trade_market, account_name, self.DBSession)
+        )
 
     def stock_k_line_repo(self, stock_code: str, time_unit: int = 1):
-        return StockKLineRepo(stock_code, time_unit, self.DBSession)
+        return StockKLineRepo(stock_code, time_unit, self.DBSession, self.kline_bulk_chunk_size)
+
+    def stock_k_line_coverage_repo(self, stock_code: str, time_unit: int = 1):
+        return StockKLineCoverageRepo(stock_code, time_unit, self.DBSession)
 
     def trade_order_repo(self, account_name: str):
-        return TradeOrderRepo(self.trade_env, self.trade_market, account_name, self.DBSession)
+        return self._cached_repo(
+            ("trade_order", account_name),
+            lambda: TradeOrderRepo(self.trade_env, self.trade_market, account_name, self.DBSession)
+        )
 
 
 def main():
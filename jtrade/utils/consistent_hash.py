@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: consistent_hash
+@author: jkguo
+@create: 2024/10/24
+"""
+import bisect
+import hashlib
+import typing
+
+
+class ConsistentHashRing(object):
+    """
+    一致性哈希环，每个节点放置 replicas 个虚拟节点；增删节点时只有少量 key 需要迁移
+    """
+
+    def __init__(self, nodes: typing.Iterable[typing.Hashable] = (), replicas: int = 100):
+        self.replicas = replicas
+        self._ring: typing.List[typing.Tuple[int, typing.Hashable]] = []
+        self._hashes: typing.List[int] = []
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def add_node(self, node: typing.Hashable):
+        for i in range(self.replicas):
+            bisect.insort(self._ring, (self._hash(f"{node}#{i}"), node))
+        self._hashes = [h for h, _ in self._ring]
+
+    def remove_node(self, node: typing.Hashable):
+        self._ring = [(h, n) for h, n in self._ring if n != node]
+        self._hashes = [h for h, _ in self._ring]
+
+    def get_node(self, key: str) -> typing.Hashable:
+        if len(self._ring) == 0:
+            raise Exception("consistent hash ring is empty")
+        idx = bisect.bisect(self._hashes, self._hash(key)) % len(self._ring)
+        return self._ring[idx][1]
@@ -8,6 +8,7 @@
 import time
 import datetime
 import pytz
+import numpy as np
 
 
 def now_time_str(fmt="%Y-%m-%d %H:%M:%S"):
@@ -42,3 +43,45 @@ def timeStr2timestamp(time_str: str, timezone=None):
     utc_time = local_time.astimezone(pytz.utc)
     timestamp = utc_time.timestamp()
     return timestamp
+
+
+# 港股交易时间（北京时间）相对 UTC 的分钟偏移，无夏令时
+HK_UTC_OFFSET_MINUTES = 8 * 60
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def time_str2epoch_min(time_str: str) -> int:
+    """
+    北京时间 yyyy-mm-dd HH:MM[:SS] 转换为 epoch 分钟数（秒数被截断）
+    """
+    days = datetime.date(int(time_str[0:4]), int(time_str[5:7]), int(time_str[8:10])).toordinal() - _EPOCH_ORDINAL
+    return days * 1440 + int(time_str[11:13]) * 60 + int(time_str[14:16]) - HK_UTC_OFFSET_MINUTES
+
+
+def epoch_min2time_str(epoch_min: int) -> str:
+    """
+    epoch 分钟数转换为北京时间 yyyy-mm-dd HH:MM:SS
+    """
+    days, minutes = divmod(int(epoch_min) + HK_UTC_OFFSET_MINUTES, 1440)
+    date = datetime.date.fromordinal(days + _EPOCH_ORDINAL)
+    return f"{date.isoformat()} {minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+def time_strs2epoch_mins(time_strs) -> np.ndarray:
+    """
+    批量将北京时间 yyyy-mm-dd HH:MM:SS 转换为 int64 epoch 分钟数
+    """
+    values = np.asarray(time_strs)
+    if values.dtype == object:
+        values = values.astype('U19')
+    return np.asarray(values, dtype='datetime64[m]').astype('int64') - HK_UTC_OFFSET_MINUTES
+
+
+def epoch_mins2time_strs(epoch_mins: np.ndarray) -> np.ndarray:
+    """
+    批量将 int64 epoch 分钟数转换为北京时间 yyyy-mm-dd HH:MM:SS
+    """
+    values = (np.asarray(epoch_mins, dtype='int64') + HK_UTC_OFFSET_MINUTES).astype('datetime64[m]')
+    if values.size == 0:
+        return np.empty(values.shape, dtype='U19')
+    return np.char.replace(np.datetime_as_string(values, unit='s'), 'T', ' ')
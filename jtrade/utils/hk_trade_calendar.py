@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: hk_trade_calendar
+@author: jkguo
+@create: 2024/10/22
+"""
+import typing
+from jtrade.utils.date_utils import HK_UTC_OFFSET_MINUTES
+
+# 港股1分钟K线时间所在的交易时段（北京时间当天分钟数，闭区间）：
+# 上午 09:30（开市竞价） ~ 12:00， 下午 13:01 ~ 16:00
+HK_KLINE_SESSIONS = [(9 * 60 + 30, 12 * 60), (13 * 60 + 1, 16 * 60)]
+# 完整交易日的1分钟K线数量
+HK_DAY_KLINE_COUNT = sum(e - s + 1 for s, e in HK_KLINE_SESSIONS)
+DAY_MINUTES = 24 * 60
+
+
+def is_trading_day(day: int) -> bool:
+    """
+    是否为交易日（只判断周末，节假日由数据覆盖索引记录）
+    :param day: 北京时间 epoch 天数
+    """
+    # 1970-01-01 是星期四
+    return (day + 3) % 7 < 5
+
+
+def next_trading_minute(epoch_min: int) -> int:
+    """
+    epoch_min 及之后的第一个K线交易分钟
+    """
+    local_min = epoch_min + HK_UTC_OFFSET_MINUTES
+    day, minute = divmod(local_min, DAY_MINUTES)
+    while True:
+        if is_trading_day(day):
+            for begin, end in HK_KLINE_SESSIONS:
+                if minute <= end:
+                    return day * DAY_MINUTES + max(minute, begin) - HK_UTC_OFFSET_MINUTES
+        day += 1
+        minute = 0
+
+
+def prev_trading_minute(epoch_min: int) -> int:
+    """
+    epoch_min 及之前的最后一个K线交易分钟
+    """
+    local_min = epoch_min + HK_UTC_OFFSET_MINUTES
+    day, minute = divmod(local_min, DAY_MINUTES)
+    while True:
+        if is_trading_day(day):
+            for begin, end in reversed(HK_KLINE_SESSIONS):
+                if minute >= begin:
+                    return day * DAY_MINUTES + min(minute, end) - HK_UTC_OFFSET_MINUTES
+        day -= 1
+        minute = DAY_MINUTES - 1
+
+
+def clip_trading_range(begin_time: int, end_time: int) -> typing.Optional[typing.Tuple[int, int]]:
+    """
+    把 [begin_time, end_time] 收缩到首尾都是交易分钟
+    :return: 不包含任何交易分钟时返回 None
+    """
+    if begin_time > end_time:
+        return None
+    begin = next_trading_minute(begin_time)
+    end = prev_trading_minute(end_time)
+    if begin > end:
+        return None
+    return begin, end
+
+
+def day_range(day: int) -> typing.Tuple[int, int]:
+    """
+    北京时间 epoch 天数对应的整天 [00:00, 23:59] epoch 分钟
+    """
+    begin = day * DAY_MINUTES - HK_UTC_OFFSET_MINUTES
+    return begin, begin + DAY_MINUTES - 1
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: latency_stats
+@author: jkguo
+@create: 2024/10/24
+"""
+import contextlib
+import functools
+import math
+import threading
+import time
+import typing
+
+
+class LatencyHistogram(object):
+    """
+    耗时直方图
+    按对数分桶（相邻桶约 5% 精度），记录 O(1)，内存固定，可一直开启
+    """
+
+    BUCKETS_PER_E = 20
+    BUCKET_COUNT = 20 * 26  # 覆盖到 e^26 ns（约 2 天）
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.buckets = [0] * self.BUCKET_COUNT
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, cost_ns: int):
+        idx = int(math.log(cost_ns) * self.BUCKETS_PER_E) if cost_ns > 1 else 0
+        if idx >= self.BUCKET_COUNT:
+            idx = self.BUCKET_COUNT - 1
+        with self._lock:
+            self.buckets[idx] += 1
+            self.count += 1
+            self.total_ns += cost_ns
+            if cost_ns > self.max_ns:
+                self.max_ns = cost_ns
+
+    def percentile(self, p: float) -> float:
+        """
+        :param p: 0 ~ 100
+        :return: 耗时 ns（所在桶的上界）
+        """
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            target = max(1, math.ceil(self.count * p / 100))
+            acc = 0
+            for idx, n in enumerate(self.buckets):
+                acc += n
+                if acc >= target:
+                    if idx == self.BUCKET_COUNT - 1:
+                        # 最后一个桶没有上界
+                        return float(self.max_ns)
+                    return min(math.exp((idx + 1) / self.BUCKETS_PER_E), self.max_ns)
+            return float(self.max_ns)
+
+    def summary(self) -> dict:
+        """
+        :return: 耗时统计（ms）
+        """
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ns / self.count / 1e6, 4) if self.count > 0 else 0,
+            "p50_ms": round(self.percentile(50) / 1e6, 4),
+            "p99_ms": round(self.percentile(99) / 1e6, 4),
+            "max_ms": round(self.max_ns / 1e6, 4)
+        }
+
+
+class LatencyRegistry(object):
+    """
+    按阶段名称汇总的耗时统计
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self.histograms: typing.Dict[str, LatencyHistogram] = {}
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def record(self, name: str, cost_ns: int):
+        if self.enabled:
+            self.histogram(name).record(cost_ns)
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        """
+        with registry.span("stage"):
+            ...
+        """
+        if not self.enabled:
+            yield
+            return
+        start_ns = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.histogram(name).record(time.perf_counter_ns() - start_ns)
+
+    def snapshot(self, prefix: str = "") -> typing.Dict[str, dict]:
+        """
+        :param prefix: 只返回名称以 prefix 开头的阶段
+        :return: 阶段名称 -> {count, mean_ms, p50_ms, p99_ms, max_ms}
+        """
+        return {
+            name: histogram.summary() for name, histogram in sorted(self.histograms.items())
+            if name.startswith(prefix)
+        }
+
+    def dump(self, prefix: str = "") -> str:
+        lines = [f"{'stage':<48} {'count':>8} {'mean_ms':>10} {'p50_ms':>10} {'p99_ms':>10} {'max_ms':>10}"]
+        for name, s in self.snapshot(prefix).items():
+            lines.append(f"{name:<48} {s['count']:>8} {s['mean_ms']:>10} {s['p50_ms']:>10}"
+                         f" {s['p99_ms']:>10} {s['max_ms']:>10}")
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+
+
+__LATENCY_REGISTRY__ = LatencyRegistry()
+
+
+def get_latency_registry() -> LatencyRegistry:
+    return __LATENCY_REGISTRY__
+
+
+def span(name: str):
+    """
+    在全局统计中记录一段代码的耗时
+    """
+    return __LATENCY_REGISTRY__.span(name)
+
+
+def timed(name: str):
+    """
+    记录函数耗时的装饰器
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            registry = __LATENCY_REGISTRY__
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            start_ns = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.histogram(name).record(time.perf_counter_ns() - start_ns)
+        return wrapper
+    return decorator
+
+
+def timed_methods(prefix: str):
+    """
+    类装饰器： 记录类中所有公开方法的耗时，阶段名称为 {prefix}.{类名}.{方法名}
+    """
+    def decorator(cls):
+        for attr_name, attr in list(vars(cls).items()):
+            if attr_name.startswith("_") or not callable(attr) or isinstance(attr, (staticmethod, classmethod)):
+                continue
+            setattr(cls, attr_name, timed(f"{prefix}.{cls.__name__}.{attr_name}")(attr))
+        return cls
+    return decorator
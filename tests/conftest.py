@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: conftest
+@author: jkguo
+@create: 2024/10/26
+"""
+import os
+import sys
+import time
+import pytest
+from futu import TrdMarket, TrdSide
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from jtrade.core.trade_context import init_context, get_context
+from jtrade.core.account import Account
+from jtrade.core.stock_manager import StockManager
+from jtrade.models.dto import TradeAccountDto, TradeOrderDto, TradeOrderStatus
+from jtrade.utils.fee_util import calc_hk_ext_fee
+
+TEST_ENV = "test_env"
+TEST_ACCOUNT = "test_acc"
+TEST_STOCK_CODE = "HK.00700"
+TEST_INIT_BALANCE = 1000000
+
+
+@pytest.fixture
+def memory_context(tmp_path):
+    """
+    内存后端的交易上下文，账户初始余额 TEST_INIT_BALANCE
+    """
+    init_context(TEST_ENV, TrdMarket.HK, TEST_ACCOUNT, db_config={}, kline_store_dir=str(tmp_path / "kline_store"),
+                 backend_type="memory")
+    dto = TradeAccountDto()
+    dto.trade_env = TEST_ENV
+    dto.trade_market = TrdMarket.HK
+    dto.account_name = TEST_ACCOUNT
+    dto.trade_pwd = ""
+    dto.account_balance = TEST_INIT_BALANCE
+    get_context().backend().trade_account_repo().save(dto)
+    yield get_context()
+
+
+@pytest.fixture
+def account(memory_context) -> Account:
+    return Account(TEST_ACCOUNT)
+
+
+@pytest.fixture
+def stock_manager(account) -> StockManager:
+    return StockManager(account, TEST_STOCK_CODE)
+
+
+def build_order(trade_side: str, holding_id: str, quantity: int = 100, price: float = 300.0) -> TradeOrderDto:
+    order = TradeOrderDto()
+    order.trade_env = TEST_ENV
+    order.trade_market = TrdMarket.HK
+    order.account_name = TEST_ACCOUNT
+    order.order_id = ""
+    order.trade_side = trade_side
+    order.order_status = TradeOrderStatus.INITIALIZED
+    order.stock_code = TEST_STOCK_CODE
+    order.stock_holding_id = holding_id
+    order.quantity = quantity
+    order.price = price
+    order.total_amount = quantity * price
+    order.ext_fee, order.ext_fee_detail = calc_hk_ext_fee(order.total_amount)
+    order.ext_detail = {}
+    return order
+
+
+def buy_and_fill(stock_manager: StockManager, holding_id: str, quantity: int = 100, price: float = 300.0):
+    """
+    买入并全部成交，返回买入订单
+    """
+    order = build_order(TrdSide.BUY, holding_id, quantity, price)
+    stock_manager.on_stock_submit_buying(order)
+    order.order_id = f"B_{holding_id}"
+    order.order_status = TradeOrderStatus.ALL_TRADED
+    order.complete_time = "2024-10-21 10:00:00"
+    stock_manager.on_stock_buy_status_change(order)
+    return order
+
+
+def wait_until(predicate, timeout: float = 5.0):
+    """
+    等待后台线程（订单网关、推送线程）处理完成
+    """
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "wait timeout"
+        time.sleep(0.001)
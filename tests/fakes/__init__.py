@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: __init__
+@author: jkguo
+@create: 2024/10/26
+离线测试使用的模拟富途连接
+"""
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: fake_quote_context
+@author: jkguo
+@create: 2024/10/26
+"""
+import random
+import threading
+import time
+import typing
+import pandas as pd
+from futu import RET_OK, RET_ERROR
+from jtrade.utils import date_utils, hk_trade_calendar
+
+
+def generate_klines(stock_code: str, begin_date: str, end_date: str, start_price: float = 100.0,
+                    seed: int = 0) -> pd.DataFrame:
+    """
+    生成 [begin_date, end_date] 每个交易日（只去掉周末）所有交易分钟的模拟1分钟K线，列同富途 request_history_kline
+    :param begin_date: yyyy-mm-dd
+    :param end_date: yyyy-mm-dd
+    """
+    rand = random.Random(seed)
+    begin_day = (date_utils.time_str2epoch_min(begin_date + " 00:00:00") + date_utils.HK_UTC_OFFSET_MINUTES) \
+        // hk_trade_calendar.DAY_MINUTES
+    end_day = (date_utils.time_str2epoch_min(end_date + " 00:00:00") + date_utils.HK_UTC_OFFSET_MINUTES) \
+        // hk_trade_calendar.DAY_MINUTES
+    times = []
+    for day in range(begin_day, end_day + 1):
+        if not hk_trade_calendar.is_trading_day(day):
+            continue
+        day_begin_time = hk_trade_calendar.day_range(day)[0]
+        for session_begin, session_end in hk_trade_calendar.HK_KLINE_SESSIONS:
+            times.extend(range(day_begin_time + session_begin, day_begin_time + session_end + 1))
+    rows = []
+    price = start_price
+    for t in times:
+        last_close = price
+        price = round(max(price + rand.choice((-0.2, 0.0, 0.2)), 0.2), 1)
+        volume = float(rand.randint(1, 100) * 100)
+        rows.append({
+            "code": stock_code, "name": stock_code, "time_key": "", "open": last_close, "close": price,
+            "high": max(last_close, price) + 0.2, "low": max(min(last_close, price) - 0.2, 0.0), "pe_ratio": 0.0,
+            "turnover_rate": 0.0, "volume": volume, "turnover": volume * price,
+            "change_rate": round((price - last_close) / last_close * 100, 6), "last_close": last_close
+        })
+    df = pd.DataFrame(rows, columns=["code", "name", "time_key", "open", "close", "high", "low", "pe_ratio",
+                                     "turnover_rate", "volume", "turnover", "change_rate", "last_close"])
+    if len(times) > 0:
+        df["time_key"] = date_utils.epoch_mins2time_strs(pd.Series(times, dtype="int64").to_numpy())
+    return df
+
+
+class FakeQuoteContext(object):
+    """
+    本地模拟的富途行情连接（模拟 OpenD），用于离线测试 FutuQuoteContextPool / FutuSdk / StockKLineLib
+    接口与 OpenQuoteContext 一致：
+    - request_history_kline 按 max_count 分页返回 klines 中的数据，未提供的股票返回空
+    - get_global_state 作为健康检查，healthy 为 False 或已关闭时返回错误
+    - fail_requests > 0 时接下来的若干次请求返回错误（模拟断线）
+    """
+
+    def __init__(self, klines: typing.Optional[typing.Dict[str, pd.DataFrame]] = None, request_latency: float = 0.0,
+                 quota: typing.Tuple[int, int] = (0, 100)):
+        """
+        :param klines: 股票代码 -> 1分钟K线（列同 request_history_kline 的返回）
+        :param request_latency: 每次请求的耗时 s
+        :param quota: 历史K线额度 (已用, 剩余)
+        """
+        self.klines = klines or {}
+        self.request_latency = request_latency
+        self.quota = quota
+        self.healthy = True
+        self.fail_requests = 0
+        self.closed = False
+        self.request_count = 0
+        self.health_check_count = 0
+        self.handlers = []
+        self.requested_codes: typing.Set[str] = set()
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.closed = True
+
+    def set_handler(self, handler):
+        self.handlers.append(handler)
+        return RET_OK
+
+    def subscribe(self, code_list, subtype_list, **kwargs):
+        if self.closed:
+            return RET_ERROR, "quote context closed"
+        return RET_OK, None
+
+    def get_global_state(self):
+        with self._lock:
+            self.health_check_count += 1
+        if self.closed or not self.healthy:
+            return RET_ERROR, "disconnected"
+        return RET_OK, {"qot_logined": True}
+
+    def get_history_kl_quota(self, get_detail=False):
+        if self.closed or not self.healthy:
+            return RET_ERROR, "disconnected"
+        used_quota, remain_quota = self.quota
+        detail_list = [{"code": code, "request_time": ""} for code in sorted(self.requested_codes)]
+        return RET_OK, (used_quota, remain_quota, detail_list if get_detail else [])
+
+    def request_history_kline(self, code, start=None, end=None, ktype=None, autype=None, fields=None,
+                              max_count=1000, page_req_key=None, extended_time=False):
+        if self.request_latency > 0:
+            time.sleep(self.request_latency)
+        with self._lock:
+            self.request_count += 1
+            if self.fail_requests > 0:
+                self.fail_requests -= 1
+                return RET_ERROR, "request timeout", None
+        if self.closed or not self.healthy:
+            return RET_ERROR, "disconnected", None
+        self.requested_codes.add(code)
+        df = self.klines.get(code)
+        if df is None or len(df) == 0:
+            return RET_OK, pd.DataFrame(columns=["code", "name", "time_key", "open", "close", "high", "low",
+                                                 "pe_ratio", "turnover_rate", "volume", "turnover", "change_rate",
+                                                 "last_close"]), None
+        days = df["time_key"].str.slice(0, 10)
+        df = df[(days >= start) & (days <= end)]
+        offset = page_req_key or 0
+        page = df.iloc[offset: offset + max_count].reset_index(drop=True)
+        next_key = offset + max_count if offset + max_count < len(df) else None
+        return RET_OK, page, next_key
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: fake_trade_context
+@author: jkguo
+@create: 2024/10/25
+"""
+import heapq
+import itertools
+import random
+import threading
+import time
+import typing
+import datetime
+import pandas as pd
+from futu import TradeOrderHandlerBase, TradeDealHandlerBase, OrderStatus, ModifyOrderOp, TrdSide, RET_OK, RET_ERROR
+
+
+class FakeSecTradeContext(object):
+    """
+    脚本化的模拟富途交易连接，用于离线测试和压测 FutuTrader
+    下单 / 撤单 / 解锁接口与 OpenSecTradeContext 一致，每笔订单按脚本在后台线程推送：
+    提交确认（ack_latency 后） -> partial_fills 次成交，最后一次在 fill_latency 后全部成交；
+    按 reject_ratio 的概率下单失败（推送 SUBMIT_FAILED）
+    """
+
+    def __init__(self, ack_latency: float = 0.001, fill_latency: float = 0.01, partial_fills: int = 1,
+                 reject_ratio: float = 0.0, place_latency: float = 0.0, push_deals: bool = True, seed: int = 0,
+                 price_improvement: float = 0.0):
+        """
+        :param ack_latency: 下单到提交确认推送的时间 s
+        :param fill_latency: 下单到全部成交推送的时间 s
+        :param partial_fills: 分几次成交
+        :param reject_ratio: 下单失败的比例
+        :param place_latency: place_order 接口本身的耗时 s
+        :param push_deals: 是否推送成交明细
+        :param seed: 随机种子
+        :param price_improvement: 成交价相对委托价的改善（买入更低 / 卖出更高）
+        """
+        self.ack_latency = ack_latency
+        self.fill_latency = fill_latency
+        self.partial_fills = max(1, partial_fills)
+        self.reject_ratio = reject_ratio
+        self.place_latency = place_latency
+        self.push_deals = push_deals
+        self.price_improvement = price_improvement
+        self.order_handler: typing.Optional[TradeOrderHandlerBase] = None
+        self.deal_handler: typing.Optional[TradeDealHandlerBase] = None
+        self.unlock_count = 0
+        self.place_count = 0
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        # (到期时间, 序号, 推送函数)
+        self._schedule: typing.List[typing.Tuple[float, int, typing.Callable[[], None]]] = []
+        # order_id -> 订单推送数据
+        self._orders: typing.Dict[str, dict] = {}
+        self._closed = False
+        self._push_thread = threading.Thread(target=self._push_loop, name="fake_trade_push", daemon=True)
+        self._push_thread.start()
+
+    def set_handler(self, handler):
+        if isinstance(handler, TradeOrderHandlerBase):
+            self.order_handler = handler
+        elif isinstance(handler, TradeDealHandlerBase):
+            self.deal_handler = handler
+        return RET_OK
+
+    def unlock_trade(self, password=None, password_md5=None, is_unlock=True):
+        self.unlock_count += 1
+        return RET_OK, None
+
+    def place_order(self, price, qty, code, trd_side, order_type="NORMAL", trd_env="REAL", acc_id=0,
+                    remark=None, **kwargs):
+        if self.place_latency > 0:
+            time.sleep(self.place_latency)
+        with self._cond:
+            if self._closed:
+                return RET_ERROR, "trade context closed"
+            self.place_count += 1
+            order_id = f"FAKE{next(self._ids):012d}"
+            order = {
+                "trd_env": trd_env, "code": code, "order_id": order_id, "trd_side": trd_side, "qty": qty,
+                "price": price, "order_status": OrderStatus.SUBMITTING, "dealt_qty": 0, "dealt_avg_price": 0.0,
+                "remark": remark, "updated_time": ""
+            }
+            self._orders[order_id] = order
+            now = time.monotonic()
+            if self._random.random() < self.reject_ratio:
+                self._push_at(now + self.ack_latency, order_id, OrderStatus.SUBMIT_FAILED)
+            else:
+                self._push_at(now + self.ack_latency, order_id, OrderStatus.SUBMITTED)
+                for i in range(1, self.partial_fills + 1):
+                    fill_qty = qty * i // self.partial_fills - qty * (i - 1) // self.partial_fills
+                    self._push_at(now + self.ack_latency + (self.fill_latency - self.ack_latency) * i / self.partial_fills,
+                                  order_id, OrderStatus.FILLED_ALL if i == self.partial_fills else OrderStatus.FILLED_PART,
+                                  fill_qty)
+        return RET_OK, pd.DataFrame([dict(order)])
+
+    def modify_order(self, modify_order_op, order_id, qty, price, adjust_limit=0, trd_env="REAL", acc_id=0,
+                     **kwargs):
+        with self._cond:
+            order = self._orders.get(order_id)
+            if order is None:
+                return RET_ERROR, f"order {order_id} not found"
+            if modify_order_op != ModifyOrderOp.CANCEL:
+                return RET_ERROR, f"modify_order_op {modify_order_op} not supported"
+            status = OrderStatus.CANCELLED_PART if order["dealt_qty"] > 0 else OrderStatus.CANCELLED_ALL
+            self._push_at(time.monotonic() + self.ack_latency, order_id, status)
+        return RET_OK, pd.DataFrame([{"order_id": order_id}])
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._push_thread is not threading.current_thread():
+            self._push_thread.join()
+
+    def _push_at(self, due: float, order_id: str, status: str, fill_qty: int = 0):
+        heapq.heappush(self._schedule, (due, next(self._ids), lambda: self._push(order_id, status, fill_qty)))
+        self._cond.notify()
+
+    def _push(self, order_id: str, status: str, fill_qty: int):
+        with self._cond:
+            order = self._orders.get(order_id)
+            if order is None or order["order_status"] in (OrderStatus.FILLED_ALL, OrderStatus.CANCELLED_ALL,
+                                                          OrderStatus.CANCELLED_PART, OrderStatus.SUBMIT_FAILED):
+                return
+            now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:23]
+            deal_price = order["price"] - self.price_improvement if order["trd_side"] == TrdSide.BUY \
+                else order["price"] + self.price_improvement
+            if fill_qty > 0:
+                order["dealt_avg_price"] = (order["dealt_avg_price"] * order["dealt_qty"] + deal_price * fill_qty) / \
+                                           (order["dealt_qty"] + fill_qty)
+                order["dealt_qty"] += fill_qty
+            order["order_status"] = status
+            order["updated_time"] = now_str
+            order_row = dict(order)
+            deal_row = {
+                "trd_env": order["trd_env"], "code": order["code"], "deal_id": f"D{next(self._ids):012d}",
+                "order_id": order_id, "qty": fill_qty, "price": deal_price, "trd_side": order["trd_side"],
+                "create_time": now_str, "status": "OK"
+            }
+            if status in (OrderStatus.FILLED_ALL, OrderStatus.CANCELLED_ALL, OrderStatus.CANCELLED_PART,
+                          OrderStatus.SUBMIT_FAILED):
+                self._orders.pop(order_id)
+        if fill_qty > 0 and self.push_deals and self.deal_handler is not None:
+            self.deal_handler.on_push_data(pd.DataFrame([deal_row]))
+        if self.order_handler is not None:
+            self.order_handler.on_push_data(pd.DataFrame([order_row]))
+
+    def _push_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and (len(self._schedule) == 0 or self._schedule[0][0] > time.monotonic()):
+                    timeout = self._schedule[0][0] - time.monotonic() if len(self._schedule) > 0 else None
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                _, _, push = heapq.heappop(self._schedule)
+            push()
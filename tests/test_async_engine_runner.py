@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_async_engine_runner
+@author: jkguo
+@create: 2024/10/26
+"""
+import asyncio
+import threading
+import time
+from jtrade.core.async_engine_runner import AsyncTradeEngineRunner
+
+STOCK_CODES = ["HK.00700", "HK.09988", "HK.03690"]
+
+
+class RecordingEngine(object):
+    """
+    记录收到的实时数据和处理线程，可阻塞在 gate 上
+    """
+
+    def __init__(self, stock_code: str, cost: float = 0, gate: threading.Event = None):
+        self.stock_code = stock_code
+        self.cost = cost
+        self.gate = gate
+        self.received = []
+        self.threads = set()
+
+    def on_rt_data(self, cur_data: dict):
+        if self.gate is not None:
+            self.gate.wait(timeout=5)
+        if self.cost > 0:
+            time.sleep(self.cost)
+        if cur_data.get("fail"):
+            raise Exception(f"engine {self.stock_code} failed")
+        self.received.append(cur_data["time"])
+        self.threads.add(threading.current_thread().name)
+
+
+def build_rt_data(stock_code: str, i: int, **kwargs) -> dict:
+    return dict({"code": stock_code, "time": f"2024-10-21 10:{i:02d}:00", "cur_price": 300.0}, **kwargs)
+
+
+def test_engines_run_in_order_and_stop_cleanly():
+    runner = AsyncTradeEngineRunner(max_workers=3)
+    engines = [RecordingEngine(code, cost=0.01) for code in STOCK_CODES]
+    for engine in engines:
+        runner.add_engine(engine)
+
+    async def run():
+        await runner.start()
+        start_time = time.perf_counter()
+        for i in range(5):
+            for code in STOCK_CODES:
+                await runner.submit(build_rt_data(code, i))
+        await runner.submit(build_rt_data(STOCK_CODES[0], 5, fail=True))
+        # 没有引擎的股票忽略
+        await runner.submit(build_rt_data("HK.00001", 0))
+        # 其他线程提交
+        thread = threading.Thread(target=runner.submit_threadsafe, args=(build_rt_data(STOCK_CODES[1], 6),))
+        thread.start()
+        thread.join()
+        await asyncio.sleep(0.01)
+        await runner.stop()
+        return time.perf_counter() - start_time
+
+    cost = asyncio.run(run())
+    for engine in engines:
+        expected = [f"2024-10-21 10:{i:02d}:00" for i in range(5)]
+        if engine.stock_code == STOCK_CODES[1]:
+            expected.append("2024-10-21 10:06:00")
+        assert engine.received == expected
+        assert all(name.startswith("trade_engine") for name in engine.threads)
+    # 不同股票并发执行
+    assert cost < 15 * 0.01
+    assert runner.processed_count == 16
+    assert runner.error_count == 1
+    assert runner.executor is None
+    assert runner._tasks == []
+    assert runner.queues == {}
+
+
+def test_submit_nowait_drops_when_full():
+    gate = threading.Event()
+    engine = RecordingEngine(STOCK_CODES[0], gate=gate)
+    runner = AsyncTradeEngineRunner(max_workers=1, queue_size=2)
+    runner.add_engine(engine)
+
+    async def run():
+        await runner.start()
+        results = [runner.submit_nowait(build_rt_data(STOCK_CODES[0], 0))]
+        # 第一条被取出后阻塞在引擎中，队列还能再放两条
+        await asyncio.sleep(0.05)
+        results.extend(runner.submit_nowait(build_rt_data(STOCK_CODES[0], i)) for i in range(1, 4))
+        gate.set()
+        await runner.stop()
+        return results
+
+    assert asyncio.run(run()) == [True, True, True, False]
+    assert engine.received == [f"2024-10-21 10:{i:02d}:00" for i in range(3)]
+    assert runner.dropped_count == 1
+    assert runner.processed_count == 3
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_engine_shard_supervisor
+@author: jkguo
+@create: 2024/10/26
+"""
+import time
+import pytest
+from jtrade.core.engine_shard_supervisor import EngineShardSupervisor, MSG_DECISIONS, MSG_ERROR
+from jtrade.core.stock_manager import StockManager
+from jtrade.core.trade_engine import TradeEngine
+from jtrade.core.trade_alg_base import TradeAlgBase, TradeDecision
+from jtrade.core.trader import KLineMockTrader
+from jtrade.models.dto import StockStatus
+from conftest import TEST_INIT_BALANCE
+
+STOCK_CODES = ["HK.00700", "HK.09988"]
+
+
+class ScriptedEngine(object):
+    """
+    工作进程中的引擎： 快照中没有持股且资金足够时买入
+    """
+
+    def __init__(self, stock_code: str):
+        self.stock_code = stock_code
+
+    def gen_decisions(self, cur_data: dict, account_state: dict):
+        if len(account_state["stocks"]) > 0 or account_state["available_balance"] < cur_data["cur_price"] * 100:
+            return []
+        decision = TradeDecision()
+        decision.trade_op = TradeDecision.TRADE_OP_BUY
+        decision.stock_code = self.stock_code
+        decision.stock_holding_id = f"{self.stock_code}_{cur_data['time']}"
+        decision.quantity = 100
+        decision.price = cur_data["cur_price"]
+        decision.trader_name = "scripted"
+        return [decision]
+
+
+def scripted_engine_factory(stock_code: str) -> ScriptedEngine:
+    return ScriptedEngine(stock_code)
+
+
+def failing_engine_factory(stock_code: str) -> ScriptedEngine:
+    raise Exception(f"no engine for {stock_code}")
+
+
+def build_rt_data(stock_code: str, cur_time: str, cur_price: float) -> dict:
+    return {"code": stock_code, "time": cur_time, "cur_price": cur_price}
+
+
+def test_decisions_executed_on_supervisor_account(account):
+    engines = {}
+
+    def executor_factory(stock_code: str) -> TradeEngine:
+        stock_manager = StockManager(account, stock_code)
+        engines[stock_code] = TradeEngine(stock_manager, None, TradeAlgBase(), KLineMockTrader(stock_manager))
+        return engines[stock_code]
+
+    supervisor = EngineShardSupervisor(STOCK_CODES, scripted_engine_factory, num_workers=2,
+                                       executor_factory=executor_factory)
+    supervisor.start()
+    try:
+        results = supervisor.process_batch([build_rt_data(code, "2024-10-21 10:00:00", 300.0)
+                                            for code in STOCK_CODES])
+        assert sorted(item[2] for item in results if item[0] == MSG_DECISIONS) == STOCK_CODES
+        # 下一批的快照包含已执行的买单，不再重复买入
+        results = supervisor.process_batch([build_rt_data(code, "2024-10-21 10:01:00", 300.0)
+                                            for code in STOCK_CODES])
+        assert results == []
+    finally:
+        supervisor.stop()
+    for code in STOCK_CODES:
+        stocks = engines[code].stock_manager.load_all_valid_stocks()
+        assert [stock.status for stock in stocks.values()] == [StockStatus.BUYING]
+    # 两只股票的买单都冻结在同一个账户上
+    assert TEST_INIT_BALANCE - account.get_available_balance() > 2 * 300.0 * 100
+    assert supervisor.metrics()["processed"] == 4
+    assert supervisor.metrics()["decisions"] == 2
+
+
+def mock_executor_factory(account):
+    def executor_factory(stock_code: str) -> TradeEngine:
+        stock_manager = StockManager(account, stock_code)
+        return TradeEngine(stock_manager, None, TradeAlgBase(), KLineMockTrader(stock_manager))
+    return executor_factory
+
+
+def test_execute_error_reported(account):
+    executor_factory = mock_executor_factory(account)
+
+    supervisor = EngineShardSupervisor(STOCK_CODES[:1], scripted_engine_factory, num_workers=1,
+                                       executor_factory=executor_factory)
+    supervisor.start()
+    try:
+        # 价格非法，主进程执行时决策校验失败
+        results = supervisor.process_batch([build_rt_data(STOCK_CODES[0], "2024-10-21 10:00:00", -1.0)])
+    finally:
+        supervisor.stop()
+    assert [item[0] for item in results] == [MSG_ERROR]
+    assert account.get_available_balance() == TEST_INIT_BALANCE
+
+
+def test_ticks_of_same_stock_see_previous_decisions(account):
+    executor_factory = mock_executor_factory(account)
+    supervisor = EngineShardSupervisor(STOCK_CODES, scripted_engine_factory, num_workers=2,
+                                       executor_factory=executor_factory)
+    supervisor.start()
+    try:
+        data_list = [build_rt_data(code, f"2024-10-21 10:0{i}:00", 300.0) for i in range(3) for code in STOCK_CODES]
+        with pytest.raises(Exception):
+            supervisor.submit_batch(data_list)
+        results = supervisor.process_batch(data_list)
+    finally:
+        supervisor.stop()
+    # 同一股票后面的数据的快照已包含第一条数据的买单，只买入一次
+    decisions = [item for item in results if item[0] == MSG_DECISIONS]
+    assert sorted((item[2], item[3]) for item in decisions) == [(code, "2024-10-21 10:00:00") for code in STOCK_CODES]
+    assert supervisor.metrics()["processed"] == 6
+
+
+def test_worker_init_error_raised(account):
+    supervisor = EngineShardSupervisor(STOCK_CODES[:1], failing_engine_factory, num_workers=1,
+                                       executor_factory=mock_executor_factory(account))
+    supervisor.start()
+    start_time = time.time()
+    try:
+        with pytest.raises(Exception, match="engine shard"):
+            supervisor.process_batch([build_rt_data(STOCK_CODES[0], "2024-10-21 10:00:00", 300.0)])
+    finally:
+        supervisor.stop(timeout=10)
+    assert time.time() - start_time < 10
+    assert supervisor.metrics()["errors"] == 1
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_futu_sdk
+@author: jkguo
+@create: 2024/10/26
+"""
+import time
+import threading
+import pytest
+from futu import KLType
+from jtrade.core.futu_sdk import FutuQuoteContextPool, FutuRateLimiter, FutuSdk
+from fakes.fake_quote_context import FakeQuoteContext, generate_klines
+
+
+class ContextFactory(object):
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.created = []
+
+    def __call__(self) -> FakeQuoteContext:
+        quote_ctx = FakeQuoteContext(**self.kwargs)
+        self.created.append(quote_ctx)
+        return quote_ctx
+
+
+def test_pool_reuses_idle_context():
+    factory = ContextFactory()
+    pool = FutuQuoteContextPool(factory, max_size=2, health_check_interval=60)
+    with pool.checkout() as first:
+        pass
+    with pool.checkout() as second:
+        assert second is first
+    assert len(factory.created) == 1
+    # 闲置时间未超过检查间隔时不做健康检查
+    assert first.health_check_count == 0
+    assert pool.stats() == {"size": 1, "idle": 1, "max_size": 2}
+
+
+def test_pool_health_check_reconnects_idle_context():
+    factory = ContextFactory()
+    pool = FutuQuoteContextPool(factory, max_size=1, health_check_interval=0)
+    with pool.checkout() as first:
+        pass
+    first.healthy = False
+    with pool.checkout() as second:
+        assert second is not first
+    assert first.closed
+    assert len(factory.created) == 2
+    assert pool.stats()["size"] == 1
+
+
+def test_pool_drops_broken_context_after_error():
+    factory = ContextFactory()
+    pool = FutuQuoteContextPool(factory, max_size=1, health_check_interval=60)
+    with pytest.raises(Exception, match="disconnected"):
+        with pool.checkout() as first:
+            first.healthy = False
+            raise Exception("disconnected")
+    assert first.closed
+    assert pool.stats() == {"size": 0, "idle": 0, "max_size": 1}
+    with pool.checkout() as second:
+        assert second is not first
+
+
+def test_pool_keeps_healthy_context_after_error():
+    factory = ContextFactory()
+    pool = FutuQuoteContextPool(factory, max_size=1, health_check_interval=60)
+    with pytest.raises(ValueError):
+        with pool.checkout() as first:
+            raise ValueError("bad argument")
+    with pool.checkout() as second:
+        assert second is first
+
+
+def test_pool_checkout_timeout_and_wakeup():
+    factory = ContextFactory()
+    pool = FutuQuoteContextPool(factory, max_size=1, checkout_timeout=0.05)
+    with pool.checkout():
+        with pytest.raises(Exception, match="timeout"):
+            with pool.checkout():
+                pass
+    # 归还后等待中的借出被唤醒
+    pool.checkout_timeout = 5
+    acquired = threading.Event()
+    release = threading.Event()
+
+    def wait_checkout():
+        with pool.checkout():
+            acquired.set()
+            release.wait(timeout=5)
+
+    t = threading.Thread(target=wait_checkout)
+    try:
+        with pool.checkout():
+            t.start()
+            time.sleep(0.02)
+            assert not acquired.is_set()
+        assert acquired.wait(timeout=5)
+    finally:
+        # 等待中的线程归还连接后再关闭连接池
+        release.set()
+        t.join()
+        pool.close()
+    assert len(factory.created) == 1
+    assert factory.created[0].closed
+
+
+def test_pool_close():
+    factory = ContextFactory()
+    pool = FutuQuoteContextPool(factory, max_size=2)
+    with pool.checkout() as quote_ctx:
+        pass
+    pool.close()
+    assert quote_ctx.closed
+    with pytest.raises(Exception, match="closed"):
+        with pool.checkout():
+            pass
+
+
+def test_rate_limiter_blocks_within_period():
+    limiter = FutuRateLimiter(3, 0.2)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.1
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.19
+
+
+def test_sdk_query_kline_pages_through_rate_limiter():
+    klines = generate_klines("HK.00700", "2024-10-14", "2024-10-18")
+    factory = ContextFactory(klines={"HK.00700": klines})
+    sdk = FutuSdk(quote_ctx_factory=factory, pool_size=1)
+    sdk.KLINE_PAGE_SIZE = 400
+    sdk.kline_rate_limiter = FutuRateLimiter(100, 30)
+    df = sdk.query_kline("HK.00700", "2024-10-15 00:00:00", "2024-10-16 12:00:00", KLType.K_1M)
+    # 两天 662 条 -> 2 页
+    assert factory.created[0].request_count == 2
+    assert len(sdk.kline_rate_limiter._request_times) == 2
+    assert df["time_key"].iloc[0] == "2024-10-15 09:30:00"
+    assert df["time_key"].iloc[-1] == "2024-10-16 12:00:00"
+    assert len(df) == 331 + 151
+    sdk.close()
+
+
+def test_sdk_reconnects_after_failed_request():
+    klines = generate_klines("HK.00700", "2024-10-14", "2024-10-14")
+    factory = ContextFactory(klines={"HK.00700": klines})
+    sdk = FutuSdk(quote_ctx_factory=factory, pool_size=1)
+    with sdk.quote_ctx_pool.checkout() as quote_ctx:
+        pass
+    # 连接断开：请求失败，归还时健康检查失败后丢弃，下一次请求重建连接
+    quote_ctx.healthy = False
+    with pytest.raises(Exception, match="failed"):
+        sdk.query_kline("HK.00700", "2024-10-14 00:00:00", "2024-10-14 23:59:00", KLType.K_1M)
+    assert quote_ctx.closed
+    df = sdk.query_kline("HK.00700", "2024-10-14 00:00:00", "2024-10-14 23:59:00", KLType.K_1M)
+    assert len(df) == 331
+    assert len(factory.created) == 2
+    used_quota, remain_quota, codes = sdk.query_history_kline_quota()
+    assert codes == {"HK.00700"}
+    sdk.close()
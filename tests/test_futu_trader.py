@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_futu_trader
+@author: jkguo
+@create: 2024/10/26
+"""
+import pytest
+from futu import TrdSide
+from jtrade.core.futu_trader import FutuTrader
+from fakes.fake_trade_context import FakeSecTradeContext
+from jtrade.models.dto import StockStatus, TradeOrderStatus
+from jtrade.utils.fee_util import calc_hk_ext_fee
+from conftest import TEST_ACCOUNT, TEST_STOCK_CODE, TEST_INIT_BALANCE, build_order, wait_until
+
+
+def start_trader(stock_manager, **fake_kwargs):
+    fake_ctx = FakeSecTradeContext(**fake_kwargs)
+    trader = FutuTrader(stock_manager.account.acc_dto, trade_ctx_factory=lambda: fake_ctx, order_rate_limit=(1000, 1))
+    trader.register_stock_manager(stock_manager)
+    trader.start()
+    return trader
+
+
+def stock_status(stock_manager, holding_id):
+    stock = stock_manager.position_book.get(holding_id)
+    return None if stock is None else stock.status
+
+
+def submit_buy(stock_manager, trader, holding_id, quantity=100, price=300.0):
+    order = build_order(TrdSide.BUY, holding_id, quantity, price)
+    stock_manager.on_stock_submit_buying(order)
+    trader.open_position(order)
+    return order
+
+
+def submit_sell(stock_manager, trader, holding_id, quantity=100, price=310.0):
+    order = build_order(TrdSide.SELL, holding_id, quantity, price)
+    stock_manager.on_stock_submit_selling(order)
+    trader.close_position(order)
+    return order
+
+
+@pytest.fixture
+def trader_factory(stock_manager):
+    traders = []
+
+    def factory(**fake_kwargs):
+        trader = start_trader(stock_manager, **fake_kwargs)
+        traders.append(trader)
+        return trader
+    yield factory
+    for trader in traders:
+        trader.close()
+
+
+def test_partial_fills_then_all_traded(stock_manager, trader_factory):
+    trader = trader_factory(partial_fills=3, fill_latency=0.01)
+    order = submit_buy(stock_manager, trader, "h1")
+    wait_until(lambda: stock_status(stock_manager, "h1") == StockStatus.HOLDING)
+    assert order.order_status == TradeOrderStatus.ALL_TRADED
+    assert len(order.ext_detail["deals"]) == 3
+    assert order.ext_detail["dealt_qty"] == 100
+    stock = stock_manager.position_book.get("h1")
+    assert stock.quantity == 100
+
+
+def test_submit_failed_refunds(stock_manager, trader_factory):
+    trader = trader_factory(reject_ratio=1.0)
+    order = submit_buy(stock_manager, trader, "h1")
+    wait_until(lambda: stock_status(stock_manager, "h1") == StockStatus.DELETED)
+    assert order.order_status == TradeOrderStatus.CANCELLED
+    assert stock_manager.account.get_available_balance() == TEST_INIT_BALANCE
+
+
+def test_buy_part_filled_then_cancelled(stock_manager, trader_factory, memory_context):
+    trader = trader_factory(partial_fills=2, ack_latency=0.001, fill_latency=2.0)
+    order = submit_buy(stock_manager, trader, "h1", quantity=100, price=300.0)
+    wait_until(lambda: order.order_status == TradeOrderStatus.PART_TRADED)
+    trader.cancel_order(order)
+    wait_until(lambda: stock_status(stock_manager, "h1") == StockStatus.HOLDING)
+    assert order.order_status == TradeOrderStatus.PART_CANCELLED
+    stock = stock_manager.position_book.get("h1")
+    assert stock.quantity == 50
+    assert stock.buy_total_amount == 50 * 300.0
+    dealt_fee, _ = calc_hk_ext_fee(50 * 300.0)
+    assert stock.buy_all_ext_fee == dealt_fee
+    # 只扣除已成交部分的金额和费用
+    expected_balance = round(TEST_INIT_BALANCE - 50 * 300.0 - dealt_fee, 4)
+    assert stock_manager.account.get_available_balance() == pytest.approx(expected_balance)
+    stored = memory_context.backend().trade_account_repo().get(TEST_ACCOUNT).account_balance
+    assert stored == pytest.approx(expected_balance)
+
+
+def test_sell_part_filled_then_cancelled(stock_manager, trader_factory):
+    trader = trader_factory(partial_fills=1, fill_latency=0.002)
+    submit_buy(stock_manager, trader, "h1", quantity=100, price=300.0)
+    wait_until(lambda: stock_status(stock_manager, "h1") == StockStatus.HOLDING)
+    balance = stock_manager.account.get_available_balance()
+    trader.close()
+    trader = trader_factory(partial_fills=4, ack_latency=0.001, fill_latency=4.0)
+    order = submit_sell(stock_manager, trader, "h1", quantity=100, price=310.0)
+    wait_until(lambda: order.order_status == TradeOrderStatus.PART_TRADED)
+    trader.cancel_order(order)
+    wait_until(lambda: stock_status(stock_manager, "h1") == StockStatus.HOLDING)
+    assert order.order_status == TradeOrderStatus.PART_CANCELLED
+    stock = stock_manager.position_book.get("h1")
+    assert stock.quantity == 75
+    sold_stocks = stock_manager.load_all_sold_stocks()
+    assert len(sold_stocks) == 1
+    sold = list(sold_stocks.values())[0]
+    assert sold.quantity == 25
+    assert sold.sell_total_amount == 25 * 310.0
+    assert sold.buy_total_amount + stock.buy_total_amount == pytest.approx(100 * 300.0)
+    sold_fee, _ = calc_hk_ext_fee(25 * 310.0)
+    assert sold.trade_profit == pytest.approx(25 * 310.0 - sold.buy_total_amount - sold_fee - sold.buy_all_ext_fee)
+    assert stock_manager.account.get_available_balance() == pytest.approx(balance + 25 * 310.0 - sold_fee)
+    assert sold.stock_code == TEST_STOCK_CODE
+    assert sold.stock_holding_id == f"h1_{order.order_id}"
+
+
+def test_fill_price_difference_settled(stock_manager, trader_factory, memory_context):
+    trader = trader_factory(partial_fills=2, fill_latency=0.005, price_improvement=1.0)
+    order = submit_buy(stock_manager, trader, "h1", quantity=100, price=300.0)
+    wait_until(lambda: stock_status(stock_manager, "h1") == StockStatus.HOLDING)
+    # 订单保持委托价，成交均价单独记录
+    assert order.price == 300.0
+    assert order.ext_detail["dealt_avg_price"] == pytest.approx(299.0)
+    stock = stock_manager.position_book.get("h1")
+    buy_fee, _ = calc_hk_ext_fee(100 * 299.0)
+    assert stock.buy_price == pytest.approx(299.0)
+    assert stock.buy_total_amount == pytest.approx(100 * 299.0)
+    assert stock.buy_all_ext_fee == buy_fee
+    balance = TEST_INIT_BALANCE - 100 * 299.0 - buy_fee
+    assert stock_manager.account.get_available_balance() == pytest.approx(balance)
+    sell_order = submit_sell(stock_manager, trader, "h1", quantity=100, price=310.0)
+    wait_until(lambda: stock_status(stock_manager, "h1") == StockStatus.SOLD)
+    assert sell_order.price == 310.0
+    stock = stock_manager.position_book.get("h1")
+    sell_fee, _ = calc_hk_ext_fee(100 * 311.0)
+    assert stock.sell_total_amount == pytest.approx(100 * 311.0)
+    assert stock.trade_profit == pytest.approx(100 * 311.0 - 100 * 299.0 - buy_fee - sell_fee)
+    balance += 100 * 311.0 - sell_fee
+    assert stock_manager.account.get_available_balance() == pytest.approx(balance)
+    stored = memory_context.backend().trade_account_repo().get(TEST_ACCOUNT).account_balance
+    assert stored == pytest.approx(balance)
+
+
+def test_notifications_carry_push_state(stock_manager, trader_factory):
+    trader = trader_factory(partial_fills=3, fill_latency=0.01)
+    notified = []
+    trader.set_order_listener(lambda o: notified.append((o, o.order_status, dict(o.ext_detail or {}).get("dealt_qty"))))
+    order = build_order(TrdSide.BUY, "h1", 100, 300.0)
+    trader.open_position(order)
+    wait_until(lambda: order.order_status == TradeOrderStatus.ALL_TRADED)
+    wait_until(lambda: any(status == TradeOrderStatus.ALL_TRADED for _, status, _ in notified))
+    # 每次通知是独立快照，之后的推送不会修改之前通知的订单
+    assert len({id(o) for o, _, _ in notified}) == len(notified)
+    assert all(o is not order for o, _, _ in notified)
+    for o, status, dealt_qty in notified:
+        assert o.order_status == status
+        assert dict(o.ext_detail or {}).get("dealt_qty") == dealt_qty
+    part_qty = [qty for _, status, qty in notified if status == TradeOrderStatus.PART_TRADED]
+    assert part_qty and part_qty == sorted(part_qty) and part_qty[-1] < 100
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_kline_buffer
+@author: jkguo
+@create: 2024/10/26
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from jtrade.core.kline_buffer import KLineRingBuffer
+
+
+def build_segment(begin_time: int, count: int) -> dict:
+    times = np.arange(begin_time, begin_time + count, dtype='int64')
+    segment = {'time': times, 'close': times.astype('float64') / 10}
+    for values in segment.values():
+        values.setflags(write=False)
+    return segment
+
+
+def test_segments_query_inside_one_segment_is_view():
+    buffer = KLineRingBuffer(column_names=['code', 'time', 'close'])
+    segments = [build_segment(100, 10), build_segment(200, 10)]
+    buffer.assign_segments(segments, {'code': 'HK.00700'})
+    assert len(buffer) == 20
+    assert buffer.first_time() == 100
+    assert buffer.last_time() == 209
+    close = buffer.column('close', 202, 205)
+    assert np.shares_memory(close, segments[1]['close'])
+    assert close.tolist() == [20.2, 20.3, 20.4, 20.5]
+    df = buffer.query(100, 109)
+    assert df['code'].tolist() == ['HK.00700'] * 10
+    assert df['time'].tolist() == list(range(100, 110))
+
+
+def test_segments_query_across_segments():
+    buffer = KLineRingBuffer(column_names=['time', 'close'])
+    buffer.assign_segments([build_segment(100, 10), build_segment(200, 10)])
+    times = buffer.column('time', 105, 203)
+    assert times.tolist() == list(range(105, 110)) + list(range(200, 204))
+    assert buffer.column('close', 105, 203).tolist() == [t / 10 for t in times.tolist()]
+    assert len(buffer.column('close', 150, 160)) == 0
+
+
+def test_segments_evict_and_append():
+    buffer = KLineRingBuffer(column_names=['time', 'close'])
+    segments = [build_segment(100, 10), build_segment(200, 10)]
+    buffer.assign_segments(segments)
+    assert buffer.evict_before(203) == 13
+    assert buffer.first_time() == 203
+    assert np.shares_memory(buffer.column('close', 203, 209), segments[1]['close'])
+    # 追加后转为普通数组，原日块不被修改
+    buffer.append(pd.DataFrame({'time': [209, 210], 'close': [1.0, 2.0]}))
+    assert buffer.column('time', 0, 1000).tolist() == list(range(203, 211))
+    assert buffer.column('close', 209, 210).tolist() == [1.0, 2.0]
+    assert segments[1]['close'][-1] == 20.9
+    assert not np.shares_memory(buffer.column('close', 203, 210), segments[1]['close'])
+
+
+def test_query_views_are_read_only():
+    buffer = KLineRingBuffer(column_names=['time', 'close'])
+    buffer.append(pd.DataFrame({'time': [100, 101, 102], 'close': [1.0, 2.0, 3.0]}))
+    close = buffer.column('close', 100, 102)
+    assert np.shares_memory(close, buffer.columns['close'])
+    with pytest.raises(ValueError):
+        close[0] = 9.0
+    df = buffer.query(100, 102)
+    with pytest.raises(ValueError):
+        df.loc[0, 'close'] = 9.0
+    # 新增列和拷贝后的修改不影响缓冲区
+    df['close2'] = df['close'] * 2
+    df = df.copy()
+    df.loc[0, 'close'] = 9.0
+    assert buffer.column('close', 100, 102).tolist() == [1.0, 2.0, 3.0]
+    # 追加不受只读视图影响
+    buffer.append(pd.DataFrame({'time': [103], 'close': [4.0]}))
+    assert buffer.column('close', 100, 103).tolist() == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_segment_views_are_read_only():
+    buffer = KLineRingBuffer(column_names=['code', 'time', 'close'])
+    segments = [build_segment(100, 10), build_segment(200, 10)]
+    for segment in segments:
+        segment['close'].setflags(write=True)
+    buffer.assign_segments(segments, {'code': 'HK.00700'})
+    # 段内视图、跨段拼接和常量列都是只读的
+    for values in (buffer.column('close', 202, 205), buffer.column('close', 105, 203), buffer.column('code', 100, 105)):
+        with pytest.raises(ValueError):
+            values[0] = values[1]
+    assert segments[1]['close'][2] == 20.2
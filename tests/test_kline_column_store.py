@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_kline_column_store
+@author: jkguo
+@create: 2024/10/26
+"""
+import os
+import numpy as np
+from fakes.fake_quote_context import generate_klines
+from jtrade.models.kline_column_store import StockKLineColumnStore
+from jtrade.utils import date_utils
+from conftest import TEST_STOCK_CODE
+
+KLINES = generate_klines(TEST_STOCK_CODE, "2024-10-07", "2024-10-11")
+DAYS = KLINES["time_key"].str.slice(0, 10)
+
+
+def day_klines(day: str):
+    return KLINES[DAYS == day].reset_index(drop=True)
+
+
+def day_begin(day: str) -> int:
+    return date_utils.time_str2epoch_min(day + " 00:00:00")
+
+
+def day_end(day: str) -> int:
+    return date_utils.time_str2epoch_min(day + " 23:59:00")
+
+
+def segment_dirs(store: StockKLineColumnStore):
+    return sorted(name for name in os.listdir(store.store_dir) if name.startswith("seg_"))
+
+
+def test_append_writes_new_segment_only(tmp_path):
+    store = StockKLineColumnStore(str(tmp_path), TEST_STOCK_CODE)
+    store.store(day_klines("2024-10-07"), day_begin("2024-10-07"))
+    first_segment = segment_dirs(store)
+    mtime = os.stat(os.path.join(store.store_dir, first_segment[0], "close.npy")).st_mtime_ns
+    store.store(day_klines("2024-10-08"))
+    assert store.segment_count() == 2
+    assert segment_dirs(store)[0] == first_segment[0]
+    assert os.stat(os.path.join(store.store_dir, first_segment[0], "close.npy")).st_mtime_ns == mtime
+    df = store.query(day_begin("2024-10-07"), day_end("2024-10-08"))
+    expected = KLINES[DAYS <= "2024-10-08"]
+    assert list(df["time_key"]) == list(expected["time_key"])
+    assert np.array_equal(df["close"].to_numpy(), expected["close"].to_numpy())
+    assert store.count() == len(expected)
+    assert store.begin_time() == day_begin("2024-10-07")
+
+
+def test_query_inside_one_segment_is_view(tmp_path):
+    store = StockKLineColumnStore(str(tmp_path), TEST_STOCK_CODE)
+    store.store(day_klines("2024-10-07"))
+    store.store(day_klines("2024-10-08"))
+    data = store.query_columns(day_begin("2024-10-08"), day_end("2024-10-08"), ["time", "close"])
+    assert isinstance(data["close"].base, np.memmap) or isinstance(data["close"], np.memmap)
+    assert len(data["time"]) == len(day_klines("2024-10-08"))
+
+
+def test_overlap_rewrites_only_overlapped_segments(tmp_path):
+    store = StockKLineColumnStore(str(tmp_path), TEST_STOCK_CODE)
+    for day in ["2024-10-07", "2024-10-08", "2024-10-09"]:
+        store.store(day_klines(day))
+    first, second, third = segment_dirs(store)
+    # 重写 10-08 的部分K线，新数据为准
+    update = day_klines("2024-10-08").iloc[10:20].copy()
+    update["close"] = 1.0
+    store.store(update)
+    names = segment_dirs(store)
+    assert len(names) == 3
+    assert first in names and third in names and second not in names
+    df = store.query(day_begin("2024-10-08"), day_end("2024-10-08"))
+    assert len(df) == len(day_klines("2024-10-08"))
+    assert (df["close"].iloc[10:20] == 1.0).all()
+    assert np.array_equal(df["close"].iloc[20:].to_numpy(), day_klines("2024-10-08")["close"].iloc[20:].to_numpy())
+
+
+def test_backfill_lowers_begin_time(tmp_path):
+    store = StockKLineColumnStore(str(tmp_path), TEST_STOCK_CODE)
+    store.store(day_klines("2024-10-09"), day_begin("2024-10-09"))
+    store.store(day_klines("2024-10-07"))
+    assert store.begin_time() == int(day_klines("2024-10-07")["time_key"].map(date_utils.time_str2epoch_min).iloc[0])
+    store.store(day_klines("2024-10-08"), day_begin("2024-10-06"))
+    assert store.begin_time() == day_begin("2024-10-06")
+    df = store.query(day_begin("2024-10-06"), day_end("2024-10-09"))
+    assert list(df["time_key"]) == list(KLINES[DAYS <= "2024-10-09"]["time_key"])
+
+
+def test_compact(tmp_path):
+    store = StockKLineColumnStore(str(tmp_path), TEST_STOCK_CODE)
+    for day in ["2024-10-07", "2024-10-08", "2024-10-09", "2024-10-10", "2024-10-11"]:
+        store.store(day_klines(day))
+    before = store.query(day_begin("2024-10-07"), day_end("2024-10-11"))
+    store.compact()
+    assert store.segment_count() == 1
+    assert len(segment_dirs(store)) == 1
+    after = store.query(day_begin("2024-10-07"), day_end("2024-10-11"))
+    assert before.equals(after)
+    # 另一个实例读到同样的数据
+    other = StockKLineColumnStore(str(tmp_path), TEST_STOCK_CODE)
+    assert other.query(day_begin("2024-10-07"), day_end("2024-10-11")).equals(after)
+
+
+def test_auto_compact(tmp_path, monkeypatch):
+    monkeypatch.setattr(StockKLineColumnStore, "MAX_SEGMENTS", 2)
+    store = StockKLineColumnStore(str(tmp_path), TEST_STOCK_CODE)
+    for day in ["2024-10-07", "2024-10-08", "2024-10-09"]:
+        store.store(day_klines(day))
+    assert store.segment_count() == 1
+    assert store.count() == len(KLINES[DAYS <= "2024-10-09"])
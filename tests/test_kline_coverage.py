@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_kline_coverage
+@author: jkguo
+@create: 2024/10/26
+"""
+from jtrade.core.kline_coverage import KLineCoverageIndex
+from jtrade.models.kline_column_store import StockKLineColumnStoreCoverageRepo
+
+
+def test_add_merges_overlapping_and_adjacent(tmp_path):
+    index = KLineCoverageIndex(StockKLineColumnStoreCoverageRepo(str(tmp_path)))
+    index.add(100, 200)
+    index.add(300, 400)
+    index.add(201, 250)
+    assert index.intervals == [[100, 250], [300, 400]]
+    index.add(240, 310)
+    assert index.intervals == [[100, 400]]
+    index.dirty = False
+    # 已覆盖的区间不标记修改
+    index.add(150, 160)
+    assert not index.dirty
+
+
+def test_missing_returns_gaps(tmp_path):
+    index = KLineCoverageIndex(StockKLineColumnStoreCoverageRepo(str(tmp_path)))
+    index.add(100, 200)
+    index.add(300, 400)
+    assert index.missing(50, 450) == [(50, 99), (201, 299), (401, 450)]
+    assert index.missing(150, 350) == [(201, 299)]
+    assert index.missing(120, 180) == []
+    assert index.is_covered(300, 400)
+    assert not index.is_covered(200, 300)
+
+
+def test_save_and_reload(tmp_path):
+    repo = StockKLineColumnStoreCoverageRepo(str(tmp_path))
+    index = KLineCoverageIndex(repo)
+    index.add(100, 200)
+    index.add(300, 400)
+    index.save()
+    assert not index.dirty
+    reloaded = KLineCoverageIndex(StockKLineColumnStoreCoverageRepo(str(tmp_path)))
+    assert reloaded.intervals == [[100, 200], [300, 400]]
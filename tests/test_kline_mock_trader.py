@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_kline_mock_trader
+@author: jkguo
+@create: 2024/10/26
+"""
+from futu import TrdSide
+from jtrade.core.trader import KLineMockTrader
+from jtrade.models.dto import StockStatus, TradeOrderStatus
+from conftest import TEST_INIT_BALANCE, build_order, buy_and_fill
+
+
+def submit_buy(stock_manager, trader, holding_id, price, quantity=100):
+    order = build_order(TrdSide.BUY, holding_id, quantity, price)
+    stock_manager.on_stock_submit_buying(order)
+    trader.open_position(order)
+    return order
+
+
+def test_order_matches_next_bar_only(stock_manager):
+    trader = KLineMockTrader(stock_manager)
+    # 第 t 根K线先撮合，再按收盘价下单
+    trader.on_kline_update("2024-10-21 10:00:00", 300.0, high=302.0, low=298.0)
+    order = submit_buy(stock_manager, trader, "h1", price=299.0)
+    assert order.order_status == TradeOrderStatus.INITIALIZED
+    # 第 t+1 根K线最低价高于买入价，不成交
+    trader.on_kline_update("2024-10-21 10:01:00", 301.0, high=302.0, low=300.0)
+    assert stock_manager.position_book.get("h1").status == StockStatus.BUYING
+    # 第 t+2 根K线最低价触及买入价，按挂单价成交
+    trader.on_kline_update("2024-10-21 10:02:00", 300.0, high=301.0, low=299.0)
+    stock = stock_manager.position_book.get("h1")
+    assert order.order_status == TradeOrderStatus.ALL_TRADED
+    assert order.complete_time == "2024-10-21 10:02:00"
+    assert stock.status == StockStatus.HOLDING
+    assert stock.buy_price == 299.0
+
+
+def test_price_priority(stock_manager):
+    trader = KLineMockTrader(stock_manager)
+    low_bid = submit_buy(stock_manager, trader, "h1", price=295.0)
+    high_bid = submit_buy(stock_manager, trader, "h2", price=300.0)
+    trader.on_kline_update("2024-10-21 10:01:00", 299.0, high=301.0, low=298.0)
+    assert high_bid.order_status == TradeOrderStatus.ALL_TRADED
+    assert low_bid.order_status == TradeOrderStatus.INITIALIZED
+    assert list(trader.buy_orders) == [low_bid.order_id]
+
+
+def test_sell_matches_high(stock_manager):
+    trader = KLineMockTrader(stock_manager)
+    buy_and_fill(stock_manager, "h1", price=300.0)
+    order = build_order(TrdSide.SELL, "h1", 100, 305.0)
+    stock_manager.on_stock_submit_selling(order)
+    trader.close_position(order)
+    trader.on_kline_update("2024-10-21 10:01:00", 303.0, high=304.9, low=302.0)
+    assert stock_manager.position_book.get("h1").status == StockStatus.SELLING
+    trader.on_kline_update("2024-10-21 10:02:00", 304.0, high=305.0, low=303.0)
+    stock = stock_manager.position_book.get("h1")
+    assert stock.status == StockStatus.SOLD
+    assert stock.sell_total_amount == 100 * 305.0
+
+
+def test_day_end_cancels_and_refunds(stock_manager):
+    trader = KLineMockTrader(stock_manager)
+    submit_buy(stock_manager, trader, "h1", price=290.0)
+    trader.on_kline_update("2024-10-21 16:00:00", 300.0, high=301.0, low=299.0)
+    assert stock_manager.position_book.get("h1").status == StockStatus.DELETED
+    # 收盘K线之后提交的订单在下一交易日第一根K线前撤销
+    submit_buy(stock_manager, trader, "h2", price=300.0)
+    trader.on_kline_update("2024-10-22 09:30:00", 300.0, high=301.0, low=299.0)
+    assert stock_manager.position_book.get("h2").status == StockStatus.DELETED
+    assert stock_manager.account.get_available_balance() == TEST_INIT_BALANCE
+    assert trader.buy_orders == {}
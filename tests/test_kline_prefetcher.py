@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_kline_prefetcher
+@author: jkguo
+@create: 2024/10/26
+"""
+import pytest
+from jtrade.core.trade_context import get_context
+from jtrade.core.futu_sdk import FutuSdk
+from fakes.fake_quote_context import FakeQuoteContext
+from jtrade.core.kline_prefetcher import KLinePrefetcher
+from test_stock_kline_lib import KLINES, new_memory_context, new_kline_lib
+from conftest import TEST_STOCK_CODE
+
+DAYS = KLINES["time_key"].str.slice(0, 10)
+
+
+@pytest.fixture
+def fake_quote_ctx():
+    return FakeQuoteContext(klines={TEST_STOCK_CODE: KLINES})
+
+
+def new_prefetcher(quote_ctx: FakeQuoteContext) -> KLinePrefetcher:
+    ctx = get_context()
+    return KLinePrefetcher(FutuSdk(quote_ctx_factory=lambda: quote_ctx, pool_size=1), ctx.backend(),
+                           column_store_factory=ctx.kline_column_store, chunk_days=3)
+
+
+def stored_time_keys():
+    store = get_context().kline_column_store(TEST_STOCK_CODE)
+    return store.query(store.begin_time(), store.end_time())["time_key"].tolist()
+
+
+def test_prefetch_fills_column_store_contiguously(tmp_path, fake_quote_ctx):
+    new_memory_context(str(tmp_path / "kline_store"))
+    new_kline_lib(fake_quote_ctx).query("2024-10-07", "2024-10-08")
+    # 预取使用的覆盖索引中已经有中间的交易日（只在数据库中），预取只拉取前后的块
+    new_kline_lib(fake_quote_ctx, column_store=None,
+                  coverage_repo=get_context().backend().stock_k_line_coverage_repo(TEST_STOCK_CODE)
+                  ).query("2024-10-09", "2024-10-11")
+    report = new_prefetcher(fake_quote_ctx).prefetch([TEST_STOCK_CODE], "2024-10-07", "2024-10-18")
+    assert report["failed"] == []
+    assert stored_time_keys() == KLINES["time_key"].tolist()
+
+
+def test_prefetch_not_adjacent_keeps_store_contiguous(tmp_path, fake_quote_ctx):
+    new_memory_context(str(tmp_path / "kline_store"))
+    new_kline_lib(fake_quote_ctx).query("2024-10-07", "2024-10-08")
+    new_prefetcher(fake_quote_ctx).prefetch([TEST_STOCK_CODE], "2024-10-14", "2024-10-18")
+    assert stored_time_keys() == KLINES[DAYS <= "2024-10-08"]["time_key"].tolist()
+    df = new_kline_lib(fake_quote_ctx).query("2024-10-07", "2024-10-18")
+    assert df["time_key"].tolist() == KLINES["time_key"].tolist()
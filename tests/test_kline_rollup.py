@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_kline_rollup
+@author: jkguo
+@create: 2024/10/26
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from fakes.fake_quote_context import generate_klines
+from jtrade.core.kline_buffer import KLineRingBuffer
+from jtrade.core.kline_rollup import KLineRollup
+from jtrade.utils import date_utils
+from conftest import TEST_STOCK_CODE
+
+# 两个交易日，共 2 * 331 根1分钟K线
+KLINES = generate_klines(TEST_STOCK_CODE, "2024-10-17", "2024-10-18")
+
+
+def resample(kline_df: pd.DataFrame, time_unit: int) -> pd.DataFrame:
+    """
+    用 pandas 从头合成高周期K线，作为增量合成的对照
+    """
+    local_times = pd.to_datetime(kline_df['time_key'])
+    if time_unit == KLineRollup.DAY_MINUTES:
+        labels = local_times.dt.floor('D')
+    else:
+        labels = local_times.dt.ceil(f'{time_unit}min')
+    grouped = kline_df.groupby(labels.dt.strftime('%Y-%m-%d %H:%M:%S').to_numpy(), sort=True)
+    df = grouped.agg(open=('open', 'first'), close=('close', 'last'), high=('high', 'max'), low=('low', 'min'),
+                     volume=('volume', 'sum'), turnover=('turnover', 'sum'))
+    df['time'] = date_utils.time_strs2epoch_mins(df.index.to_numpy())
+    return df.reset_index(drop=True)[KLineRollup.COLUMNS]
+
+
+def assert_same_bars(rollup: KLineRollup, expected: pd.DataFrame):
+    df = rollup.query(0, 2 ** 40)
+    assert df['time'].tolist() == expected['time'].tolist()
+    for c in KLineRollup.COLUMNS[1:]:
+        assert np.allclose(df[c].to_numpy(), expected[c].to_numpy()), c
+
+
+@pytest.mark.parametrize("time_unit", [5, 60, KLineRollup.DAY_MINUTES])
+def test_incremental_matches_resample(time_unit):
+    source = KLineRingBuffer(column_names=KLineRollup.COLUMNS)
+    rollup = KLineRollup(time_unit)
+    # 分批追加，批次边界落在周期中间，其中一批跨越两个交易日（第一天收盘到第二天开盘）
+    bounds = [0, 1, 7, 8, 150, 326, 336, 337, 500, len(KLINES)]
+    for begin, end in zip(bounds[:-1], bounds[1:]):
+        source.append(KLINES.iloc[begin: end])
+        rollup.update(source)
+        assert_same_bars(rollup, resample(KLINES.iloc[:end], time_unit))
+    # 没有新数据时不变
+    rollup.update(source)
+    assert_same_bars(rollup, resample(KLINES, time_unit))
+
+
+def test_day_bar_completed_by_next_day():
+    source = KLineRingBuffer(column_names=KLineRollup.COLUMNS)
+    rollup = KLineRollup(KLineRollup.DAY_MINUTES)
+    source.append(KLINES.iloc[:331])
+    rollup.update(source)
+    # 第一天收盘后日K仍未完成（周期到当天 24:00 结束）
+    assert len(rollup.completed) == 0
+    assert rollup.open_bar['time'] == date_utils.time_str2epoch_min("2024-10-17 00:00:00")
+    source.append(KLINES.iloc[331: 333])
+    rollup.update(source)
+    assert rollup.completed.column('time', 0, 2 ** 40).tolist() == \
+        [date_utils.time_str2epoch_min("2024-10-17 00:00:00")]
+    assert rollup.open_bar['time'] == date_utils.time_str2epoch_min("2024-10-18 00:00:00")
+    assert rollup.open_bar['open'] == KLINES['open'].iloc[331]
+    assert rollup.open_bar['close'] == KLINES['close'].iloc[332]
+
+
+def test_source_reset_rebuilds():
+    source = KLineRingBuffer(column_names=KLineRollup.COLUMNS)
+    rollup = KLineRollup(30)
+    source.append(KLINES.iloc[331:])
+    rollup.update(source)
+    # 源数据被清空后重新加载更早的数据
+    source.clear()
+    source.append(KLINES.iloc[:331])
+    rollup.update(source)
+    assert_same_bars(rollup, resample(KLINES.iloc[:331], 30))
+
+
+def test_bucket_times():
+    rollup = KLineRollup(5)
+    times = date_utils.time_strs2epoch_mins(np.array(["2024-10-17 09:30:00", "2024-10-17 09:31:00",
+                                                      "2024-10-17 09:35:00", "2024-10-17 09:36:00"]))
+    labels = date_utils.epoch_mins2time_strs(rollup.bucket_times(times))
+    assert labels.tolist() == ["2024-10-17 09:30:00", "2024-10-17 09:35:00", "2024-10-17 09:35:00",
+                               "2024-10-17 09:40:00"]
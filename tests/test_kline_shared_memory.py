@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_kline_shared_memory
+@author: jkguo
+@create: 2024/10/26
+"""
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+from jtrade.core.kline_shared_memory import SharedKLineSegment, KLineSharedCatalog
+from conftest import TEST_STOCK_CODE
+
+
+def build_columns(begin_time: int, count: int) -> dict:
+    times = np.arange(begin_time, begin_time + count, dtype='int64')
+    columns = {'time': times}
+    for i, c in enumerate(SharedKLineSegment.COLUMNS[1:]):
+        columns[c] = times.astype('float64') / 10 + i
+    return columns
+
+
+def assert_shm_unlinked(shm_name: str):
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=shm_name)
+
+
+def test_segment_create_and_attach():
+    columns = build_columns(1000, 50)
+    segment = SharedKLineSegment.create(TEST_STOCK_CODE, 1, 990, columns)
+    try:
+        attached = SharedKLineSegment.attach(segment.info)
+        assert attached.stock_code == TEST_STOCK_CODE
+        assert attached.time_unit == 1
+        assert attached.begin_time == 990
+        assert len(attached) == 50
+        for c in SharedKLineSegment.COLUMNS:
+            assert np.array_equal(attached.columns[c], columns[c])
+            assert attached.columns[c].dtype == np.dtype(SharedKLineSegment.COLUMN_DTYPES.get(c, 'float64'))
+            assert not attached.columns[c].flags.writeable
+        # 附加方关闭不影响发布方
+        attached.close()
+        assert np.array_equal(segment.columns['close'], columns['close'])
+    finally:
+        segment.close()
+    assert_shm_unlinked(segment.info["shm_name"])
+
+
+def test_catalog_publish_and_attach(tmp_path):
+    catalog = KLineSharedCatalog()
+    try:
+        old_segment = catalog.publish(TEST_STOCK_CODE, 1, 1000, build_columns(1000, 10))
+        # 重新发布替换旧段，旧段被回收
+        segment = catalog.publish(TEST_STOCK_CODE, 1, 1000, build_columns(1000, 20))
+        assert_shm_unlinked(old_segment.info["shm_name"])
+        path = str(tmp_path / "catalog.json")
+        catalog.save(path)
+        loaded = KLineSharedCatalog.load(path)
+        assert list(loaded.keys()) == [KLineSharedCatalog.key(TEST_STOCK_CODE, 1)]
+        attached = KLineSharedCatalog.attach(loaded, TEST_STOCK_CODE)
+        assert np.array_equal(attached.columns['time'], segment.columns['time'])
+        assert np.array_equal(attached.columns['turnover'], segment.columns['turnover'])
+        attached.close()
+        with pytest.raises(Exception):
+            KLineSharedCatalog.attach(loaded, TEST_STOCK_CODE, 5)
+    finally:
+        catalog.close()
+    assert catalog.segments == {}
+    assert_shm_unlinked(segment.info["shm_name"])
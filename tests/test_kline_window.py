@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_kline_window
+@author: jkguo
+@create: 2024/10/26
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from fakes.fake_quote_context import FakeQuoteContext
+from jtrade.core.kline_window import KLineWindow
+from test_stock_kline_lib import KLINES, new_memory_context, new_kline_lib
+from conftest import TEST_STOCK_CODE
+
+
+@pytest.fixture
+def fake_quote_ctx(tmp_path):
+    new_memory_context(str(tmp_path / "kline_store"))
+    return FakeQuoteContext(klines={TEST_STOCK_CODE: KLINES})
+
+
+def assert_window_matches(window: KLineWindow, fake_quote_ctx: FakeQuoteContext, begin_time: str, end_time: str):
+    window.update(begin_time, end_time)
+    expected = new_kline_lib(fake_quote_ctx).query(begin_time, end_time)
+    assert window.x.tolist() == expected["time_key"].tolist()
+    assert np.array_equal(window.y, expected["close"].to_numpy())
+    pd.testing.assert_frame_equal(window.kline_df, expected, check_dtype=False)
+
+
+def test_window_slides_forward(fake_quote_ctx):
+    window = KLineWindow(new_kline_lib(fake_quote_ctx))
+    assert_window_matches(window, fake_quote_ctx, "2024-10-08 10:00", "2024-10-09 10:00")
+    # 每次向后移动一分钟，以及一次跨过午休
+    for minute in range(1, 4):
+        assert_window_matches(window, fake_quote_ctx, f"2024-10-08 10:0{minute}", f"2024-10-09 10:0{minute}")
+    assert_window_matches(window, fake_quote_ctx, "2024-10-08 13:30", "2024-10-09 13:30")
+    assert len(window.x) == 332
+
+
+def test_window_moves_backward(fake_quote_ctx):
+    window = KLineWindow(new_kline_lib(fake_quote_ctx))
+    assert_window_matches(window, fake_quote_ctx, "2024-10-10", "2024-10-11")
+    # 窗口开始早于已缓存的 time_key 和内存缓存，重新加载
+    assert_window_matches(window, fake_quote_ctx, "2024-10-08", "2024-10-09")
+    assert_window_matches(window, fake_quote_ctx, "2024-10-08 15:00", "2024-10-10 10:00")
+
+
+def test_window_spans_gap(fake_quote_ctx):
+    window = KLineWindow(new_kline_lib(fake_quote_ctx))
+    # 跨过周末
+    assert_window_matches(window, fake_quote_ctx, "2024-10-11 15:00", "2024-10-14 10:00")
+    assert window.x[0] == "2024-10-11 15:00:00"
+    assert window.x[-1] == "2024-10-14 10:00:00"
+    # 窗口内没有交易分钟
+    window.update("2024-10-12", "2024-10-13")
+    assert len(window.x) == 0
+    assert len(window.y) == 0
+    assert len(window.kline_df) == 0
+    assert_window_matches(window, fake_quote_ctx, "2024-10-14", "2024-10-15")
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_latency_stats
+@author: jkguo
+@create: 2024/10/26
+"""
+import pytest
+from jtrade.utils.latency_stats import LatencyHistogram, LatencyRegistry, timed, get_latency_registry
+
+
+def test_histogram_record_and_percentile():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) == 0.0
+    for cost_ns in range(1, 1001):
+        histogram.record(cost_ns * 1000)
+    assert histogram.count == 1000
+    assert histogram.max_ns == 1000 * 1000
+    assert histogram.total_ns == sum(range(1, 1001)) * 1000
+    # 分桶精度约 5%，返回所在桶的上界
+    for p in (1, 50, 90, 99):
+        exact = p * 10 * 1000
+        assert exact <= histogram.percentile(p) <= exact * 1.06
+    assert histogram.percentile(100) == 1000 * 1000
+    summary = histogram.summary()
+    assert summary["count"] == 1000
+    assert summary["mean_ms"] == pytest.approx(0.5005)
+    assert summary["max_ms"] == 1.0
+    assert 0.5 <= summary["p50_ms"] <= 0.53
+
+
+def test_histogram_extreme_values_and_reset():
+    histogram = LatencyHistogram()
+    histogram.record(0)
+    histogram.record(1)
+    # 超出最大桶的值记在最后一个桶
+    histogram.record(10 ** 15)
+    assert histogram.count == 3
+    assert histogram.percentile(50) <= 1.06
+    assert histogram.percentile(100) == 10 ** 15
+    histogram.reset()
+    assert histogram.count == 0
+    assert histogram.max_ns == 0
+    assert histogram.summary() == {"count": 0, "mean_ms": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+
+
+def test_registry_span_snapshot_and_reset():
+    registry = LatencyRegistry()
+    for _ in range(3):
+        with registry.span("engine.on_rt_data"):
+            pass
+    registry.record("trader.order", 2000)
+    snapshot = registry.snapshot("engine.")
+    assert list(snapshot.keys()) == ["engine.on_rt_data"]
+    assert snapshot["engine.on_rt_data"]["count"] == 3
+    assert "trader.order" in registry.dump()
+    registry.enabled = False
+    with registry.span("engine.on_rt_data"):
+        pass
+    registry.record("trader.order", 2000)
+    assert registry.histogram("engine.on_rt_data").count == 3
+    assert registry.histogram("trader.order").count == 1
+    registry.reset()
+    assert all(s["count"] == 0 for s in registry.snapshot().values())
+
+
+def test_timed_records_in_global_registry():
+    registry = get_latency_registry()
+    name = "test_latency_stats.timed"
+    registry.histogram(name).reset()
+
+    @timed(name)
+    def work(x):
+        if x < 0:
+            raise ValueError(x)
+        return x * 2
+
+    assert work(2) == 4
+    with pytest.raises(ValueError):
+        work(-1)
+    # 抛出异常时同样记录耗时
+    assert registry.histogram(name).count == 2
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_mysql_backend
+@author: jkguo
+@create: 2024/10/26
+"""
+import threading
+import pytest
+import sqlalchemy
+from sqlalchemy.dialects.mysql.dml import OnDuplicateClause
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import QueuePool
+from futu import TrdMarket
+from jtrade.models import mysql_backend
+from jtrade.models.mysql_backend import MysqlBackend, StockKLineRepo
+from jtrade.models.dto import StockDto, StockStatus, StockKLineDto, DtoBase, DtoUtil
+from conftest import TEST_ENV, TEST_ACCOUNT, TEST_STOCK_CODE
+
+
+@compiles(OnDuplicateClause, "sqlite")
+def compile_on_duplicate_for_sqlite(element, compiler, **kw):
+    """
+    sqlite 中把 MySQL 的 ON DUPLICATE KEY UPDATE 按主键冲突改写为 ON CONFLICT DO UPDATE（语义相同）
+    """
+    keys = ", ".join(c.name for c in element.inserted_alias.primary_key)
+    sets = ", ".join(f"{c} = excluded.{c}" for c in element.update)
+    return f"ON CONFLICT ({keys}) DO UPDATE SET {sets}"
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    """
+    连接池和会话逻辑不依赖 MySQL 方言，用 sqlite 文件库代替
+    """
+    db_path = tmp_path / "backend.sqlite"
+    real_create_engine = sqlalchemy.create_engine
+
+    def create_sqlite_engine(url, echo=False, poolclass=QueuePool, **kwargs):
+        return real_create_engine(f"sqlite:///{db_path}", poolclass=poolclass,
+                                  connect_args={"check_same_thread": False}, **kwargs)
+
+    monkeypatch.setattr(mysql_backend, "create_engine", create_sqlite_engine)
+    backend = MysqlBackend(TEST_ENV, TrdMarket.HK, "localhost", 3306, "user", "pwd", echo_stdout=False,
+                           scope_isolation_level=None)
+    DtoBase.metadata.create_all(backend.db_engine)
+    yield backend
+    backend.close()
+
+
+def build_stock(holding_id: str, quantity: int) -> StockDto:
+    stock = StockDto()
+    stock.trade_env = TEST_ENV
+    stock.trade_market = TrdMarket.HK
+    stock.account_name = TEST_ACCOUNT
+    stock.stock_code = TEST_STOCK_CODE
+    stock.stock_holding_id = holding_id
+    stock.status = StockStatus.HOLDING
+    stock.quantity = quantity
+    return stock
+
+
+def test_session_scope_reads_committed_changes(backend):
+    repo = backend.stock_repo(TEST_ACCOUNT)
+    repo.save(build_stock("h1", 100))
+    with backend.session_scope():
+        # 持有引用，对象留在作用域 session 的 identity map 中
+        stock = repo.query_by_holding_id(TEST_STOCK_CODE, "h1")
+        assert stock.quantity == 100
+        # 其他线程（其他连接）修改并提交
+        t = threading.Thread(target=lambda: repo.save(build_stock("h1", 200)))
+        t.start()
+        t.join()
+        # 作用域中再次读取时不返回 identity map 中过期的对象
+        assert repo.query_by_holding_id(TEST_STOCK_CODE, "h1").quantity == 200
+        assert [s.quantity for s in repo.query_all(TEST_STOCK_CODE)] == [200]
+        assert stock.quantity == 200
+
+
+def test_pool_event_counters_thread_safe(backend):
+    before = backend.pool_stats()["checkout"]
+
+    def worker():
+        for _ in range(200):
+            with backend.db_engine.connect():
+                pass
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert backend.pool_stats()["checkout"] - before == 8 * 200
+
+
+def test_only_account_repos_cached(backend):
+    assert backend.stock_repo(TEST_ACCOUNT) is backend.stock_repo(TEST_ACCOUNT)
+    assert backend.trade_order_repo(TEST_ACCOUNT) is backend.trade_order_repo(TEST_ACCOUNT)
+    for code in ["HK.%05d" % i for i in range(100)]:
+        backend.stock_k_line_repo(code)
+        backend.stock_k_line_coverage_repo(code)
+    assert len(backend._repos) == 2
+
+
+def build_kline(stock_code: str, minute: int, close: float, pe_ratio=None) -> StockKLineDto:
+    kline = StockKLineDto()
+    kline.time_key = f"2024-10-21 10:{minute:02d}:00"
+    kline.stock_code = stock_code
+    kline.time_unit = 1
+    kline.open = close - 0.2
+    kline.close = close
+    kline.high = close + 0.2
+    kline.low = close - 0.4
+    kline.pe_ratio = pe_ratio
+    kline.turnover_rate = 0.01
+    kline.volume = 100.0 * minute
+    kline.turnover = 100.0 * minute * close
+    kline.change_rate = 0.1
+    kline.last_close = close - 0.2
+    return kline
+
+
+def merge_store(session_maker, stock_kline_list):
+    """
+    批量写入之前逐行 merge 的写法，作为对照
+    """
+    session = session_maker()
+    try:
+        for stock_kline in stock_kline_list:
+            session.merge(stock_kline)
+        session.commit()
+    finally:
+        session.close()
+
+
+def test_kline_bulk_store_matches_row_merge(backend):
+    bulk_repo = StockKLineRepo("HK.00001", 1, backend.DBSession, bulk_chunk_size=3)
+    merge_repo = StockKLineRepo("HK.00002", 1, backend.DBSession)
+    batches = [
+        [(minute, 300.0 + minute / 10, 15.0) for minute in range(10)],
+        # 覆盖已有的K线（包括改为空值），并追加新的K线
+        [(minute, 310.0 + minute / 10, None) for minute in range(7, 14)],
+        [(3, 299.0, 16.0)]
+    ]
+    for batch in batches:
+        assert bulk_repo.store([build_kline("HK.00001", *row) for row in batch]) == len(batch)
+        merge_store(backend.DBSession, [build_kline("HK.00002", *row) for row in batch])
+
+    def rows(repo):
+        return [dict(DtoUtil.to_dict(kline), stock_code=None) for kline in repo.query("2024-10-21", "2024-10-22")]
+
+    bulk_rows = rows(bulk_repo)
+    assert len(bulk_rows) == 14
+    assert bulk_rows == rows(merge_repo)
+    assert bulk_rows[3]["close"] == 299.0
+    assert bulk_rows[8]["pe_ratio"] is None
+    assert bulk_rows[8]["close"] == 310.8
+    with pytest.raises(Exception):
+        bulk_repo.store([build_kline("HK.00002", 0, 300.0)])
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_order_gateway
+@author: jkguo
+@create: 2024/10/26
+"""
+import pytest
+from futu import TrdSide
+from jtrade.core.order_gateway import AsyncOrderGateway
+from jtrade.core.trade_engine import TradeEngine
+from jtrade.core.trade_alg_base import TradeAlgBase, TradeDecision
+from jtrade.core.trader import KLineMockTrader
+from jtrade.models.dto import StockStatus, TradeOrderStatus
+from conftest import TEST_ACCOUNT, TEST_INIT_BALANCE, build_order, wait_until
+from test_trade_engine import build_decision
+
+
+class FailingTrader(KLineMockTrader):
+
+    def open_position(self, order):
+        raise Exception("broker unavailable")
+
+
+@pytest.fixture
+def gateway(stock_manager):
+    gateway = AsyncOrderGateway(KLineMockTrader(stock_manager), max_workers=4)
+    gateway.register_stock_manager(stock_manager)
+    yield gateway
+    gateway.stop()
+
+
+def test_submit_fill_flow(stock_manager, gateway, memory_context):
+    gateway.start()
+    engine = TradeEngine(stock_manager, None, TradeAlgBase(), gateway.trader, order_gateway=gateway)
+    engine._execute_decision(build_decision(TradeDecision.TRADE_OP_BUY, "h1"))
+    wait_until(lambda: gateway.metrics()["submitted"] == 1)
+    gateway.join()
+    stock = stock_manager.position_book.get("h1")
+    assert stock.status == StockStatus.BUYING
+    assert stock.buy_order_id != ""
+    gateway.trader.on_kline_update("2024-10-21 10:01:00", 300.0)
+    gateway.join()
+    assert stock_manager.position_book.get("h1").status == StockStatus.HOLDING
+    orders = memory_context.backend().trade_order_repo(TEST_ACCOUNT).query_all()
+    assert [o.order_id for o in orders] == [stock.buy_order_id]
+    assert gateway.metrics()["submitted"] == 1
+
+
+def test_not_started_gateway_does_not_freeze(stock_manager, gateway):
+    engine = TradeEngine(stock_manager, None, TradeAlgBase(), gateway.trader, order_gateway=gateway)
+    with pytest.raises(Exception, match="not started"):
+        engine._execute_decision(build_decision(TradeDecision.TRADE_OP_BUY, "h1"))
+    assert stock_manager.position_book.get("h1") is None
+    assert stock_manager.account.get_available_balance() == TEST_INIT_BALANCE
+
+
+def test_submit_error_releases_freeze(stock_manager, gateway, monkeypatch):
+    gateway.start()
+    engine = TradeEngine(stock_manager, None, TradeAlgBase(), gateway.trader, order_gateway=gateway)
+
+    def broken_submit(order):
+        raise RuntimeError("cannot schedule new futures after shutdown")
+    monkeypatch.setattr(gateway, "submit_open", broken_submit)
+    with pytest.raises(RuntimeError):
+        engine._execute_decision(build_decision(TradeDecision.TRADE_OP_BUY, "h1"))
+    assert stock_manager.position_book.get("h1").status == StockStatus.DELETED
+    assert stock_manager.account.get_available_balance() == TEST_INIT_BALANCE
+
+
+def test_rejected_order_refunds(stock_manager, memory_context):
+    gateway = AsyncOrderGateway(FailingTrader(stock_manager))
+    gateway.register_stock_manager(stock_manager)
+    gateway.start()
+    order = build_order(TrdSide.BUY, "h1")
+    stock_manager.on_stock_submit_buying(order)
+    future = gateway.submit_open(order)
+    with pytest.raises(Exception, match="broker unavailable"):
+        future.result()
+    gateway.stop()
+    assert stock_manager.position_book.get("h1").status == StockStatus.DELETED
+    assert memory_context.backend().trade_account_repo().get(TEST_ACCOUNT).account_balance == TEST_INIT_BALANCE
+    assert gateway.metrics()["rejected"] == 1
+
+
+def test_counters_under_concurrent_submits(stock_manager, gateway):
+    gateway.start()
+    count = 200
+    futures = []
+    for i in range(count):
+        order = build_order(TrdSide.BUY, f"h{i}", quantity=1, price=1.0)
+        stock_manager.on_stock_submit_buying(order)
+        futures.append(gateway.submit_open(order))
+    for future in futures:
+        future.result()
+    gateway.join()
+    metrics = gateway.metrics()
+    assert metrics["submitted"] == count
+    assert metrics["events"] == count
+    assert metrics["errors"] == 0
+
+
+def test_queued_pushes_keep_their_own_state(stock_manager, gateway):
+    order = build_order(TrdSide.BUY, "h1", quantity=200)
+    stock_manager.on_stock_submit_buying(order)
+    order.order_id = "B_h1"
+    stock_manager.on_stock_order_submitted(order)
+    # 事件线程处理之前连续收到多次推送，交易类修改的是同一个订单对象
+    order.order_status = TradeOrderStatus.PART_TRADED
+    order.ext_detail["dealt_qty"] = 100
+    order.ext_detail["dealt_avg_price"] = 300.0
+    gateway.on_order_status(order)
+    order.order_status = TradeOrderStatus.ALL_TRADED
+    order.ext_detail["dealt_qty"] = 200
+    gateway.on_order_status(order)
+    gateway.start()
+    gateway.join()
+    assert gateway.metrics()["events"] == 2
+    assert gateway.metrics()["errors"] == 0
+    stock = stock_manager.position_book.get("h1")
+    assert stock.status == StockStatus.HOLDING
+    assert stock.quantity == 200
+    assert stock_manager.account.get_available_balance() == round(
+        TEST_INIT_BALANCE - stock.buy_total_amount - stock.buy_all_ext_fee, 4)
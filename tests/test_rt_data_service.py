@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_rt_data_service
+@author: jkguo
+@create: 2024/10/26
+"""
+import threading
+import time
+import pandas as pd
+from jtrade.core.rt_data_service import RtDataQueue, RtDataService, RtDataReplayer
+
+
+def build_rt_data(stock_code: str, cur_time: str, cur_price: float = 300.0) -> dict:
+    return {"code": stock_code, "time": cur_time, "cur_price": cur_price}
+
+
+class RecordingEngine(object):
+    """
+    记录收到的实时数据，可选每条数据处理耗时
+    """
+
+    def __init__(self, stock_code: str, cost: float = 0):
+        self.stock_code = stock_code
+        self.cost = cost
+        self.received = []
+
+    def on_rt_data(self, cur_data: dict):
+        if self.cost > 0:
+            time.sleep(self.cost)
+        self.received.append(cur_data)
+
+
+def test_coalesce_keeps_latest_per_stock():
+    rt_queue = RtDataQueue()
+    assert rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:00:00", 300.0))
+    assert rt_queue.put(build_rt_data("HK.09988", "2024-10-21 10:00:00", 80.0))
+    assert rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:01:00", 301.0))
+    assert rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:02:00", 302.0))
+    assert len(rt_queue) == 2
+    # 按股票第一次入队的顺序取出，取到的是该股票最新一条
+    assert rt_queue.get(timeout=0) == build_rt_data("HK.00700", "2024-10-21 10:02:00", 302.0)
+    assert rt_queue.get(timeout=0) == build_rt_data("HK.09988", "2024-10-21 10:00:00", 80.0)
+    assert rt_queue.get(timeout=0.01) is None
+    metrics = rt_queue.metrics()
+    assert metrics["put"] == 4
+    assert metrics["coalesced"] == 2
+    assert metrics["depth"] == 0
+    assert metrics["busy"] == 2
+    assert metrics["wait"]["count"] == 2
+    rt_queue.task_done("HK.00700")
+    rt_queue.task_done("HK.09988")
+    assert rt_queue.join(timeout=0)
+    assert rt_queue.metrics()["busy"] == 0
+
+
+def test_stale_data_dropped():
+    rt_queue = RtDataQueue()
+    assert rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:02:00"))
+    assert not rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:01:00"))
+    assert rt_queue.get(timeout=0)["time"] == "2024-10-21 10:02:00"
+    rt_queue.task_done("HK.00700")
+    # 已处理过更新的数据，乱序到达的旧数据同样丢弃
+    assert not rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:00:00"))
+    assert rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:02:00"))
+    metrics = rt_queue.metrics()
+    assert metrics["stale"] == 2
+    assert metrics["depth"] == 1
+
+
+def test_busy_stock_not_taken_until_task_done():
+    rt_queue = RtDataQueue()
+    rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:00:00"))
+    assert rt_queue.get(timeout=0)["time"] == "2024-10-21 10:00:00"
+    rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:01:00"))
+    rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:02:00"))
+    rt_queue.put(build_rt_data("HK.09988", "2024-10-21 10:00:00"))
+    # 处理中的股票的新数据只更新待处理数据，其他股票可以取出
+    assert rt_queue.get(timeout=0)["code"] == "HK.09988"
+    assert rt_queue.get(timeout=0.01) is None
+    assert not rt_queue.join(timeout=0)
+    rt_queue.task_done("HK.00700")
+    assert rt_queue.get(timeout=0) == build_rt_data("HK.00700", "2024-10-21 10:02:00")
+    rt_queue.task_done("HK.00700")
+    rt_queue.task_done("HK.09988")
+    assert rt_queue.join(timeout=0)
+    assert rt_queue.metrics()["coalesced"] == 1
+
+
+def test_get_wakes_up_on_put():
+    rt_queue = RtDataQueue()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(rt_queue.get(timeout=5)))
+    thread.start()
+    time.sleep(0.05)
+    rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:00:00"))
+    thread.join(timeout=5)
+    assert result == [build_rt_data("HK.00700", "2024-10-21 10:00:00")]
+
+
+def test_full_queue_drops_new_stocks():
+    rt_queue = RtDataQueue(max_size=2)
+    assert rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:00:00"))
+    assert rt_queue.put(build_rt_data("HK.09988", "2024-10-21 10:00:00"))
+    assert not rt_queue.put(build_rt_data("HK.03690", "2024-10-21 10:00:00"))
+    # 已在队列中的股票仍然可以合并
+    assert rt_queue.put(build_rt_data("HK.00700", "2024-10-21 10:01:00"))
+    metrics = rt_queue.metrics()
+    assert metrics["depth"] == 2
+    assert metrics["dropped"] == 1
+    assert metrics["coalesced"] == 1
+    assert metrics["oldest_wait_ms"] >= 0
+    rt_queue.get(timeout=0)
+    rt_queue.task_done("HK.00700")
+    assert rt_queue.put(build_rt_data("HK.03690", "2024-10-21 10:00:00"))
+
+
+def build_kline_df(stock_codes, count: int) -> pd.DataFrame:
+    rows = []
+    for i in range(count):
+        for stock_code in stock_codes:
+            rows.append({"code": stock_code, "time_key": f"2024-10-21 10:{i:02d}:00", "close": 300.0 + i})
+    return pd.DataFrame(rows)
+
+
+def test_replayer_each_row():
+    service = RtDataService()
+    engines = [RecordingEngine("HK.00700"), RecordingEngine("HK.09988")]
+    for engine in engines:
+        service.register_engine(engine)
+    service.start()
+    try:
+        kline_df = build_kline_df(["HK.00700", "HK.09988", "HK.03690"], 5)
+        RtDataReplayer(service, kline_df, wait_each=True).run()
+    finally:
+        service.stop()
+    for engine in engines:
+        assert [cur_data["time"] for cur_data in engine.received] == [f"2024-10-21 10:{i:02d}:00" for i in range(5)]
+        assert [cur_data["cur_price"] for cur_data in engine.received] == [300.0 + i for i in range(5)]
+    # 没有注册引擎的股票不入队
+    assert service.metrics()["put"] == 10
+    assert service.metrics()["coalesced"] == 0
+
+
+def test_replayer_coalesces_slow_engine():
+    service = RtDataService(dispatch_threads=2)
+    engine = RecordingEngine("HK.00700", cost=0.05)
+    service.register_engine(engine)
+    service.start()
+    try:
+        RtDataReplayer(service, build_kline_df(["HK.00700"], 20)).run()
+    finally:
+        service.stop()
+    # 引擎处理慢时积压的数据被合并，处理顺序不乱，最后一条一定被处理
+    times = [cur_data["time"] for cur_data in engine.received]
+    assert times == sorted(times)
+    assert times[-1] == "2024-10-21 10:19:00"
+    metrics = service.metrics()
+    assert len(times) < 20
+    assert metrics["coalesced"] == 20 - len(times)
+    assert metrics["depth"] == 0 and metrics["busy"] == 0
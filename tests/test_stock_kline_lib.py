@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_stock_kline_lib
+@author: jkguo
+@create: 2024/10/26
+"""
+import numpy as np
+import pytest
+from futu import TrdMarket
+from jtrade.core.trade_context import init_context, get_context
+from jtrade.core.futu_sdk import FutuSdk
+from fakes.fake_quote_context import FakeQuoteContext, generate_klines
+from jtrade.core.kline_block_cache import KLineBlockCache
+from jtrade.core.kline_shared_memory import KLineSharedCatalog
+from jtrade.core.stock_k_linke_lib import StockKLineLib
+from jtrade.models.dto import StockKLineDto, DtoUtil
+from jtrade.models.kline_column_store import StockKLineColumnStoreCoverageRepo
+from conftest import TEST_ENV, TEST_ACCOUNT, TEST_STOCK_CODE
+
+KLINES = generate_klines(TEST_STOCK_CODE, "2024-10-07", "2024-10-18")
+
+
+@pytest.fixture
+def fake_quote_ctx():
+    return FakeQuoteContext(klines={TEST_STOCK_CODE: KLINES})
+
+
+def new_memory_context(store_dir: str):
+    init_context(TEST_ENV, TrdMarket.HK, TEST_ACCOUNT, db_config={}, kline_store_dir=store_dir, backend_type="memory")
+    return get_context()
+
+
+def new_kline_lib(quote_ctx: FakeQuoteContext, **kwargs) -> StockKLineLib:
+    ctx = get_context()
+    return StockKLineLib(
+        TEST_STOCK_CODE, ctx.backend().stock_k_line_repo(TEST_STOCK_CODE),
+        FutuSdk(quote_ctx_factory=lambda: quote_ctx, pool_size=1),
+        column_store=kwargs.pop("column_store", ctx.kline_column_store(TEST_STOCK_CODE)),
+        coverage_repo=kwargs.pop("coverage_repo", ctx.kline_coverage_repo(TEST_STOCK_CODE)),
+        block_cache=kwargs.pop("block_cache", KLineBlockCache()),
+        **kwargs
+    )
+
+
+def test_memory_backend_reuses_column_store_across_runs(tmp_path, fake_quote_ctx):
+    store_dir = str(tmp_path / "kline_store")
+    new_memory_context(store_dir)
+    assert isinstance(get_context().kline_coverage_repo(TEST_STOCK_CODE), StockKLineColumnStoreCoverageRepo)
+    df = new_kline_lib(fake_quote_ctx).query("2024-10-08", "2024-10-16")
+    assert len(df) == 7 * 331
+    request_count = fake_quote_ctx.request_count
+    assert request_count > 0
+    # 新的一次运行：内存后端为空，覆盖索引和K线从本地列式存储恢复，不再请求富途
+    new_memory_context(store_dir)
+    df2 = new_kline_lib(fake_quote_ctx).query("2024-10-08", "2024-10-16")
+    assert fake_quote_ctx.request_count == request_count
+    assert df2["time_key"].tolist() == df["time_key"].tolist()
+    assert np.array_equal(df2["close"].to_numpy(), df["close"].to_numpy())
+    # 只请求新增的交易日
+    df3 = new_kline_lib(fake_quote_ctx).query("2024-10-08", "2024-10-17")
+    assert len(df3) == 8 * 331
+    assert fake_quote_ctx.requested_codes == {TEST_STOCK_CODE}
+    assert fake_quote_ctx.request_count == request_count + 1
+
+
+def test_store_begin_after_query_begin_keeps_store_rows(tmp_path, fake_quote_ctx):
+    store_dir = str(tmp_path / "kline_store")
+    new_memory_context(store_dir)
+    new_kline_lib(fake_quote_ctx).query("2024-10-10", "2024-10-11")
+    new_memory_context(store_dir)
+    lib = new_kline_lib(fake_quote_ctx)
+    # 查询开始早于本地存储的开始时间：之前的部分从富途补齐，本地存储中的数据不丢失
+    df = lib.query("2024-10-09", "2024-10-11")
+    assert len(df) == 3 * 331
+    assert df["time_key"].iloc[0] == "2024-10-09 09:30:00"
+    assert df["time_key"].iloc[-1] == "2024-10-11 16:00:00"
+
+
+def test_libs_share_cached_day_blocks(tmp_path, fake_quote_ctx):
+    new_memory_context(str(tmp_path / "kline_store"))
+    block_cache = KLineBlockCache()
+    lib1 = new_kline_lib(fake_quote_ctx, block_cache=block_cache)
+    df1 = lib1.query("2024-10-08", "2024-10-10")
+    lib2 = new_kline_lib(fake_quote_ctx, block_cache=block_cache)
+    df2 = lib2.query("2024-10-08", "2024-10-10")
+    assert block_cache.stats()["hits"] >= 3
+    assert df2["time_key"].tolist() == df1["time_key"].tolist()
+    assert df2["code"].tolist() == [TEST_STOCK_CODE] * len(df2)
+    # 两个 lib 的内存缓存引用同一份日块
+    close1 = lib1.buffer.column("close", *lib1.ensure_range("2024-10-09", "2024-10-09"))
+    close2 = lib2.buffer.column("close", *lib2.ensure_range("2024-10-09", "2024-10-09"))
+    assert len(close1) == 331
+    assert np.shares_memory(close1, close2)
+
+
+def test_compact_lib_uses_compact_day_blocks(tmp_path, fake_quote_ctx):
+    new_memory_context(str(tmp_path / "kline_store"))
+    block_cache = KLineBlockCache()
+    full_lib = new_kline_lib(fake_quote_ctx, block_cache=block_cache)
+    full_df = full_lib.query("2024-10-08", "2024-10-09")
+    full_bytes = block_cache.stats()["bytes"]
+    lib = new_kline_lib(fake_quote_ctx, block_cache=block_cache, compact=True, columns=["close", "volume"])
+    df = lib.query("2024-10-08", "2024-10-09")
+    assert df["close"].dtype == np.float32
+    assert df["volume"].dtype == np.int64
+    assert np.allclose(df["close"].to_numpy(), full_df["close"].to_numpy())
+    block = block_cache.get((TEST_STOCK_CODE, 1, lib._day_of(int(df["time"].iloc[0])), True))
+    assert block["close"].dtype == np.float32
+    assert block_cache.stats()["bytes"] - full_bytes < full_bytes
+    assert np.shares_memory(lib.buffer.column("close", *lib.ensure_range("2024-10-08", "2024-10-08")), block["close"])
+    # 数据更新后两种表示的日块都失效
+    assert len(block_cache) == 4
+    lib.store_kline(full_df.iloc[:10], to_db=False)
+    assert len(block_cache) == 2
+    assert block_cache.get((TEST_STOCK_CODE, 1, lib._day_of(int(df["time"].iloc[0])), False)) is None
+
+
+def test_gap_sync_does_not_leave_holes_in_column_store(tmp_path, fake_quote_ctx):
+    new_memory_context(str(tmp_path / "kline_store"))
+    new_kline_lib(fake_quote_ctx).query("2024-10-07", "2024-10-08")
+    # 没有本地存储的 lib 通过同一个覆盖索引同步中间的交易日，只写入数据库
+    new_kline_lib(fake_quote_ctx, column_store=None).query("2024-10-09", "2024-10-11")
+    lib = new_kline_lib(fake_quote_ctx)
+    df = lib.query("2024-10-07", "2024-10-18")
+    assert len(df) == 10 * 331
+    assert df["time_key"].tolist() == KLINES["time_key"].tolist()
+    # 本地存储只保存连续的K线，之后从本地存储读取也不丢失交易日
+    store = lib.column_store
+    assert store.query(store.begin_time(), store.end_time())["time_key"].tolist() == KLINES["time_key"].tolist()
+
+
+def test_store_reads_do_not_leave_holes(tmp_path, fake_quote_ctx):
+    new_memory_context(str(tmp_path / "kline_store"))
+    new_kline_lib(fake_quote_ctx).query("2024-10-10", "2024-10-11")
+    # 查询范围在本地存储之后、之前，且与本地存储不相接
+    new_kline_lib(fake_quote_ctx).query("2024-10-16", "2024-10-17")
+    new_kline_lib(fake_quote_ctx).query("2024-10-07", "2024-10-08")
+    lib = new_kline_lib(fake_quote_ctx)
+    store = lib.column_store
+    stored = store.query(store.begin_time(), store.end_time())["time_key"]
+    assert stored.tolist() == KLINES[KLINES["time_key"].str.slice(0, 10).between("2024-10-10", "2024-10-11")][
+        "time_key"].tolist()
+    df = lib.query("2024-10-07", "2024-10-18")
+    assert df["time_key"].tolist() == KLINES["time_key"].tolist()
+
+
+def test_publish_shared_and_attach(tmp_path, fake_quote_ctx):
+    new_memory_context(str(tmp_path / "kline_store"))
+    lib = new_kline_lib(fake_quote_ctx)
+    df = lib.query("2024-10-08", "2024-10-10")
+    catalog = KLineSharedCatalog()
+    try:
+        segment = lib.publish_shared(catalog, "2024-10-08", "2024-10-10")
+        assert len(segment) == 3 * 331
+        attached = KLineSharedCatalog.attach(catalog.catalog(), TEST_STOCK_CODE)
+        request_count = fake_quote_ctx.request_count
+        shared_lib = new_kline_lib(fake_quote_ctx, shared_segment=attached)
+        shared_df = shared_lib.query("2024-10-09", "2024-10-10")
+        # 直接使用共享内存中的K线，不再请求富途
+        assert fake_quote_ctx.request_count == request_count
+        expected = df[df["time_key"] >= "2024-10-09"]
+        assert shared_df["time_key"].tolist() == expected["time_key"].tolist()
+        for c in ["time", "open", "close", "high", "low", "volume", "turnover"]:
+            assert np.array_equal(shared_df[c].to_numpy(), expected[c].to_numpy())
+        assert np.shares_memory(shared_lib.buffer.column("close", *shared_lib.ensure_range("2024-10-09", "2024-10-09")),
+                                attached.columns["close"])
+        # 附加方释放视图后关闭
+        del shared_lib, shared_df
+        attached.close()
+    finally:
+        catalog.close()
+    with pytest.raises(FileNotFoundError):
+        KLineSharedCatalog.attach({KLineSharedCatalog.key(TEST_STOCK_CODE, 1): segment.info}, TEST_STOCK_CODE)
+
+
+def row_by_row_dtos(df, time_unit: int):
+    """
+    向量化之前逐行转换的写法，作为对照
+    """
+    stock_dto_list = []
+    for index, row in df.iterrows():
+        row_dict = row.to_dict()
+        row_dict["stock_code"] = row_dict["code"]
+        row_dict["time_unit"] = time_unit
+        stock_dto_list.append(DtoUtil.from_dict(StockKLineDto(), row_dict))
+    return stock_dto_list
+
+
+def test_store_kline_matches_row_by_row_conversion(tmp_path, fake_quote_ctx):
+    new_memory_context(str(tmp_path / "kline_store"))
+    lib = new_kline_lib(fake_quote_ctx, column_store=None)
+    begin_time, end_time = lib.ensure_range("2024-10-08", "2024-10-09")
+    df = lib.fetch_kline_from_futu(begin_time, end_time)
+    lib.store_kline(df)
+    # 更新已有的K线
+    updated = df.iloc[100:400].copy()
+    updated["close"] = updated["close"] + 1
+    updated["pe_ratio"] = None
+    lib.store_kline(updated)
+    expected = {dto.time_key: DtoUtil.to_dict(dto) for dto in row_by_row_dtos(df, 1)}
+    expected.update({dto.time_key: DtoUtil.to_dict(dto) for dto in row_by_row_dtos(updated, 1)})
+    stored = [DtoUtil.to_dict(dto) for dto in lib.repo.query("2024-10-08 00:00:00", "2024-10-09 23:59:59")]
+    assert [row["time_key"] for row in stored] == sorted(expected.keys())
+    for row in stored:
+        assert row == expected[row["time_key"]]
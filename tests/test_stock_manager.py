@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_stock_manager
+@author: jkguo
+@create: 2024/10/26
+"""
+import pytest
+from futu import TrdSide
+from jtrade.core.stock_manager import StockManager
+from jtrade.core.position_book import StockPositionBook
+from jtrade.models.dto import StockStatus, TradeOrderStatus
+from conftest import TEST_ACCOUNT, TEST_STOCK_CODE, TEST_INIT_BALANCE, build_order, buy_and_fill
+
+
+def stored_stock(ctx, holding_id):
+    return ctx.backend().stock_repo(TEST_ACCOUNT).query_by_holding_id(TEST_STOCK_CODE, holding_id)
+
+
+def stored_balance(ctx):
+    return ctx.backend().trade_account_repo().get(TEST_ACCOUNT).account_balance
+
+
+def test_rollback_restores_account_and_positions(stock_manager, memory_context):
+    buy_and_fill(stock_manager, "h1")
+    balance = stock_manager.account.get_available_balance()
+    with pytest.raises(Exception, match="broken"):
+        with stock_manager.unit_of_work():
+            stock_manager.on_stock_submit_buying(build_order(TrdSide.BUY, "h2"))
+            raise Exception("broken")
+    assert stock_manager.position_book.get("h2") is None
+    assert stored_stock(memory_context, "h2") is None
+    assert stock_manager.account.get_available_balance() == balance
+    assert stored_balance(memory_context) == balance
+    assert stock_manager.position_book.get("h1").status == StockStatus.HOLDING
+
+
+def test_buy_cancel_refunds(stock_manager, memory_context):
+    order = build_order(TrdSide.BUY, "h1")
+    stock_manager.on_stock_submit_buying(order)
+    assert stored_balance(memory_context) == TEST_INIT_BALANCE - order.total_amount - order.ext_fee
+    order.order_status = TradeOrderStatus.CANCELLED
+    stock_manager.on_stock_buy_status_change(order)
+    assert stored_stock(memory_context, "h1").status == StockStatus.DELETED
+    assert stored_balance(memory_context) == TEST_INIT_BALANCE
+
+
+def test_write_behind_flushes_in_unit_of_work(account, memory_context, monkeypatch):
+    stock_manager = StockManager(account, TEST_STOCK_CODE, persist_mode=StockPositionBook.WRITE_BEHIND)
+    flush_count = [0]
+    flush = stock_manager.position_book.flush
+
+    def counting_flush():
+        flush_count[0] += 1
+        flush()
+    monkeypatch.setattr(stock_manager.position_book, "flush", counting_flush)
+    with stock_manager.unit_of_work():
+        buy_and_fill(stock_manager, "h1")
+        buy_and_fill(stock_manager, "h2")
+    # 嵌套的工作单元只在最外层写回一次
+    assert flush_count[0] == 1
+    assert stored_stock(memory_context, "h1").status == StockStatus.HOLDING
+    assert stored_stock(memory_context, "h2").status == StockStatus.HOLDING
+
+
+def test_write_behind_rollback_keeps_committed_changes(account, memory_context):
+    stock_manager = StockManager(account, TEST_STOCK_CODE, persist_mode=StockPositionBook.WRITE_BEHIND)
+    buy_and_fill(stock_manager, "h1")
+    with pytest.raises(Exception, match="broken"):
+        with stock_manager.unit_of_work():
+            buy_and_fill(stock_manager, "h2")
+            raise Exception("broken")
+    # 回滚后从数据库恢复，之前已提交的 h1 不丢失
+    assert stock_manager.position_book.get("h1").status == StockStatus.HOLDING
+    assert stock_manager.position_book.get("h2") is None
+    assert stored_stock(memory_context, "h2") is None
+
+
+def test_query_returns_snapshots(stock_manager):
+    buy_and_fill(stock_manager, "h1")
+    stocks = stock_manager.load_all_valid_stocks()
+    stock = stocks["h1"]
+    assert stock is not stock_manager.position_book.get("h1")
+    # 调用方修改快照不影响持仓簿
+    stock.quantity = 1
+    assert stock_manager.position_book.get("h1").quantity == 100
+    # 之后的卖出也不修改已返回的快照
+    stock_manager.on_stock_submit_selling(build_order(TrdSide.SELL, "h1", 100, 310.0))
+    assert stock_manager.position_book.get("h1").status == StockStatus.SELLING
+    assert stock.status == StockStatus.HOLDING
+    assert stock_manager.load_all_valid_stocks()["h1"].status == StockStatus.SELLING
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: test_trade_engine
+@author: jkguo
+@create: 2024/10/26
+"""
+import threading
+import pytest
+from jtrade.core.trade_engine import TradeEngine
+from jtrade.core.trade_alg_base import TradeAlgBase, TradeDecision
+from jtrade.core.trader import KLineMockTrader
+from jtrade.models.dto import StockStatus, TradeOrderStatus
+from conftest import TEST_STOCK_CODE, TEST_INIT_BALANCE, TEST_ACCOUNT
+
+
+def build_decision(trade_op: str, holding_id: str, quantity: int = 100, price: float = 300.0) -> TradeDecision:
+    decision = TradeDecision()
+    decision.trade_op = trade_op
+    decision.stock_code = TEST_STOCK_CODE
+    decision.stock_holding_id = holding_id
+    decision.quantity = quantity
+    decision.price = price
+    decision.trader_name = "test"
+    return decision
+
+
+class LockCheckTrader(KLineMockTrader):
+    """
+    下单时记录账户锁是否被其他线程可获取（即下单不在事务 / 账户锁内）
+    """
+
+    def __init__(self, stock_manager, fail: bool = False):
+        super().__init__(stock_manager)
+        self.fail = fail
+        self.lock_free_on_place = []
+
+    def _check_lock(self):
+        result = []
+        t = threading.Thread(target=lambda: result.append(self._try_lock()))
+        t.start()
+        t.join()
+        self.lock_free_on_place.append(result[0])
+
+    def _try_lock(self):
+        acquired = self.stock_manager.account.lock.acquire(blocking=False)
+        if acquired:
+            self.stock_manager.account.lock.release()
+        return acquired
+
+    def open_position(self, order):
+        self._check_lock()
+        if self.fail:
+            raise Exception("broker unavailable")
+        return super().open_position(order)
+
+    def close_position(self, order):
+        self._check_lock()
+        if self.fail:
+            raise Exception("broker unavailable")
+        return super().close_position(order)
+
+
+def test_place_order_outside_transaction(stock_manager, memory_context):
+    trader = LockCheckTrader(stock_manager)
+    engine = TradeEngine(stock_manager, None, TradeAlgBase(), trader)
+    engine._execute_decision(build_decision(TradeDecision.TRADE_OP_BUY, "h1"))
+    assert trader.lock_free_on_place == [True]
+    stock = stock_manager.position_book.get("h1")
+    assert stock.status == StockStatus.BUYING
+    assert stock.buy_order_id != ""
+    orders = memory_context.backend().trade_order_repo(TEST_ACCOUNT).query_all()
+    assert [o.order_id for o in orders] == [stock.buy_order_id]
+    # 买单成交后卖出
+    trader.on_kline_update("2024-10-21 10:01:00", 300.0)
+    assert stock_manager.position_book.get("h1").status == StockStatus.HOLDING
+    engine._execute_decision(build_decision(TradeDecision.TRADE_OP_SELL, "h1", price=310.0))
+    assert trader.lock_free_on_place == [True, True]
+    stock = stock_manager.position_book.get("h1")
+    assert stock.status == StockStatus.SELLING
+    assert stock.sell_order_id in trader.sell_orders
+
+
+def test_place_order_failure_releases_freeze(stock_manager, memory_context):
+    trader = LockCheckTrader(stock_manager, fail=True)
+    engine = TradeEngine(stock_manager, None, TradeAlgBase(), trader)
+    with pytest.raises(Exception, match="broker unavailable"):
+        engine._execute_decision(build_decision(TradeDecision.TRADE_OP_BUY, "h1"))
+    assert stock_manager.position_book.get("h1").status == StockStatus.DELETED
+    assert stock_manager.account.get_available_balance() == TEST_INIT_BALANCE
+    assert memory_context.backend().trade_account_repo().get(TEST_ACCOUNT).account_balance == TEST_INIT_BALANCE
+    assert memory_context.backend().trade_order_repo(TEST_ACCOUNT).query_all() == []
+
+
+def test_sell_failure_restores_holding(stock_manager):
+    trader = LockCheckTrader(stock_manager)
+    engine = TradeEngine(stock_manager, None, TradeAlgBase(), trader)
+    engine._execute_decision(build_decision(TradeDecision.TRADE_OP_BUY, "h1"))
+    trader.on_kline_update("2024-10-21 10:01:00", 300.0)
+    balance = stock_manager.account.get_available_balance()
+    trader.fail = True
+    with pytest.raises(Exception, match="broker unavailable"):
+        engine._execute_decision(build_decision(TradeDecision.TRADE_OP_SELL, "h1", price=310.0))
+    stock = stock_manager.position_book.get("h1")
+    assert stock.status == StockStatus.HOLDING
+    assert stock.sell_total_amount == 0
+    assert stock_manager.account.get_available_balance() == balance
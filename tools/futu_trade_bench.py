@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: futu_trade_bench
+@author: jkguo
+@create: 2024/10/25
+"""
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append("..")
+sys.path.append("../tests")
+from futu import TrdMarket, TrdEnv, TrdSide
+from jtrade.core.futu_trader import FutuTrader
+from fakes.fake_trade_context import FakeSecTradeContext
+from jtrade.models.dto import TradeAccountDto, TradeOrderDto, TradeOrderStatus
+from jtrade.utils.latency_stats import get_latency_registry
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="使用脚本化的模拟交易连接离线压测 FutuTrader 下单和成交推送")
+    parser.add_argument("--orders", type=int, default=2000, help="订单数")
+    parser.add_argument("--threads", type=int, default=8, help="并发下单线程数")
+    parser.add_argument("--ack-latency", type=float, default=0.001, help="提交确认推送延迟 s")
+    parser.add_argument("--fill-latency", type=float, default=0.01, help="全部成交推送延迟 s")
+    parser.add_argument("--partial-fills", type=int, default=2, help="分几次成交")
+    parser.add_argument("--reject-ratio", type=float, default=0.0, help="下单失败比例")
+    parser.add_argument("--place-latency", type=float, default=0.0, help="下单接口耗时 s")
+    return parser.parse_args()
+
+
+def build_order(i: int) -> TradeOrderDto:
+    order = TradeOrderDto()
+    order.trade_env = TrdEnv.REAL
+    order.trade_market = TrdMarket.HK
+    order.account_name = "bench"
+    order.order_id = ""
+    order.trade_side = TrdSide.BUY if i % 2 == 0 else TrdSide.SELL
+    order.order_status = TradeOrderStatus.INITIALIZED
+    order.stock_code = f"HK.{i % 50:05d}"
+    order.stock_holding_id = f"bench_{i}"
+    order.quantity = 100
+    order.price = 300.0
+    order.total_amount = order.quantity * order.price
+    order.ext_detail = {}
+    return order
+
+
+def main():
+    args = parse_args()
+    acc_dto = TradeAccountDto()
+    acc_dto.trade_env = TrdEnv.REAL
+    acc_dto.trade_market = TrdMarket.HK
+    acc_dto.account_name = "bench"
+    acc_dto.trade_pwd = "123456"
+    fake_ctx = FakeSecTradeContext(ack_latency=args.ack_latency, fill_latency=args.fill_latency,
+                                   partial_fills=args.partial_fills, reject_ratio=args.reject_ratio,
+                                   place_latency=args.place_latency)
+    trader = FutuTrader(acc_dto, trade_ctx_factory=lambda: fake_ctx, order_rate_limit=(args.orders, 1))
+    final_counts = {TradeOrderStatus.ALL_TRADED: 0, TradeOrderStatus.CANCELLED: 0, TradeOrderStatus.PART_CANCELLED: 0}
+    event_count = [0]
+    all_done = threading.Event()
+    lock = threading.Lock()
+
+    def on_order_status(order: TradeOrderDto):
+        with lock:
+            event_count[0] += 1
+            if order.order_status in final_counts:
+                final_counts[order.order_status] += 1
+                if sum(final_counts.values()) >= args.orders:
+                    all_done.set()
+
+    trader.set_order_listener(on_order_status)
+    trader.start()
+    registry = get_latency_registry()
+    registry.reset()
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        for i in range(args.orders):
+            order = build_order(i)
+            executor.submit(trader.open_position if order.trade_side == TrdSide.BUY else trader.close_position, order)
+    submit_cost = time.perf_counter() - start_time
+    all_done.wait(timeout=60 + args.orders * args.fill_latency)
+    total_cost = time.perf_counter() - start_time
+    trader.close()
+    print(f"订单数： {args.orders} 解锁次数： {fake_ctx.unlock_count} 状态事件： {event_count[0]}"
+          f" 成交： {final_counts[TradeOrderStatus.ALL_TRADED]} 撤单/失败： {final_counts[TradeOrderStatus.CANCELLED]}"
+          f" 部分成交后撤单： {final_counts[TradeOrderStatus.PART_CANCELLED]}")
+    print(f"下单耗时： {round(submit_cost, 3)}s 下单吞吐： {round(args.orders / submit_cost, 1)}/s"
+          f" 全部完成耗时： {round(total_cost, 3)}s")
+    print(registry.dump("futu_trader"))
+
+
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,13 @@ ACCOUNT_INIT_BALANCE = 200000
 
 MOCK_START_DATE = "2024-10-10"
 MOCK_END_DATE = "2024-10-21"
+# 本地K线列式存储目录
+KLINE_STORE_DIR = "kline_store"
+# 状态后端： memory 纯内存（结束时快照到 SQLite） / mysql
+BACKEND_TYPE = "memory"
+MEMORY_SNAPSHOT_PATH = "kline_mock_trade.sqlite"
+# 内存K线缓存保留天数（交易引擎使用360天窗口）
+KLINE_CACHE_KEEP_DAYS = 361
 
 
 def prepare_mock_context():
@@ -33,8 +40,11 @@ def prepare_mock_context():
         "kline_mock_env", TrdMarket.HK,
         account_name, db_config={
             "user": "jk_dev",
-            "password": "jk_dev"
-        }
+            "password": "jk_dev",
+            "snapshot_path": MEMORY_SNAPSHOT_PATH
+        },
+        kline_store_dir=KLINE_STORE_DIR,
+        backend_type=BACKEND_TYPE
     )
 
 
@@ -66,15 +76,19 @@ def prepare_kline_lib(stock_manager):
     lib = StockKLineLib(
         stock_manager.stock_code,
         ctx.backend().stock_k_line_repo(stock_manager.stock_code),
-        ctx.futu_sdk()
-        # , force_sync_from_futu=True
+        ctx.futu_sdk(),
+        # force_sync_from_futu=True,
+        column_store=ctx.kline_column_store(stock_manager.stock_code),
+        cache_keep_days=KLINE_CACHE_KEEP_DAYS,
+        # 内存后端时覆盖索引与本地列式存储一起保存，避免每次运行重新下载全部历史
+        coverage_repo=ctx.kline_coverage_repo(stock_manager.stock_code)
     )
     return lib
 
 
 def prepare_trader(stock_manager):
     from jtrade.core.trader import KLineMockTrader
-    trader = KLineMockTrader(stock_manager)
+    trader = KLineMockTrader(stock_manager, print_positions=True)
     return trader
 
 
@@ -196,9 +210,11 @@ def mock_trade():
             "cur_price": row_dict["close"]
         }
         last_price = row_dict["close"]
+        # 先用本根K线撮合之前的挂单，再按收盘价下单，新订单只与之后的K线撮合
+        trader.on_kline_update(row_dict["time_key"], last_price, high=row_dict["high"], low=row_dict["low"])
         trade_engine.on_rt_data(cur_data)
-        trader.on_kline_update(row_dict["time_key"], last_price)
     output_mock_report(start_mock_date, end_mock_date, last_price, account, stock_manager)
+    get_context().backend().close()
     plot_account_trade(start_mock_date, end_mock_date, stock_manager, kline_lib)
 
 
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+@file: kline_prefetch
+@author: jkguo
+@create: 2024/10/23
+"""
+import sys
+import argparse
+
+sys.path.append("..")
+from futu import TrdMarket
+from jtrade.core.trade_context import init_context, get_context
+from jtrade.core.kline_prefetcher import KLinePrefetcher
+from jtrade.utils import log_util
+
+# 本地K线列式存储目录
+KLINE_STORE_DIR = "kline_store"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="批量预取股票历史K线")
+    parser.add_argument("--codes", nargs="*", default=[], help="股票代码，如 HK.00700 HK.02628")
+    parser.add_argument("--codes-file", default=None, help="股票代码文件，每行一个")
+    parser.add_argument("--begin", required=True, help="开始日期 yyyy-mm-dd")
+    parser.add_argument("--end", required=True, help="结束日期 yyyy-mm-dd")
+    parser.add_argument("--time-unit", type=int, default=1, help="K线时间单位 min")
+    parser.add_argument("--workers", type=int, default=4, help="并发线程数")
+    parser.add_argument("--chunk-days", type=int, default=30, help="每个请求块的天数")
+    parser.add_argument("--db-user", default="jk_dev")
+    parser.add_argument("--db-password", default="jk_dev")
+    return parser.parse_args()
+
+
+def load_codes(args) -> list:
+    codes = list(args.codes)
+    if args.codes_file is not None:
+        with open(args.codes_file, "r") as fp:
+            codes.extend(line.strip() for line in fp if line.strip() != "")
+    return codes
+
+
+def main():
+    args = parse_args()
+    log_util.set_stdout_logger(logger="kline_prefetcher")
+    init_context(
+        "kline_prefetch", TrdMarket.HK, "", db_config={
+            "user": args.db_user,
+            "password": args.db_password
+        },
+        kline_store_dir=KLINE_STORE_DIR,
+        futu_config={
+            "pool_size": args.workers
+        }
+    )
+    ctx = get_context()
+    prefetcher = KLinePrefetcher(ctx.futu_sdk(), ctx.backend(), column_store_factory=ctx.kline_column_store,
+                                 time_unit=args.time_unit, max_workers=args.workers, chunk_days=args.chunk_days)
+    report = prefetcher.prefetch(load_codes(args), args.begin, args.end)
+    print(f"预取股票数： {report['stocks']} 请求块数： {report['chunks']} K线数： {report['rows']}"
+          f" 耗时： {report['cost']}s")
+    if len(report["skipped"]) > 0:
+        print(f"额度不足跳过： {report['skipped']}")
+    for code, b, e, err in report["failed"]:
+        print(f"失败： {code} {b} ~ {e} {err}")
+    ctx.futu_sdk().close()
+
+
+if __name__ == '__main__':
+    main()